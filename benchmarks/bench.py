@@ -0,0 +1,355 @@
+"""
+boogaPlus benchmark harness.
+
+Measures how the render, navigation and persistence paths scale with chat length and swipe count, using synthetic chats
+and stub text-generation-webui modules, so it runs from a plain checkout without TGWUI installed:
+
+    python benchmarks/bench.py --turns 10,100,1000,5000 --swipes 1,20,200 --text-size 300 --output bench.json
+    python benchmarks/bench.py --compare bench.json   # compare against a previous run (e.g. from another commit)
+
+For every (turns, swipes, text size) scenario and operation it reports latency percentiles, peak traced allocations
+(tracemalloc, measured in a separate pass so it doesn't skew the timings) and bytes written to disk per operation.
+"""
+
+from typing import Callable, Dict, List, Optional
+from pathlib import Path
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+ROOT = Path(__file__).resolve().parent.parent
+STREAM_CHUNK_WORDS = 4  # Words per streamed chunk of the stub text generation
+BATCH_SWIPES = 5        # Replies generated by the regenerate/generate_swipes operations
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+def install_stubs(history_dir: Path):
+    """Install minimal stand-ins for the TGWUI modules boogaPlus patches, then import the extension"""
+    def get_history_file_path(unique_id, character, mode):
+        if mode == 'instruct':
+            return history_dir / 'instruct' / f'{unique_id}.json'
+        return history_dir / 'chat' / character / f'{unique_id}.json'
+
+    def convert_to_markdown_wrapped(text, use_cache=False):
+        return '\n'.join(f'<p>{paragraph}</p>' for paragraph in text.split('\n\n')) if text else ''
+
+    def chat_html_wrapper(history, name1, name2, mode, style, character, unique_id, reset_cache=False):
+        if style == 'wpp':
+            return html_generator.generate_chat_html(history['visible'], name1, name2, reset_cache)
+        return html_generator.generate_cai_chat_html(history['visible'], name1, name2, style, character, unique_id, reset_cache)
+
+    replies = itertools.count()
+    def generate_chat_reply(text, state, regenerate=False, _continue=False, loading_message=True, for_ui=False):
+        """Streams state['canned_reply'] (numbered, so every reply is distinct) in chunks of STREAM_CHUNK_WORDS words"""
+        history = state['history']
+        if not regenerate and not _continue:
+            history['internal'].append([text, ''])
+            history['visible'].append([text, ''])
+        words = f"{next(replies)} {state['canned_reply']}".split(' ')
+        for end in range(STREAM_CHUNK_WORDS, len(words) + STREAM_CHUNK_WORDS, STREAM_CHUNK_WORDS):
+            history['internal'][-1][1] = history['visible'][-1][1] = ' '.join(words[:end])
+            yield history
+
+    def generate_chat_reply_wrapper(text, state, regenerate=False, _continue=False):
+        for history in generate_chat_reply(text, state, regenerate, _continue, for_ui=True):
+            yield chat_html_wrapper(history, state['name1'], state['name2'], state['mode'], state['chat_style'], state['character_menu'], state['unique_id']), history
+
+    def delete_file(path):
+        if path.exists():
+            path.unlink()
+
+    noop = lambda *args, **kwargs: None
+    _module('modules', __path__=[])
+    _module('modules.shared', args=types.SimpleNamespace(multi_user=False), persistent_interface_state={'mode': 'chat'}, gradio={})
+    html_generator = _module(
+        'modules.html_generator',
+        chat_styles={'cai-chat': '.message { padding: 1em; }\n' * 200, 'wpp': '.message { margin: 1em; }\n' * 200},
+        convert_to_markdown_wrapped=convert_to_markdown_wrapped,
+        chat_html_wrapper=chat_html_wrapper,
+        generate_cai_chat_html=noop,
+        generate_chat_html=noop,
+    )
+    _module(
+        'modules.chat',
+        get_history_file_path=get_history_file_path,
+        chat_html_wrapper=chat_html_wrapper,
+        redraw_html=chat_html_wrapper,
+        generate_chat_reply_wrapper=generate_chat_reply_wrapper,
+        generate_chat_reply=generate_chat_reply,
+        character_is_loaded=lambda *args, **kwargs: True,
+        remove_last_message=noop,
+        send_dummy_message=noop,
+        send_dummy_reply=noop,
+        save_history=noop,
+        delete_file=delete_file,
+        handle_delete_chat_confirm_click=noop,
+        replace_last_reply=noop,
+        rename_history=noop,
+    )
+    _module('modules.extensions', apply_extensions=noop)
+    _module('modules.utils', gradio=lambda *keys: list(keys))
+    for name in ('gradio', 'fastapi'):
+        if importlib.util.find_spec(name) is None:
+            _module(name, FastAPI=object, update=lambda **kwargs: kwargs)
+
+    # Import the checkout as `extensions.boogaplus`, the way TGWUI does
+    _module('extensions', __path__=[])
+    _module('extensions.boogaplus', __path__=[str(ROOT)])
+    import extensions.boogaplus.script as script
+    return script
+
+"""Synthetic chats"""
+WORDS = "the of and to in a is that for it as was with be by on not he this are or his from at which but have an they you were her she there had been one all their".split()
+
+def make_text(rng: random.Random, size: int) -> str:
+    target = max(1, int(size * rng.uniform(0.5, 1.5)))
+    words = []
+    length = 0
+    while length < target:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+def make_chat(rng: random.Random, turns: int, swipes: int, text_size: int):
+    """Build a history and a matching swipe cache with `swipes` alternatives for every bot message"""
+    history = {'internal': [], 'visible': []}
+    history_cache = {'visible': [], 'internal': []}
+    for i in range(turns):
+        user = make_text(rng, text_size // 3)
+        bot_swipes = [make_text(rng, text_size) for _ in range(swipes)]
+        pos = rng.randrange(swipes)
+        history['internal'].append([user, bot_swipes[pos]])
+        history['visible'].append([user, bot_swipes[pos]])
+        for cache_type in ['visible', 'internal']:
+            history_cache[cache_type].append([
+                {'text': [user], 'pos': 0},
+                {'text': list(bot_swipes), 'pos': pos},
+            ])
+    return history, history_cache
+
+"""Measurement"""
+class ByteCounter:
+    """Counts bytes written through the store's write functions (files: journal/snapshot bytes, sqlite: text bytes)"""
+    def __init__(self, store):
+        self.bytes = 0
+        append_events, write_snapshot = store.append_events, store.write_snapshot
+        def counted_append_events(location, events):
+            written = append_events(location, events)
+            self.bytes += written
+            return written
+        def counted_write_snapshot(location, packed):
+            written = write_snapshot(location, packed)
+            self.bytes += written
+            return written
+        store.append_events = counted_append_events
+        store.write_snapshot = counted_write_snapshot
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def measure(op: Callable[[], None], repeat: int, counter: ByteCounter, flush: Callable[[], None], setup: Optional[Callable[[], None]] = None) -> Dict:
+    timings = []
+    written = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        flush()
+        before = counter.bytes
+        start = time.perf_counter()
+        op()
+        timings.append(time.perf_counter() - start)
+        flush()  # Count what the background writer persists for this operation
+        written.append(counter.bytes - before)
+
+    # Allocation pass (tracemalloc slows everything down, so it is kept apart from the timings)
+    peaks = []
+    for _ in range(min(repeat, 5)):
+        if setup:
+            setup()
+        tracemalloc.start()
+        op()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        flush()
+
+    return {
+        'n': repeat,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p90_ms': percentile(timings, 0.90) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'max_ms': max(timings) * 1000,
+        'alloc_peak_bytes': max(peaks),
+        'bytes_written': sum(written) / len(written),
+    }
+
+def run_scenario(script, rng: random.Random, turns: int, swipes: int, text_size: int, repeat: int, counter: ByteCounter) -> Dict[str, Dict]:
+    cache = script.cache
+    journal = sys.modules['extensions.boogaplus.utils.journal']
+    html_generator = sys.modules['modules.html_generator']
+    writer = script.writer
+    fragments = script.fragments
+
+    unique_id = f'bench-{turns}-{swipes}-{text_size}'
+    state = {
+        'history': None, 'name1': 'You', 'name2': 'Bot', 'mode': 'chat', 'chat_style': 'cai-chat',
+        'character_menu': 'Bench', 'unique_id': unique_id,
+        'canned_reply': make_text(rng, text_size),  # Streamed by the stub generate_chat_reply
+    }
+    history, history_cache = make_chat(rng, turns, swipes, text_size)
+    state['history'] = history
+
+    # Persist the synthetic cache as a snapshot, the way it would be found on disk
+    path = cache.get_cache_location(unique_id, state['character_menu'], state['mode'])
+    cache.store.delete(path)
+    cache.store.write_snapshot(path, journal.pack_snapshot(history_cache))
+    key = cache.get_cache_key(state)
+
+    def evict():
+        writer.flush()
+        with cache._registry_lock:
+            cache._registry.pop(key, None)
+
+    results = {}
+    results['update_cache (cold load)'] = measure(lambda: cache.update_cache(state), repeat, counter, writer.flush, setup=evict)
+    cache.update_cache(state)
+
+    visible = history['visible']
+    render_args = (visible, state['name1'], state['name2'], 'cai-chat', state['character_menu'], unique_id)
+    results['generate_cai_chat_html (cold)'] = measure(lambda: html_generator.generate_cai_chat_html(*render_args), repeat, counter, writer.flush, setup=fragments.clear)
+    results['generate_cai_chat_html (warm)'] = measure(lambda: html_generator.generate_cai_chat_html(*render_args), repeat, counter, writer.flush)
+    results['generate_chat_html (warm)'] = measure(lambda: html_generator.generate_chat_html(visible, state['name1'], state['name2']), repeat, counter, writer.flush)
+
+    def stream_chunk():
+        visible[-1][1] += ' token'
+        html_generator.generate_cai_chat_html(*render_args)
+    script.start_streaming()
+    try:
+        html_generator.generate_cai_chat_html(*render_args)
+        results['generate_cai_chat_html (streaming chunk)'] = measure(stream_chunk, repeat, counter, writer.flush)
+    finally:
+        script.stop_streaming()
+
+    directions = ['left', 'right']
+    def nav_args():
+        i = rng.randrange(turns)
+        return (i, 1, rng.choice(directions), history, state['name1'], state['name2'], state['mode'], state['chat_style'], state['character_menu'], unique_id)
+    loop = asyncio.new_event_loop()
+    results['navigate_message'] = measure(lambda: loop.run_until_complete(script.navigate_message(*nav_args())), repeat, counter, writer.flush)
+    loop.close()
+    def navigate_unqueued():  # The jump and render alone, without the event loop and coalescing around them
+        i, msg_type, direction, *args = nav_args()
+        script._navigate_message(i, msg_type, *script.parse_direction(direction), *args)
+    results['_navigate_message'] = measure(navigate_unqueued, repeat, counter, writer.flush)
+
+    def append():
+        history['internal'][-1][1] = history['visible'][-1][1] = make_text(rng, text_size)
+        cache.append_to_cache(history, state, is_bot=True)
+    results['append_to_cache'] = measure(append, repeat, counter, writer.flush)
+
+    def regenerate():
+        for _ in range(BATCH_SWIPES):
+            for _ in script.generate_chat_reply_wrapper('', state, regenerate=True):
+                pass
+    results[f'regenerate x{BATCH_SWIPES} (streamed)'] = measure(regenerate, repeat, counter, writer.flush)
+    results[f'generate_swipes ({BATCH_SWIPES})'] = measure(lambda: script.generate_swipes(BATCH_SWIPES, state), repeat, counter, writer.flush)
+
+    chat_cache = cache.update_cache(state)
+    def force_save():
+        chat_cache.journal_length = max(chat_cache.journal_length, 1)
+        chat_cache.save(flush=True)
+    results['save_cache (snapshot)'] = measure(force_save, repeat, counter, writer.flush)
+
+    evict()
+    cache.store.delete(path)
+    return results
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def print_results(report: Dict, baseline: Optional[Dict] = None):
+    baseline_results = {}
+    if baseline:
+        for scenario in baseline['scenarios']:
+            for op, result in scenario['results'].items():
+                baseline_results[(scenario['turns'], scenario['swipes'], scenario['text_size'], op)] = result
+    for scenario in report['scenarios']:
+        print(f"\n== turns={scenario['turns']} swipes={scenario['swipes']} text_size={scenario['text_size']} ==")
+        print(f"{'operation':<42}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'peak KiB':>11}{'written B':>12}{'vs base':>9}")
+        for op, result in scenario['results'].items():
+            base = baseline_results.get((scenario['turns'], scenario['swipes'], scenario['text_size'], op))
+            ratio = f"{result['p50_ms'] / base['p50_ms']:.2f}x" if base and base['p50_ms'] else ''
+            print(f"{op:<42}{result['p50_ms']:>10.3f}{result['p90_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['alloc_peak_bytes'] / 1024:>11.1f}{result['bytes_written']:>12.0f}{ratio:>9}")
+
+def parse_ints(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=parse_ints, default=[10, 100, 1000], help="comma-separated chat lengths")
+    parser.add_argument('--swipes', type=parse_ints, default=[1, 20], help="comma-separated swipes per bot message")
+    parser.add_argument('--text-size', type=parse_ints, default=[300], help="comma-separated average bot message sizes (chars)")
+    parser.add_argument('--repeat', type=int, default=20, help="iterations per operation")
+    parser.add_argument('--compression', default='none', choices=['none', 'zlib', 'zstd'], help="snapshot compression")
+    parser.add_argument('--backend', default='files', choices=['files', 'sqlite'], help="cache storage backend")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help="write results as JSON")
+    parser.add_argument('--compare', type=Path, help="JSON results of a previous run to compare p50 latencies against")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='boogaplus-bench-'))
+    try:
+        script = install_stubs(workdir)
+        script.writer.configure(debounce=3600, max_pending=10**9)  # Only explicit flushes, so writes are attributable
+        script.cache.configure(max_chats=4, max_bytes=2**40, backend=args.backend)
+        sys.modules['extensions.boogaplus.utils.snapshot'].configure(compression=args.compression)
+        counter = ByteCounter(script.cache.store)
+        rng = random.Random(args.seed)
+
+        report = {
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'args': {'repeat': args.repeat, 'compression': args.compression, 'backend': args.backend, 'seed': args.seed},
+            'scenarios': [],
+        }
+        for turns in args.turns:
+            for swipes in args.swipes:
+                for text_size in args.text_size:
+                    print(f"Running turns={turns} swipes={swipes} text_size={text_size}...", file=sys.stderr)
+                    results = run_scenario(script, rng, turns, swipes, text_size, args.repeat, counter)
+                    report['scenarios'].append({'turns': turns, 'swipes': swipes, 'text_size': text_size, 'results': results})
+
+        baseline = json.loads(args.compare.read_text(encoding='utf-8')) if args.compare else None
+        print_results(report, baseline)
+        if args.output:
+            args.output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+            print(f"\nWrote {args.output}", file=sys.stderr)
+        script.writer.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
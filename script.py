@@ -1,17 +1,29 @@
 from calendar import c
 from hmac import new
-from typing import Dict, List, Optional, Coroutine, Iterable
+from typing import Callable, Dict, List, Optional, Coroutine
+from collections import OrderedDict
 from html import escape, unescape
 from pathlib import Path
 import traceback
+import hashlib
 import json
 import asyncio
 import threading
 import logging as logger
-from functools import reduce
-from operator import getitem
 
 import extensions.boogaplus.utils.cache as cache
+import extensions.boogaplus.utils.prefetch as prefetch
+import extensions.boogaplus.utils.retention as retention
+import extensions.boogaplus.utils.collector as collector
+import extensions.boogaplus.utils.assets as assets
+import extensions.boogaplus.utils.search as search
+import extensions.boogaplus.utils.archive as archive
+import extensions.boogaplus.utils.snapshot as snapshot
+import extensions.boogaplus.utils.journal as journal
+from extensions.boogaplus.utils.writer import writer
+from extensions.boogaplus.utils.fragments import fragments
+from extensions.boogaplus.utils.nav import NavTable
+import extensions.boogaplus.utils.metrics as metrics
 
 from modules import shared
 from fastapi import FastAPI
@@ -29,33 +41,43 @@ _BOLD = "\033[1;37m"
 _RESET = "\033[0m"
 
 params = {
-    'display_name': 'boogaPlus'
+    'display_name': 'boogaPlus',
+    'save_debounce': 2.0,   # seconds to coalesce cache writes for before flushing
+    'save_max_pending': 32, # flush early once this many cache mutations are pending
+    'cache_max_chats': 16,  # chat caches kept loaded in memory
+    'cache_max_mb': 64,     # approximate memory budget for loaded chat caches
+    'fragment_cache_mb': 8, # approximate memory budget for rendered chat rows
+    'cache_compression': 'none',  # snapshot compression: 'none', 'zlib' or 'zstd'
+    'cache_backend': 'files',  # 'files' (a .json.cache per chat) or 'sqlite' (logs/boogaplus.sqlite3, existing caches are imported once)
+    'prefetch_chats': 8,    # recently used chat caches loaded in the background at startup (0 to disable)
+    'prefetch_mb': 32,      # approximate memory budget for the startup warm-up
+    'prefetch_workers': 4,  # threads loading caches in the background
+    'retention_max_swipes': 0,  # swipes kept per message, the selected one always included (0 = unlimited)
+    'retention_max_mb': 0,      # approximate size of a chat's swipes before the oldest are pruned (0 = unlimited)
+    'retention_max_days': 0,    # age after which unselected swipes are pruned (0 = unlimited)
+    'gc_interval_hours': 24,    # how often orphaned caches are removed and retention is applied to every chat (0 = only from the Storage panel)
+    'archive_workers': 4,       # chat directories exported, or chats imported, concurrently by the Storage panel's archive tools
+    'render_window': 0,         # rows rendered at the end of a chat, older rows are loaded while scrolling up (0 = render every row)
+    'search_index': True,       # index every swipe for the Search panel and /boogaplus/api/search (logs/boogaplus-index.sqlite3)
+    'metrics': False  # collect hot-path latencies and counters (see the Metrics panel and /boogaplus/metrics)
 }
 
-def recursive_get(data: Dict | Iterable, keyList: List[int | str], default=None):
-    """Iterate nested dictionary / iterable."""
-    try:
-        return reduce(getitem, keyList, data)
-    except KeyError:
-        return default
-    except IndexError:
-        return default
-    except TypeError:
-        return default
-    except Exception as e:
-        print(f"{_ERROR}Error getting value:{_RESET} {e}")
-        traceback.print_exc()
-        return None
-def length(data: Iterable):
-    """Get length of iterable with try catch."""
-    try:
-        return len(data)
-    except TypeError:
-        return 0
-    except Exception as e:
-        print(f"{_ERROR}Error getting length:{_RESET} {e}")
-        traceback.print_exc()
-        return 0
+def setup():
+    """Apply persistence and cache settings (after TGWUI has loaded settings.yaml overrides into params)"""
+    writer.configure(debounce=params['save_debounce'], max_pending=params['save_max_pending'])
+    cache.configure(max_chats=params['cache_max_chats'], max_bytes=params['cache_max_mb'] * 1024 * 1024, backend=params['cache_backend'])
+    fragments.configure(max_bytes=params['fragment_cache_mb'] * 1024 * 1024)
+    snapshot.configure(compression=params['cache_compression'])
+    metrics.configure(enabled=params['metrics'])
+    prefetch.configure(max_chats=params['prefetch_chats'], max_bytes=params['prefetch_mb'] * 1024 * 1024, workers=params['prefetch_workers'])
+    prefetch.warm_up()
+    retention.configure(max_swipes=params['retention_max_swipes'], max_bytes=params['retention_max_mb'] * 1024 * 1024, max_age=params['retention_max_days'] * 24 * 3600)
+    collector.configure(interval=params['gc_interval_hours'] * 3600)
+    collector.start()
+    archive.configure(workers=params['archive_workers'])
+    configure_window(rows=params['render_window'])
+    if search.configure(enabled=params['search_index']):
+        search.index_all()
 
 # input_modifier()
 # output_modifier()
@@ -64,18 +86,60 @@ def length(data: Iterable):
 def ui():
     """Create custom gradio elements"""
     from modules.utils import gradio
+    import modules.ui as ui
     
     with gr.Tab(visible=True, label="boogaPlus", elem_id="bgpl_tab") as bgpl_row:
         with gr.Row(visible=False, elem_id="bgpl_info_row"):
             shared.gradio['bgpl_startup'] = gr.Button(elem_id="bgpl_startup")                       # chat startup handler
-            shared.gradio['bgpl_navigate'] = gr.Button(value="", elem_id="bgpl_navigate")           # navigate() handler
+            shared.gradio['bgpl_navigate'] = gr.Button(value="", elem_id="bgpl_navigate")           # navigate_message() handler
             
             shared.gradio['bgpl_history_index'] = gr.Number(value=0, elem_id="bgpl_history_index")  # selected message location in history
             shared.gradio['bgpl_message_type'] = gr.Number(value=0, elem_id="bgpl_message_type")    # selected message type (0 = user, 1 = bot)
-            shared.gradio['bgpl_direction'] = gr.Textbox(value="", elem_id="bgpl_direction")        # selected direction input ('left', 'right')
+            shared.gradio['bgpl_direction'] = gr.Textbox(value="", elem_id="bgpl_direction")        # navigation input ('left', 'right', '+n', '-n' or '=pos')
+            shared.gradio['bgpl_nav_result'] = gr.Textbox(value="", elem_id="bgpl_nav_result")      # navigate_message() JSON result
+            
+            shared.gradio['bgpl_list_swipes'] = gr.Button(value="", elem_id="bgpl_list_swipes")     # list_swipes() handler
+            shared.gradio['bgpl_swipe_offset'] = gr.Number(value=0, elem_id="bgpl_swipe_offset")    # first position of the requested page
+            shared.gradio['bgpl_swipes_result'] = gr.Textbox(value="", elem_id="bgpl_swipes_result")  # list_swipes() JSON result
+            
+            shared.gradio['bgpl_prefetch'] = gr.Button(value="", elem_id="bgpl_prefetch")            # prefetch_chats() handler
+            shared.gradio['bgpl_prefetch_targets'] = gr.Textbox(value="", elem_id="bgpl_prefetch_targets")  # JSON list of chats to prefetch
             
         with gr.Row(visible=True, elem_id="bgpl_display_row"):
             shared.gradio['bgpl_display_mode'] = gr.Radio(choices=['html', 'overlay (disabled)', 'off'], value='html', label="", elem_classes=['slim-dropdown'], interactive=True, elem_id="bgpl_display_mode")
+        
+        with gr.Row(visible=True, elem_id="bgpl_generate_row"):
+            shared.gradio['bgpl_swipe_count'] = gr.Number(value=5, precision=0, minimum=1, maximum=MAX_BATCH_SWIPES, label="Swipes", elem_id="bgpl_swipe_count")
+            shared.gradio['bgpl_generate_swipes'] = gr.Button(value="Generate swipes for the last reply", elem_id="bgpl_generate_swipes")
+        
+        with gr.Accordion("Metrics", open=False, elem_id="bgpl_metrics_row"):
+            with gr.Row():
+                shared.gradio['bgpl_metrics_enabled'] = gr.Checkbox(value=params['metrics'], label="Collect metrics", elem_id="bgpl_metrics_enabled")
+                shared.gradio['bgpl_metrics_refresh'] = gr.Button(value="Refresh", elem_classes=['refresh-button'], elem_id="bgpl_metrics_refresh")
+                shared.gradio['bgpl_metrics_reset'] = gr.Button(value="Reset", elem_classes=['refresh-button'], elem_id="bgpl_metrics_reset")
+            shared.gradio['bgpl_metrics'] = gr.JSON(value=None, label="", elem_id="bgpl_metrics")
+        
+        with gr.Accordion("Search", open=False, elem_id="bgpl_search_row"):
+            with gr.Row():
+                shared.gradio['bgpl_search_query'] = gr.Textbox(value="", label="Find swipes containing", elem_id="bgpl_search_query")
+                shared.gradio['bgpl_search_character'] = gr.Checkbox(value=False, label="Current character only", elem_id="bgpl_search_character")
+                shared.gradio['bgpl_search'] = gr.Button(value="Search", elem_id="bgpl_search")
+            shared.gradio['bgpl_search_results'] = gr.JSON(value=None, label="", elem_id="bgpl_search_results")
+            with gr.Row():
+                shared.gradio['bgpl_search_hit'] = gr.Number(value=0, precision=0, label="Result #", elem_id="bgpl_search_hit")
+                shared.gradio['bgpl_search_jump'] = gr.Button(value="Jump to result", elem_id="bgpl_search_jump")
+            shared.gradio['bgpl_search_status'] = gr.Markdown(value="", elem_id="bgpl_search_status")
+        
+        with gr.Accordion("Storage", open=False, elem_id="bgpl_storage_row"):
+            shared.gradio['bgpl_gc'] = gr.Button(value="Remove orphaned caches and apply retention", elem_id="bgpl_gc")
+            shared.gradio['bgpl_gc_report'] = gr.JSON(value=None, label="", elem_id="bgpl_gc_report")
+            with gr.Row():
+                shared.gradio['bgpl_archive_path'] = gr.Textbox(value="", label="Archive (JSONL, .gz to compress; empty = logs/boogaplus-export.jsonl.gz)", elem_id="bgpl_archive_path")
+                shared.gradio['bgpl_archive_replace'] = gr.Checkbox(value=False, label="Replace existing caches on import", elem_id="bgpl_archive_replace")
+            with gr.Row():
+                shared.gradio['bgpl_export'] = gr.Button(value="Export every cache", elem_id="bgpl_export")
+                shared.gradio['bgpl_import'] = gr.Button(value="Import", elem_id="bgpl_import")
+            shared.gradio['bgpl_archive_report'] = gr.JSON(value=None, label="", elem_id="bgpl_archive_report")
     
     # Startup event
     shared.gradio['bgpl_startup'].click(
@@ -83,13 +147,13 @@ def ui():
         inputs=gradio('history', 'name1', 'name2', 'mode', 'chat_style', 'character_menu', 'unique_id'),
         outputs=gradio('display'),  # TGWUI display
         show_progress=False
-    ).then(
-        fn=None,
-        inputs=None,
-        outputs=None,
-        js="""async () => {
-            document.querySelector('#bgpl_navigate').dispatchEvent(new Event('change', { bubbles: true }));
-        }""",
+    )
+    
+    shared.gradio['bgpl_generate_swipes'].click(
+        ui.gather_interface_values, gradio(shared.input_elements), gradio('interface_state')).then(
+        fn=generate_swipes,
+        inputs=gradio('bgpl_swipe_count', 'interface_state'),
+        outputs=gradio('display', 'history'),
         show_progress=False
     )
     
@@ -103,9 +167,9 @@ def ui():
         show_progress=False
     )
     
-    # Navigate through positions
+    # Navigate through positions (only the changed message is sent back and patched in place)
     shared.gradio['bgpl_navigate'].click(
-        fn=navigate,
+        fn=navigate_message,
         inputs=gradio(
             'bgpl_history_index',
             'bgpl_message_type',
@@ -114,20 +178,174 @@ def ui():
         ),
         outputs=gradio(
             'display', 'history',  # TGWUI display and history
+            'bgpl_nav_result',
         ),
-        show_progress='full'
+        show_progress=False,
+        concurrency_limit=None  # Async and coalesced per message (see navigate_message), so it doesn't hold up the queue
     ).then(
         fn=None,
-        inputs=None,
+        inputs=gradio('bgpl_nav_result'),
         outputs=None,
-        js="""async () => {
-            document.querySelector('#bgpl_navigate').dispatchEvent(new Event('change', { bubbles: true }));
+        js="""async (result) => {
+            applyNavigationResult(result);
+            navigationDone();
         }""",
-        show_progress='full'
+        show_progress=False
+    )
+
+    # List swipe summaries for the swipe picker (jumping to a picked swipe goes through bgpl_navigate with '=pos')
+    shared.gradio['bgpl_list_swipes'].click(
+        fn=list_swipes,
+        inputs=gradio('bgpl_history_index', 'bgpl_message_type', 'bgpl_swipe_offset', 'character_menu', 'unique_id', 'mode'),
+        outputs=gradio('bgpl_swipes_result'),
+        show_progress=False,
+        concurrency_limit=None
+    ).then(
+        fn=None,
+        inputs=gradio('bgpl_swipes_result'),
+        outputs=None,
+        js="""async (result) => { showSwipePicker(result); }""",
+        show_progress=False
+    )
+    
+    # Prefetch the caches of chats hovered or next to the selected one in the chat menus (returns immediately)
+    shared.gradio['bgpl_prefetch'].click(
+        fn=prefetch_chats,
+        inputs=gradio('bgpl_prefetch_targets', 'character_menu', 'mode'),
+        outputs=None,
+        show_progress=False,
+        concurrency_limit=None
+    )
+    
+    # Search panel
+    shared.gradio['bgpl_search'].click(
+        fn=search_swipes,
+        inputs=gradio('bgpl_search_query', 'bgpl_search_character', 'character_menu'),
+        outputs=gradio('bgpl_search_results'),
+        show_progress=False
+    )
+    shared.gradio['bgpl_search_query'].submit(
+        fn=search_swipes,
+        inputs=gradio('bgpl_search_query', 'bgpl_search_character', 'character_menu'),
+        outputs=gradio('bgpl_search_results'),
+        show_progress=False
+    )
+    shared.gradio['bgpl_search_jump'].click(
+        fn=jump_to_search_hit,
+        inputs=gradio(
+            'bgpl_search_hit', 'bgpl_search_results',
+            'history', 'name1', 'name2', 'mode', 'chat_style', 'character_menu', 'unique_id',
+        ),
+        outputs=gradio('display', 'history', 'bgpl_search_status'),
+        show_progress=False
+    )
+    
+    # Storage panel
+    shared.gradio['bgpl_gc'].click(
+        fn=collect_garbage,
+        inputs=None,
+        outputs=gradio('bgpl_gc_report'),
+        show_progress=False
+    )
+    shared.gradio['bgpl_export'].click(
+        fn=export_archive,
+        inputs=gradio('bgpl_archive_path'),
+        outputs=gradio('bgpl_archive_report'),
+        show_progress=False
+    )
+    shared.gradio['bgpl_import'].click(
+        fn=import_archive,
+        inputs=gradio('bgpl_archive_path', 'bgpl_archive_replace'),
+        outputs=gradio('bgpl_archive_report'),
+        show_progress=False
     )
+    
+    # Metrics panel
+    shared.gradio['bgpl_metrics_enabled'].change(
+        fn=set_metrics_enabled,
+        inputs=gradio('bgpl_metrics_enabled'),
+        outputs=gradio('bgpl_metrics'),
+        show_progress=False
+    )
+    shared.gradio['bgpl_metrics_refresh'].click(
+        fn=get_metrics,
+        inputs=None,
+        outputs=gradio('bgpl_metrics'),
+        show_progress=False
+    )
+    shared.gradio['bgpl_metrics_reset'].click(
+        fn=reset_metrics,
+        inputs=None,
+        outputs=gradio('bgpl_metrics'),
+        show_progress=False
+    )
+
+def collect_garbage() -> Dict:
+    try:
+        return collector.collect()
+    except Exception as e:
+        print(f"{_ERROR}Error collecting garbage: {e}{_RESET}")
+        traceback.print_exc()
+        return {'error': str(e)}
+
+def export_archive(path: str) -> Dict:
+    try:
+        return archive.export(Path(path.strip()) if path.strip() else None)
+    except Exception as e:
+        print(f"{_ERROR}Error exporting caches: {e}{_RESET}")
+        traceback.print_exc()
+        return {'error': str(e)}
+
+def import_archive(path: str, replace: bool) -> Dict:
+    try:
+        return archive.import_archive(Path(path.strip()) if path.strip() else None, replace=replace)
+    except Exception as e:
+        print(f"{_ERROR}Error importing caches: {e}{_RESET}")
+        traceback.print_exc()
+        return {'error': str(e)}
+
+def get_metric_gauges() -> Dict[str, float]:
+    """Current state of the caches, reported next to the collected metrics"""
+    stats = fragments.stats()
+    return {
+        'cached_chats': len(cache._registry),
+        'cached_chat_bytes': cache._registry_bytes,
+        'fragment_entries': stats['entries'],
+        'fragment_bytes': stats['bytes'],
+        'fragment_hits': stats['hits'],
+        'fragment_misses': stats['misses'],
+        'fragment_hit_rate': stats['hit_rate'],
+        'pending_writes': writer.pending(),
+    }
+
+def get_metrics() -> Dict:
+    return {**metrics.snapshot(), 'gauges': get_metric_gauges()}
+
+def set_metrics_enabled(enabled: bool) -> Dict:
+    params['metrics'] = enabled
+    metrics.configure(enabled=enabled)
+    return get_metrics()
+
+def reset_metrics() -> Dict:
+    metrics.reset()
+    return get_metrics()
 
 def startup(history: Dict, name1: str, name2: str, mode: str, chat_style: str, character: str, unique_id: str):
     """Chat history draw handler for boogaPlus startup."""
+    app = getattr(shared.gradio.get('interface'), 'app', None)
+    try:
+        if not _requires_login():
+            metrics.mount(app, gauges=get_metric_gauges)
+            assets.mount(app, chat_styles)
+        mount_api(app)
+    except Exception:
+        print(f"{_ERROR}Could not mount the boogaPlus endpoints:{_RESET}")
+        traceback.print_exc()
+    try:
+        cache.update_cache({'character_menu': character, 'unique_id': unique_id, 'mode': mode}).reconcile(history)
+    except Exception:
+        print(f"{_ERROR}Could not reconcile the cache with the history:{_RESET}")
+        traceback.print_exc()
     return chat.redraw_html(history, name1, name2, mode, chat_style, character, unique_id, reset_cache=True)
 
 def change_display_mode(display_mode: str, history: Dict, name1: str, name2: str, mode: str, chat_style: str, character: str, unique_id: str):
@@ -146,16 +364,108 @@ def change_display_mode(display_mode: str, history: Dict, name1: str, name2: str
     
     return chat.redraw_html(history, name1, name2, mode, chat_style, character, unique_id, reset_cache=True)
 
-def get_message_positions(i: int, msg_type: int):
-    """Recursively get cached message position and total message positions."""
-    msg_data = recursive_get(cache._history_cache, ['visible', i, msg_type])
-    return recursive_get(msg_data, ['pos'], 0), length(recursive_get(msg_data, ['text'], []))
+def parse_direction(direction: str):
+    """Parse a navigation request: 'left'/'right', a signed offset ('+3', '-2') or an absolute position ('=4').
+    Returns (absolute position or None, offset)."""
+    direction = str(direction).strip()
+    if direction == 'right':
+        return None, 1
+    if direction == 'left':
+        return None, -1
+    if direction.startswith('='):
+        return int(direction[1:]), 0
+    return None, int(direction or 0)
 
-def navigate(i: float, msg_type: float, direction: str, history: Dict, name1: str, name2: str, mode: str, chat_style: str, character: str, unique_id: str):
-    """Navigate left or right through message positions."""
-    try:
-        from modules.html_generator import chat_html_wrapper
+def _jump(state: Dict, i: int, msg_type: int, absolute: Optional[int] = None, offset: int = 0):
+    """Select position `absolute` + `offset` of (`i`, `msg_type`), or the current position + `offset` if `absolute` is None.
+    Relative jumps are clamped to the available positions, so a burst of presses stops at the first/last swipe.
+    The messages after it are switched to the branch that was generated under the new swipe (see utils/journal.py)."""
+    history = state['history']
+    
+    # Retrieve current position and total positions
+    chat_cache = cache.update_cache(state)
+    chat_cache.reconcile(history)  # No-op unless the cache was just loaded
+    with chat_cache.lock:
+        _history_cache = chat_cache.data
+        current_pos, total_pos = chat_cache.nav.get(i, msg_type)
+        if not total_pos:
+            return None, total_pos, False
+        
+        # Calculate new position and check if valid
+        if absolute is not None:
+            new_pos = absolute + offset
+            if not 0 <= new_pos < total_pos:
+                return None, total_pos, False
+        else:
+            new_pos = max(0, min(total_pos - 1, current_pos + offset))
+        if new_pos == current_pos:
+            return None, total_pos, False
+        
+        # Validate and initialize cache
+        cache.validate_cache(_history_cache, i)
+        cache.initialize_cache(_history_cache, i)
         
+        # Keep the branch under the current swipe, then get messages at new position
+        chat_cache.save_branch(history, i, msg_type)
+        chat_cache.set_position(i, msg_type, new_pos)
+        new_visible = _history_cache['visible'][i][msg_type]['text'][new_pos]
+        new_internal = _history_cache['internal'][i][msg_type]['text'][new_pos]
+        
+        # Update history
+        if new_visible and new_internal:
+            history['visible'][i][msg_type] = new_visible
+            history['internal'][i][msg_type] = new_internal
+        branched = chat_cache.restore_branch(history, i, msg_type)
+    
+    return new_pos, total_pos, branched
+
+"""Navigation requests not yet applied, per message. Concurrent requests for the same message are summed here and
+applied as a single jump by whichever request gets the message's lock first; the others return without changes.
+A message's lock only exists while a request holds or waits for it."""
+_nav_pending: Dict[tuple, List] = {}  # (character, unique_id, mode, i, msg_type) -> [absolute position or None, offset]
+_nav_locks: Dict[tuple, List] = {}    # (character, unique_id, mode, i, msg_type) -> [asyncio.Lock, requests using it]
+
+@metrics.timed('navigate_message')
+async def navigate_message(i: float, msg_type: float, direction: str, history: Dict, name1: str, name2: str, mode: str, chat_style: str, character: str, unique_id: str):
+    """Navigate through message positions, returning only the changed message.
+    The display is left untouched (patched client-side from the JSON result) unless the history shape changed.
+    Bursts of requests for the same message are coalesced into one jump; the work runs off the event loop."""
+    try:
+        i = int(i)
+        msg_type = int(msg_type)
+        absolute, offset = parse_direction(direction)
+    except (TypeError, ValueError):
+        print(f"{_ERROR}Invalid navigation request:{_RESET} {direction}")
+        return gr.update(), gr.update(), json.dumps({'redraw': False, 'body': None})
+    
+    key = (character, unique_id, cache._mode_key(mode), i, msg_type)
+    pending = _nav_pending.setdefault(key, [None, 0])
+    if absolute is not None:
+        pending[:] = [absolute, 0]
+    else:
+        pending[1] += offset
+    
+    lock = _nav_locks.setdefault(key, [asyncio.Lock(), 0])
+    lock[1] += 1
+    try:
+        async with lock[0]:
+            pending = _nav_pending.pop(key, None)
+            if pending is None:  # Already applied as part of an earlier request's jump
+                metrics.inc('navigations_coalesced')
+                return gr.update(), gr.update(), json.dumps({'redraw': False, 'index': i, 'type': msg_type, 'body': None})
+            return await asyncio.to_thread(_navigate_message, i, msg_type, pending[0], pending[1], history, name1, name2, mode, chat_style, character, unique_id)
+    finally:
+        lock[1] -= 1
+        if not lock[1]:
+            del _nav_locks[key]
+
+def _navigate_message(i: int, msg_type: int, absolute: Optional[int], offset: int, history: Dict, name1: str, name2: str, mode: str, chat_style: str, character: str, unique_id: str):
+    from modules.html_generator import chat_html_wrapper
+    
+    def redraw():
+        return chat_html_wrapper(history, name1, name2, mode, chat_style, character, unique_id), history, json.dumps({'redraw': True})
+    
+    try:
         state = {
             'history': history,
             'name1': name1,
@@ -166,50 +476,197 @@ def navigate(i: float, msg_type: float, direction: str, history: Dict, name1: st
             'unique_id': unique_id
         }
         
-        i = int(i)
-        msg_type = int(msg_type)
-        
-        # Retrieve current position and total positions
-        cache.update_cache(state)
-        current_pos, total_pos = get_message_positions(i, msg_type)
-        
-        if not total_pos:
-            return chat_html_wrapper(history, name1, name2, mode, chat_style, character, unique_id), history
+        if not 0 <= i < len(history['visible']):
+            return redraw()
         
-        # Calculate new position and check if valid
-        new_pos = current_pos
-        if direction == "right":
-            new_pos += 1
-            if new_pos >= total_pos:
-                return chat_html_wrapper(history, name1, name2, mode, chat_style, character, unique_id), history
-        elif direction == "left":
-            new_pos -= 1
-            if new_pos < 0:
-                return chat_html_wrapper(history, name1, name2, mode, chat_style, character, unique_id), history
+        old_visible = history['visible'][i][msg_type]
+        new_pos, total_pos, branched = _jump(state, i, msg_type, absolute, offset)
+        if new_pos is None:
+            return gr.update(), history, json.dumps({'redraw': False, 'index': i, 'type': msg_type, 'body': None})
         
-        # Validate and initialize cache
-        cache.validate_cache(i)
-        cache.initialize_cache(i)
-        _history_cache = cache._history_cache
+        new_visible = history['visible'][i][msg_type]
+        if branched or not old_visible or not new_visible:  # Other messages changed, or empty user messages aren't displayed
+            return redraw()
         
-        # Get messages at new position
-        visible_msg_cache = _history_cache['visible'][i][msg_type]
-        internal_msg_cache = _history_cache['internal'][i][msg_type]
-        visible_msg_cache['pos'] = new_pos
-        internal_msg_cache['pos'] = new_pos
-        new_visible = visible_msg_cache['text'][new_pos]
-        new_internal = internal_msg_cache['text'][new_pos]
-        
-        # Update history
-        if new_visible and new_internal:
-            history['visible'][i][msg_type] = new_visible
-            history['internal'][i][msg_type] = new_internal
-        
-        return chat_html_wrapper(history, name1, name2, mode, chat_style, character, unique_id), history
+        body = convert_to_markdown_wrapped(new_visible, use_cache=i != len(history['visible']) - 1)
+        return gr.update(), history, json.dumps({
+            'redraw': False,
+            'index': i,
+            'type': msg_type,
+            'body': body,
+            'pos': new_pos,
+            'total': total_pos
+        })
     except Exception as e:
         print(f"{_ERROR}Error during navigation: {e}{_RESET}")
         traceback.print_exc()
-        return chat_html_wrapper(history, name1, name2, mode, chat_style, character, unique_id), history
+        return redraw()
+
+SWIPE_PAGE_SIZE = 50
+SWIPE_PREVIEW_CHARS = 80
+
+def get_swipe_summaries(character: str, unique_id: str, mode: str, i: int, msg_type: int, offset: int = 0, limit: int = SWIPE_PAGE_SIZE, preview_chars: int = SWIPE_PREVIEW_CHARS) -> Dict:
+    """Page of swipe summaries of a message (see ChatCache.summarize)"""
+    chat_cache = cache.update_cache({'character_menu': character, 'unique_id': unique_id, 'mode': mode})
+    return chat_cache.summarize(int(i), int(msg_type), int(offset), int(limit), int(preview_chars))
+
+@metrics.timed('list_swipes')
+def list_swipes(i: float, msg_type: float, offset: float, character: str, unique_id: str, mode: str) -> str:
+    """Swipe picker handler: JSON page of swipe summaries"""
+    try:
+        return json.dumps(get_swipe_summaries(character, unique_id, mode, i, msg_type, offset))
+    except Exception as e:
+        print(f"{_ERROR}Error listing swipes: {e}{_RESET}")
+        traceback.print_exc()
+        return json.dumps({'index': int(i), 'type': int(msg_type), 'items': [], 'error': str(e)})
+
+PREFETCH_MAX_TARGETS = 4  # Chats prefetched per menu event
+
+def prefetch_chats(targets: str, character: str, mode: str):
+    """Chat menu hover/select handler: queue background loads of the targeted chats' caches.
+    `targets` is a JSON list of {"unique_id"?, "character"?}; a target without unique_id is a character's latest chat."""
+    try:
+        keys = []
+        for target in json.loads(targets or '[]')[:PREFETCH_MAX_TARGETS]:
+            target_character = target.get('character') or character
+            unique_id = target.get('unique_id') or prefetch.latest_chat(target_character, mode)
+            if unique_id:
+                keys.append(cache.make_key(target_character, unique_id, mode))
+        prefetch.prefetch(keys)
+    except Exception as e:
+        print(f"{_ERROR}Error prefetching chats: {e}{_RESET}")
+        traceback.print_exc()
+
+SEARCH_RESULTS = 50
+
+def find_swipes(query: str, limit: int = SEARCH_RESULTS, character: Optional[str] = None, preview_chars: int = SWIPE_PREVIEW_CHARS) -> Dict:
+    """Swipes containing every word of `query` (see utils/search.py), numbered for jump_to_search_hit.
+    Hits in loaded chats get a preview; other chats aren't read, so a query never loads a cache."""
+    hits = search.search(query, limit, character)
+    for n, hit in enumerate(hits):
+        hit['n'] = n
+        chat_cache = cache.get_loaded(cache.make_key(hit['character'], hit['unique_id'], hit['mode']))
+        if chat_cache is not None:
+            items = chat_cache.summarize(hit['index'], hit['type'], hit['pos'], 1, preview_chars)['items']
+            hit['preview'] = items[0]['preview'] if items else None
+    return {'query': query, 'hits': hits}
+
+def search_swipes(query: str, character_only: bool, character: str) -> Dict:
+    """Search panel handler"""
+    try:
+        if search.index is None:
+            return {'error': "The search index is disabled (boogaplus-search_index)"}
+        return find_swipes(query, character=character if character_only else None)
+    except Exception as e:
+        print(f"{_ERROR}Error searching swipes: {e}{_RESET}")
+        traceback.print_exc()
+        return {'query': query, 'hits': [], 'error': str(e)}
+
+def jump_to_search_hit(n: float, results: Dict, history: Dict, name1: str, name2: str, mode: str, chat_style: str, character: str, unique_id: str):
+    """Search panel handler: select the swipe of result `n`. In the open chat, the display is updated; in another chat, the
+    swipe is selected in its saved history, which shows it once the chat is opened."""
+    from modules.html_generator import chat_html_wrapper
+    
+    def result(status: str):
+        return chat_html_wrapper(history, name1, name2, mode, chat_style, character, unique_id), history, status
+    
+    try:
+        hits = (results or {}).get('hits') or []
+        if not 0 <= int(n) < len(hits):
+            return result("No such result")
+        hit = hits[int(n)]
+        i, msg_type, pos = hit['index'], hit['type'], hit['pos']
+        if cache.make_key(hit['character'], hit['unique_id'], hit['mode']) != cache.make_key(character, unique_id, mode):
+            jumped = jump_to_swipe(hit['character'], hit['unique_id'], hit['mode'], i, msg_type, pos)
+            where = f"{hit['character']} || {hit['unique_id']}" if hit['character'] else hit['unique_id']
+            return result(f"Selected swipe {jumped['pos'] + 1}/{jumped['total']} of message {i} in {where}; open that chat to see it")
+        if not 0 <= i < len(history['visible']):
+            return result(f"Message {i} is in another branch of this chat")
+        state = {'history': history, 'name1': name1, 'name2': name2, 'mode': mode, 'chat_style': chat_style, 'character_menu': character, 'unique_id': unique_id}
+        _jump(state, i, msg_type, absolute=pos)
+        return result(f"Selected swipe {pos + 1} of message {i}")
+    except Exception as e:
+        print(f"{_ERROR}Error jumping to search result: {e}{_RESET}")
+        traceback.print_exc()
+        return result(f"Could not jump to the result: {e}")
+
+def jump_to_swipe(character: str, unique_id: str, mode: str, i: int, msg_type: int, pos: int) -> Dict:
+    """Select swipe `pos` of a message in a saved chat: the cache position is moved and the history file is updated.
+    (Open UI sessions keep their own copy of the history; they pick the change up when the chat is reloaded.)"""
+    history = chat.load_history(unique_id, character, mode)
+    if not 0 <= i < len(history['visible']):
+        raise IndexError(f"message {i} is out of range")
+    state = {'history': history, 'character_menu': character, 'unique_id': unique_id, 'mode': mode}
+    new_pos, total_pos, _ = _jump(state, i, msg_type, absolute=pos)
+    if new_pos is not None:
+        chat.save_history(history, unique_id, character, mode)
+    return {
+        'index': i,
+        'type': msg_type,
+        'pos': cache.update_cache(state).nav.get(i, msg_type)[0],
+        'total': total_pos,
+        'changed': new_pos is not None,
+        'text': history['internal'][i][msg_type],
+    }
+
+API_MODES = ('chat', 'chat-instruct', 'instruct')
+
+def _requires_login() -> bool:
+    """Whether the UI is password protected: routes added to its FastAPI app bypass Gradio's login, so none are mounted"""
+    return bool(getattr(shared.args, 'gradio_auth', None) or getattr(shared.args, 'gradio_auth_path', None))
+
+def mount_api(app: Optional[FastAPI], prefix: str = '/boogaplus/api') -> bool:
+    """Add the swipe API to the FastAPI app serving the UI:
+        GET  {prefix}/swipes?character=&unique_id=&mode=&index=&type=[&offset=&limit=&preview=]  -> page of swipe summaries
+        POST {prefix}/jump?character=&unique_id=&mode=&index=&type=&pos=                          -> select swipe `pos`
+        GET  {prefix}/search?q=[&limit=&character=]                                               -> swipes containing `q`
+        GET  {prefix}/rows?window=&version=&start=&end=                                           -> rows of a windowed render
+    Routes added this way bypass Gradio's login, so they aren't mounted when the UI is password protected.
+    Chats are only served if their history is saved in the logs folder (404 otherwise)."""
+    global _windows_mounted
+    if app is None or getattr(app, '_boogaplus_api', False):
+        return False
+    if _requires_login():
+        print(f"{_INPUT}boogaPlus swipe API, metrics and style routes disabled (the UI requires a login){_RESET}")
+        app._boogaplus_api = True
+        return False
+    from fastapi import HTTPException
+    
+    def check_chat(character: str, unique_id: str, mode: str):
+        """404 unless the parameters name a saved chat (they end up in file paths, and loading a cache creates its folder)"""
+        if mode not in API_MODES or not unique_id or any(
+            '..' in name or any(c in name for c in '/\\\x00') for name in (character, unique_id)
+        ):
+            raise HTTPException(status_code=404, detail="unknown chat")
+        path = chat.get_history_file_path(unique_id, character, mode).resolve()
+        if not path.is_relative_to(cache.get_logs_dir().resolve()) or not path.is_file():
+            raise HTTPException(status_code=404, detail="unknown chat")
+    
+    def swipes_endpoint(character: str, unique_id: str, mode: str, index: int, type: int, offset: int = 0, limit: int = SWIPE_PAGE_SIZE, preview: int = SWIPE_PREVIEW_CHARS):
+        check_chat(character, unique_id, mode)
+        return get_swipe_summaries(character, unique_id, mode, index, type, offset, min(limit, 500), preview)
+    
+    def jump_endpoint(character: str, unique_id: str, mode: str, index: int, type: int, pos: int):
+        check_chat(character, unique_id, mode)
+        try:
+            return jump_to_swipe(character, unique_id, mode, index, type, pos)
+        except IndexError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    
+    def search_endpoint(q: str, limit: int = SEARCH_RESULTS, character: Optional[str] = None):
+        return find_swipes(q, min(limit, search.MAX_RESULTS), character)
+    
+    def rows_endpoint(window: str, version: int, start: int, end: int):
+        html = render_window_rows(window, version, start, end)
+        return {'html': html, 'stale': html is None}
+    
+    app.add_api_route(f'{prefix}/swipes', swipes_endpoint, methods=['GET'])
+    app.add_api_route(f'{prefix}/search', search_endpoint, methods=['GET'])
+    app.add_api_route(f'{prefix}/jump', jump_endpoint, methods=['POST'])
+    app.add_api_route(f'{prefix}/rows', rows_endpoint, methods=['GET'])
+    app._boogaplus_api = True
+    _windows_mounted = prefix == WINDOW_API
+    return True
 
 def custom_css():
     return open(Path(__file__).parent / 'ui/.css', 'r', encoding='utf-8').read()
@@ -222,7 +679,11 @@ def custom_js():
 import atexit
 def cleanup():
     print("(boogaplus) Cleaning up caches...")
-    cache.save_cache()
+    cache.save_cache(flush=True)
+    writer.stop()
+    search.close()
+    stats = fragments.stats()
+    print(f"(boogaplus) Fragment cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
     print("(boogaplus) Finished cleanup.")
 atexit.register(cleanup)
 
@@ -240,56 +701,87 @@ generate_chat_reply = chat.generate_chat_reply
 chat_html_wrapper = chat.chat_html_wrapper
 save_history = chat.save_history
 _generate_chat_reply_wrapper = chat.generate_chat_reply_wrapper
+@metrics.timed('generate_chat_reply_wrapper')
 def generate_chat_reply_wrapper(text, state, regenerate=False, _continue=False):
     '''
     Same as above but returns HTML for the UI (BOOGAPLUS MONKEY PATCH)
     '''
     history = state['history']
     _is_first = True
-    for html, history in _generate_chat_reply_wrapper(text, state, regenerate, _continue):
-        if _is_first:
-            if not regenerate and not _continue:
-                cache.append_to_cache(history, state, is_bot=False)  # history['visible'][-1][0] == escape(text)
-            _is_first = False
-        yield html, history
+    start_streaming()
+    try:
+        for html, history in _generate_chat_reply_wrapper(text, state, regenerate, _continue):
+            if _is_first:
+                if not regenerate and not _continue:
+                    cache.append_to_cache(history, state, is_bot=False)  # history['visible'][-1][0] == escape(text)
+                _is_first = False
+            yield html, history
+    finally:
+        stop_streaming()
     cache.append_to_cache(history, state, is_bot=True)
     yield chat_html_wrapper(history, state['name1'], state['name2'], state['mode'], state['chat_style'], state['character_menu'], state['unique_id']), history
         
 chat.generate_chat_reply_wrapper = generate_chat_reply_wrapper
 
+MAX_BATCH_SWIPES = 16
+
+@metrics.timed('generate_swipes')
+def generate_swipes(n: int, state: Dict):
+    '''
+    Regenerate the last reply `n` times in a row and keep every result as a swipe. Nothing is rendered until all of
+    them are generated; they are then cached in one batch and the chat is redrawn once, on the first new swipe.
+    Generations run one after another, since TGWUI's loaders serialize them anyway. Stopping keeps the finished ones.
+    '''
+    history = state['history']
+    n = max(0, min(int(n or 0), MAX_BATCH_SWIPES))
+    if n and character_is_loaded(state) and history['visible']:
+        i = len(history['visible']) - 1
+        chat_cache = cache.update_cache(state)
+        chat_cache.reconcile(history)
+        with chat_cache.lock:
+            msg = journal.get_msg(chat_cache.data, i, 1)
+            shown = (history['visible'][i][1], history['internal'][i][1])
+            uncached = shown[1] and (msg is None or snapshot.find_text(msg['text'], shown[1], msg.get('pos', 0)) < 0)
+        
+        swipes = [shown] if uncached else []  # Regenerating replaces the shown reply, keep it
+        shared.stop_everything = False
+        for _ in range(n):
+            for history in generate_chat_reply('', state, regenerate=True, loading_message=False):
+                pass
+            if len(history['visible']) == i + 1 and history['internal'][i][1]:
+                swipes.append((history['visible'][i][1], history['internal'][i][1]))
+            if shared.stop_everything:
+                break
+        
+        if len(swipes) > int(uncached):
+            with chat_cache.lock:
+                chat_cache.extend(i, 1, swipes, select=int(uncached))
+                if retention.enabled():
+                    chat_cache.prune(rows=[i])
+                pos, _ = chat_cache.nav.get(i, 1)
+                history['visible'][i][1] = chat_cache.data['visible'][i][1]['text'][pos]
+                history['internal'][i][1] = chat_cache.data['internal'][i][1]['text'][pos]
+            writer.flush(chat_cache.path)
+            print(f"{_SUCCESS}Generated {len(swipes) - int(uncached)} swipes for message {i}{_RESET}")
+        save_history(history, state['unique_id'], state['character_menu'], state['mode'])
+    return chat_html_wrapper(history, state['name1'], state['name2'], state['mode'], state['chat_style'], state['character_menu'], state['unique_id']), history
+
 
 
 
 """html"""
-import time
 import modules.html_generator as html_generator
 chat_styles = html_generator.chat_styles
 convert_to_markdown_wrapped = html_generator.convert_to_markdown_wrapped
-def generate_cai_chat_html(history, name1, name2, style, character, unique_id, reset_cache=False):
-    output = f'<style>{chat_styles[style]}</style><div class="chat cai-chat" id="chat"><div class="messages">'
+@metrics.timed('render_row (cai-chat)')
+def _cai_chat_row(i: int, _row: List[str], is_last: bool, name1: str, name2: str, img_me: str, img_bot: str, positions: List):
+    """Render a single cai-chat row (user + bot message)."""
+    parts = []
+    row = [convert_to_markdown_wrapped(entry, use_cache=not is_last) for entry in _row]
 
-    # We use ?character and ?time.time() to force the browser to reset caches
-    img_bot = f'<img src="file/cache/pfp_character_thumb.png?{character}" class="pfp_character">' if Path("cache/pfp_character_thumb.png").exists() else ''
-    img_me = f'<img src="file/cache/pfp_me.png?{time.time() if reset_cache else ""}">' if Path("cache/pfp_me.png").exists() else ''
-    
-    try: cache.update_cache({
-        'history': history,
-        'name1': name1,
-        'name2': name2,
-        'mode': 'chat-instruct',
-        'chat_style': style,
-        'character_menu': character,
-        'unique_id': unique_id
-    })
-    except: pass
-
-    for i, _row in enumerate(history):
-        row = [convert_to_markdown_wrapped(entry, use_cache=i != len(history) - 1) for entry in _row]
-
-        if row[0]:  # don't display empty user messages
-            try: current_pos, total_pos = get_message_positions(i, 0)
-            except: current_pos, total_pos = 0, 0
-            output += f"""
+    if row[0]:  # don't display empty user messages
+        current_pos, total_pos = positions[0]
+        parts.append(f"""
                   <div class="message" data-history-index="{i}" data-message-type="0">
                     <div class="circle-you">
                       {img_me}
@@ -310,11 +802,10 @@ def generate_cai_chat_html(history, name1, name2, style, character, unique_id, r
                       </div>
                     </div>
                   </div>
-                """
+                """)
 
-        try: current_pos, total_pos = get_message_positions(i, 1)
-        except: current_pos, total_pos = 0, 0
-        output += f"""
+    current_pos, total_pos = positions[1]
+    parts.append(f"""
               <div class="message" data-history-index="{i}" data-message-type="1">
                 <div class="circle-bot">
                   {img_bot}
@@ -335,23 +826,192 @@ def generate_cai_chat_html(history, name1, name2, style, character, unique_id, r
                   </div>
                 </div>
               </div>
-            """
+            """)
+    return ''.join(parts)
+
+"""Streaming prefix reuse: while a reply is generated, only the last row changes between chunks, so the HTML of all
+rows before it is rendered once and reused for as long as those rows and their swipe positions are unchanged."""
+_streaming = 0  # Number of generations in progress
+_stream_lock = threading.Lock()
+_stream_prefixes: Dict[tuple, tuple] = {}  # key -> (render settings, snapshot of rows[:-1], their positions, prefix HTML)
+
+def start_streaming():
+    global _streaming
+    with _stream_lock:
+        _streaming += 1
+
+def stop_streaming():
+    global _streaming
+    with _stream_lock:
+        _streaming -= 1
+        if not _streaming:
+            _stream_prefixes.clear()
+
+def get_stream_prefix(key: tuple, settings: tuple, history: List, nav: NavTable) -> Optional[str]:
+    """Get the cached HTML of rows[:-1] if those rows, their (pos, total) and the render settings are unchanged"""
+    with _stream_lock:
+        entry = _stream_prefixes.get(key) if _streaming else None
+    if entry is None:
+        return None
+    cached_settings, rows, positions, prefix = entry
+    # List comparison checks identity first, so this is a cheap pointer scan while streaming (and arrays compare in C)
+    if cached_settings != settings or len(rows) != len(history) - 1 or history[:-1] != rows \
+            or _prefix_positions(nav, len(rows)) != positions:
+        return None
+    return prefix
+
+def set_stream_prefix(key: tuple, settings: tuple, history: List, nav: NavTable, prefix: str):
+    with _stream_lock:
+        if _streaming:
+            rows = [list(row) for row in history[:-1]]
+            _stream_prefixes[key] = (settings, rows, _prefix_positions(nav, len(rows)), prefix)
+
+def _prefix_positions(nav: NavTable, length: int) -> List:
+    """Navigation columns of the first `length` rows (a swipe selected on another client changes them, not the rows)"""
+    return [column[:length] for columns in nav.columns for column in columns]
+
+"""Windowed rendering: with a RENDER_WINDOW, only the last RENDER_WINDOW rows (rounded to whole blocks of WINDOW_BLOCK
+rows) are rendered, and every older block is rendered as an empty placeholder. ui/.js fetches a block's rows from the
+rows endpoint (see mount_api) once its placeholder scrolls into view. Fetched blocks stay rendered in later redraws of
+the chat, so a redraw doesn't take away rows the user scrolled to. Windows need the endpoint, so every row is rendered
+while it isn't mounted (e.g. when the UI requires a login)."""
+RENDER_WINDOW = 0    # Rows rendered at the end of a chat (0 = every row)
+WINDOW_API = '/boogaplus/api'  # Prefix of the rows endpoint, as requested by ui/.js (under the app's root path)
+WINDOW_BLOCK = 25    # Rows per placeholder
+MAX_WINDOWS = 8      # Chats whose last render is kept for the rows endpoint
+
+class _Window:
+    __slots__ = ('id', 'version', 'history', 'start', 'loaded', 'render_row', 'get_nav')
+    def __init__(self, window_id: str):
+        self.id = window_id
+        self.version = 0       # Incremented by every render that isn't a streaming chunk
+        self.history = []      # Visible rows of the last render
+        self.start = 0         # First row rendered in full
+        self.loaded = set()    # Blocks fetched by the client, rendered in full from then on
+        self.render_row = None # (i, row, nav) -> fragment HTML, with the last render's settings
+        self.get_nav = None    # () -> NavTable of the chat
+
+_windows: OrderedDict = OrderedDict()  # key -> _Window
+_windows_lock = threading.Lock()
+_windows_mounted = False
 
-    output += "</div></div>"
+def configure_window(rows: Optional[int] = None, block: Optional[int] = None):
+    global RENDER_WINDOW, WINDOW_BLOCK
+    if rows is not None:
+        RENDER_WINDOW = max(0, int(rows))
+    if block is not None:
+        WINDOW_BLOCK = max(1, int(block))
+
+def _open_window(key: tuple, history: List, render_row: Callable, get_nav: Callable, streaming: bool) -> Optional[_Window]:
+    """Window of a chat's render (None if every row is rendered), updated with the rows being rendered"""
+    if not RENDER_WINDOW or not _windows_mounted:
+        return None
+    with _windows_lock:
+        window = _windows.get(key)
+        if window is None:
+            window = _windows[key] = _Window(hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).hexdigest())
+            while len(_windows) > MAX_WINDOWS:
+                _windows.popitem(last=False)
+        _windows.move_to_end(key)
+        if not streaming:
+            window.version += 1
+            window.start = max(0, len(history) - RENDER_WINDOW) // WINDOW_BLOCK * WINDOW_BLOCK
+        window.history = history
+        window.render_row, window.get_nav = render_row, get_nav
+    return window
+
+def _render_rows(parts: List[str], history: List, nav: NavTable, render_row: Callable, window: Optional[_Window]):
+    """Append the HTML of every row but the last to `parts`, with placeholders for the blocks outside the window"""
+    end = len(history) - 1
+    i = 0
+    while i < end:
+        block = i // WINDOW_BLOCK
+        if window is not None and i < window.start and block not in window.loaded:
+            block_end = min(end, (block + 1) * WINDOW_BLOCK)
+            parts.append(f'<div class="bgpl-placeholder" data-window="{window.id}" data-version="{window.version}" '
+                         f'data-start="{i}" data-end="{block_end}" style="--bgpl-rows: {block_end - i}"></div>')
+            i = block_end
+            continue
+        parts.append(render_row(i, history[i], nav))
+        i += 1
+
+@metrics.timed('render_window_rows')
+def render_window_rows(window_id: str, version: int, start: int, end: int) -> Optional[str]:
+    """HTML of rows `start` to `end` of a windowed render (None if the render was replaced since)"""
+    with _windows_lock:
+        window = next((window for window in _windows.values() if window.id == window_id), None)
+        if window is None or window.version != version:
+            return None
+        history, render_row, get_nav = window.history, window.render_row, window.get_nav
+        start, end = max(0, start), min(end, len(history) - 1)
+        window.loaded.update(range(start // WINDOW_BLOCK, (end + WINDOW_BLOCK - 1) // WINDOW_BLOCK))
+    nav = get_nav()
+    return ''.join(render_row(i, history[i], nav) for i in range(start, end))
+
+def _row_positions(nav: NavTable, i: int):
+    return [nav.get(i, 0), nav.get(i, 1)]
+
+@metrics.timed('generate_cai_chat_html')
+def generate_cai_chat_html(history, name1, name2, style, character, unique_id, reset_cache=False):
+    head = assets.style_tag(style, chat_styles[style])
+
+    # Avatar URLs carry a hash of the image, so browsers reload them exactly when they change
+    bot_digest = assets.resolve("cache/pfp_character_thumb.png", context=character, refresh=reset_cache)
+    me_digest = assets.resolve("cache/pfp_me.png", refresh=reset_cache)
+    img_bot = f'<img src="file/cache/pfp_character_thumb.png?{bot_digest}" class="pfp_character">' if bot_digest else ''
+    img_me = f'<img src="file/cache/pfp_me.png?{me_digest}">' if me_digest else ''
     
-    return output
-html_generator.generate_cai_chat_html = generate_cai_chat_html
+    def get_nav() -> NavTable:
+        try: return cache.update_cache({
+            'history': history,
+            'name1': name1,
+            'name2': name2,
+            'mode': 'chat-instruct',
+            'chat_style': style,
+            'character_menu': character,
+            'unique_id': unique_id
+        }).nav
+        except: return NavTable()
+    nav = get_nav()
 
-def generate_chat_html(history, name1, name2, reset_cache=False):
-    output = f'<style>{chat_styles["wpp"]}</style><div class="chat wpp" id="chat"><div class="messages">'
+    def render_row(i: int, _row: List[str], nav: NavTable) -> str:
+        positions = _row_positions(nav, i)
+        key = ('cai-chat', style, i, _row[0], _row[1], *positions[0], *positions[1], name1, name2, img_me, img_bot, cache._mode)
+        fragment = fragments.get(key)
+        if fragment is None:
+            fragment = _cai_chat_row(i, _row, False, name1, name2, img_me, img_bot, positions)
+            fragments.put(key, fragment)
+        return fragment
+
+    stream_key = ('cai-chat', character, unique_id)
+    settings = (head, name1, name2, img_me, img_bot, cache._mode)
+    prefix = get_stream_prefix(stream_key, settings, history, nav)
+    window = _open_window(stream_key, history, render_row, get_nav, streaming=prefix is not None)
+    if prefix is None:
+        parts = [f'{head}<div class="chat cai-chat" id="chat"><div class="messages">']
+        _render_rows(parts, history, nav, render_row, window)
+        prefix = ''.join(parts)
+        if history:
+            set_stream_prefix(stream_key, settings, history, nav, prefix)
+    
+    parts = [prefix]
+    if history:  # The last row is re-rendered while streaming; don't fill the cache with partial replies
+        i = len(history) - 1
+        parts.append(_cai_chat_row(i, history[i], True, name1, name2, img_me, img_bot, _row_positions(nav, i)))
+    parts.append("</div></div>")
+    
+    return ''.join(parts)
+html_generator.generate_cai_chat_html = generate_cai_chat_html
 
-    for i, _row in enumerate(history):
-        row = [convert_to_markdown_wrapped(entry, use_cache=i != len(history) - 1) for entry in _row]
+@metrics.timed('render_row (wpp)')
+def _chat_row(i: int, _row: List[str], is_last: bool, positions: List):
+    """Render a single wpp row (user + bot message)."""
+    parts = []
+    row = [convert_to_markdown_wrapped(entry, use_cache=not is_last) for entry in _row]
 
-        if row[0]:  # don't display empty user messages
-            try: current_pos, total_pos = get_message_positions(i, 0)
-            except: current_pos, total_pos = 0, 0
-            output += f"""
+    if row[0]:  # don't display empty user messages
+        current_pos, total_pos = positions[0]
+        parts.append(f"""
               <div class="message" data-history-index="{i}" data-message-type="0">
                 <div class="text-you">
                   <div class="message-body">
@@ -366,11 +1026,10 @@ def generate_chat_html(history, name1, name2, reset_cache=False):
                   </div>
                 </div>
               </div>
-            """
+            """)
 
-        try: current_pos, total_pos = get_message_positions(i, 1)
-        except: current_pos, total_pos = 0, 0
-        output += f"""
+    current_pos, total_pos = positions[1]
+    parts.append(f"""
           <div class="message" data-history-index="{i}" data-message-type="1">
             <div class="text-bot">
               <div class="message-body">
@@ -385,8 +1044,41 @@ def generate_chat_html(history, name1, name2, reset_cache=False):
               </div>
             </div>
           </div>
-        """
+        """)
+    return ''.join(parts)
+
+@metrics.timed('generate_chat_html')
+def generate_chat_html(history, name1, name2, reset_cache=False):
+    head = assets.style_tag('wpp', chat_styles['wpp'])
+    
+    # No character/unique_id is passed to this style, so use the most recently used chat
+    chat_cache = cache.get_recent_cache()
+    nav = chat_cache.nav if chat_cache else NavTable()
+
+    def render_row(i: int, _row: List[str], nav: NavTable) -> str:
+        positions = _row_positions(nav, i)
+        key = ('wpp', i, _row[0], _row[1], *positions[0], *positions[1])
+        fragment = fragments.get(key)
+        if fragment is None:
+            fragment = _chat_row(i, _row, False, positions)
+            fragments.put(key, fragment)
+        return fragment
 
-    output += "</div></div>"
-    return output
-html_generator.generate_chat_html = generate_chat_html
\ No newline at end of file
+    stream_key = ('wpp',)
+    prefix = get_stream_prefix(stream_key, (head,), history, nav)
+    window_key = ('wpp', *chat_cache.key) if chat_cache else stream_key
+    window = _open_window(window_key, history, render_row, lambda: nav, streaming=prefix is not None)
+    if prefix is None:
+        parts = [f'{head}<div class="chat wpp" id="chat"><div class="messages">']
+        _render_rows(parts, history, nav, render_row, window)
+        prefix = ''.join(parts)
+        if history:
+            set_stream_prefix(stream_key, (head,), history, nav, prefix)
+    
+    parts = [prefix]
+    if history:
+        i = len(history) - 1
+        parts.append(_chat_row(i, history[i], True, _row_positions(nav, i)))
+    parts.append("</div></div>")
+    return ''.join(parts)
+html_generator.generate_chat_html = generate_chat_html
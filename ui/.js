@@ -1,17 +1,50 @@
-let setupAttempts = 0;
 let _start = 0;
 
-let messages = null;
-let selectedMessageChatIndex = null;
+let startupDone = false;
 let selectedMessageHistoryIndex = null;
 let selectedMessageType = null;
 let whenLastSelection = null;
 let whenLastNavHover = null;
+let navInFlight = null;  // When the last navigation request was sent (null once its result is applied)
+let navPending = null;   // Presses made while a request was in flight: {index, type, offset}
+const NAV_TIMEOUT = 5000;
+let prefetchTimer = null;
+let lastPrefetch = null;  // Targets of the last prefetch request, so hovering back and forth doesn't repeat it
+const PREFETCH_DELAY = 150;  // Hover time (ms) before a chat is prefetched
 
 function navigateHistory(direction, index=null, type=null) {
     index = index === null ? selectedMessageHistoryIndex : index;
     type = type === null ? selectedMessageType : type;
+    const offset = direction === 'left' ? -1 : (direction === 'right' ? 1 : Number(direction));
+    queueNavigation(index, type, null, offset);
+}
+
+// Jump straight to swipe `pos` of a message
+function jumpToSwipe(index, type, pos) {
+    queueNavigation(index, type, pos, 0);
+}
 
+function queueNavigation(index, type, absolute, offset) {
+    // Coalesce requests made while one is in flight into a single jump, sent once it completes
+    if (navInFlight !== null && Date.now() - navInFlight < NAV_TIMEOUT) {
+        if (navPending && (navPending.index != index || navPending.type != type)) {
+            sendNavigation(navPending);
+            navPending = null;
+        }
+        navPending = navPending || { index, type, absolute: null, offset: 0 };
+        if (absolute !== null) {
+            navPending.absolute = absolute;
+            navPending.offset = 0;
+        }
+        navPending.offset += offset;
+        return;
+    }
+    sendNavigation({ index, type, absolute, offset });
+}
+
+function sendNavigation({ index, type, absolute, offset }) {
+    if (absolute === null && !offset) return;
+    const direction = absolute !== null ? `=${absolute + offset}` : (offset > 0 ? `+${offset}` : `${offset}`);
     const gradio = gradioApp();
 
     const dirInput = gradio.querySelector('#bgpl_direction textarea');
@@ -23,21 +56,120 @@ function navigateHistory(direction, index=null, type=null) {
             updateGradioInput(historyIndexInput, index);
             updateGradioInput(messageIndexInput, type);
             updateGradioInput(dirInput, direction);
+            navInFlight = Date.now();
             gradio.querySelector('#bgpl_navigate')?.click();
         }
     }
 }
 
-function selectMessage(element, index=null) {
+// Called once a navigation result is applied; sends the requests coalesced in the meantime
+function navigationDone() {
+    navInFlight = null;
+    if (navPending) {
+        const pending = navPending;
+        navPending = null;
+        sendNavigation(pending);
+    }
+}
+
+// Swipe picker: request a page of swipe summaries of a message (shown by showSwipePicker)
+function openSwipePicker(index, type, offset=0) {
+    const gradio = gradioApp();
+    const historyIndexInput = gradio.querySelector('#bgpl_history_index input[type="number"]');
+    const messageIndexInput = gradio.querySelector('#bgpl_message_type input[type="number"]');
+    const offsetInput = gradio.querySelector('#bgpl_swipe_offset input[type="number"]');
+    if (historyIndexInput && messageIndexInput && offsetInput) {
+        updateGradioInput(historyIndexInput, index);
+        updateGradioInput(messageIndexInput, type);
+        updateGradioInput(offsetInput, offset);
+        gradio.querySelector('#bgpl_list_swipes')?.click();
+    }
+}
+
+function closeSwipePicker() {
+    gradioApp().querySelectorAll('.bgpl-swipe-picker').forEach(el => el.remove());
+}
+
+function showSwipePicker(result) {
+    closeSwipePicker();
+    if (!result) return;
+    const data = JSON.parse(result);
+    if (!data.items?.length) return;
+
+    const gradio = gradioApp();
+    const msg = gradio.querySelector(`#chat .message[data-history-index="${data.index}"][data-message-type="${data.type}"]`);
+    if (!msg) return;
+
+    const picker = document.createElement('div');
+    picker.className = 'bgpl-swipe-picker';
+    picker.addEventListener('click', (e) => e.stopPropagation());
+    data.items.forEach(item => {
+        const entry = document.createElement('div');
+        entry.className = 'bgpl-swipe-entry';
+        entry.toggleAttribute('selected', item.pos === data.pos);
+        entry.textContent = `${item.pos + 1}. ${item.preview}${item.length > item.preview.length ? '…' : ''}`;
+        entry.title = `${item.length} characters`;
+        entry.addEventListener('click', () => {
+            closeSwipePicker();
+            jumpToSwipe(data.index, data.type, item.pos);
+        });
+        picker.appendChild(entry);
+    });
+
+    const pageSize = data.items.length;
+    if (data.offset > 0 || data.offset + pageSize < data.total) {
+        const pager = document.createElement('div');
+        pager.className = 'bgpl-swipe-pager';
+        const prev = document.createElement('span');
+        prev.textContent = '‹';
+        prev.toggleAttribute('activated', data.offset > 0);
+        prev.addEventListener('click', () => data.offset > 0 && openSwipePicker(data.index, data.type, Math.max(0, data.offset - pageSize)));
+        const next = document.createElement('span');
+        next.textContent = '›';
+        next.toggleAttribute('activated', data.offset + pageSize < data.total);
+        next.addEventListener('click', () => data.offset + pageSize < data.total && openSwipePicker(data.index, data.type, data.offset + pageSize));
+        const label = document.createElement('span');
+        label.textContent = `${data.offset + 1}-${data.offset + pageSize} / ${data.total}`;
+        pager.append(prev, label, next);
+        picker.appendChild(pager);
+    }
+    msg.appendChild(picker);
+}
+
+// Patch a single message in place from the navigate_message() JSON result
+function applyNavigationResult(result) {
+    if (!result) return;
+    const data = JSON.parse(result);
+    if (data.redraw || data.body === null) return;  // Full redraw already applied, or nothing changed
+
+    const gradio = gradioApp();
+    const msg = gradio.querySelector(`#chat .message[data-history-index="${data.index}"][data-message-type="${data.type}"]`);
+    const body = msg?.querySelector('.message-body');
+    if (!body) {  // Displayed chat is out of sync, redraw it in full
+        gradio.querySelector('#bgpl_startup')?.click();
+        return;
+    }
+    body.innerHTML = data.body;
+
+    const navContainer = msg.querySelector('.nav-container');
+    if (navContainer) {
+        navContainer.toggleAttribute('hidden', data.total <= 1);
+        msg.querySelector('.nav-left')?.toggleAttribute('activated', data.pos !== 0);
+        msg.querySelector('.nav-right')?.toggleAttribute('activated', data.pos <= data.total - 2);
+        const navPos = navContainer.querySelector('.nav-pos');
+        if (navPos) navPos.textContent = `${data.pos + 1}/${data.total}`;
+    }
+}
+
+function selectMessage(element) {
     // Remove previous selection
     deselectMessages();
 
     // Add selection to clicked message
     if (element) {
-        selectedMessageChatIndex = index;
         selectedMessageHistoryIndex = element.dataset.historyIndex;
         selectedMessageType = element.dataset.messageType;
-        element.querySelector('.message-body').classList.add('selected-message');
+        element.querySelector('.message-body')?.classList.add('selected-message');
 
         // const navContent = document.querySelector('.nav-container');
         // activateNavOverlay(navContent);
@@ -46,15 +178,36 @@ function selectMessage(element, index=null) {
 }
 
 function deselectMessages() {
-    document.querySelectorAll('.selected-message').forEach(el => {
+    gradioApp().querySelectorAll('.selected-message').forEach(el => {
         el.classList.remove('selected-message');
     });
-    selectedMessageChatIndex = null;
     selectedMessageHistoryIndex = null;
     selectedMessageType = null;
     whenLastNavHover = null;
 }
 
+function selectedMessageSelector() {
+    return `.message[data-history-index="${selectedMessageHistoryIndex}"][data-message-type="${selectedMessageType}"]`;
+}
+
+function getSelectedMessage() {
+    if (selectedMessageHistoryIndex === null) return null;
+    return gradioApp().querySelector(`#chat ${selectedMessageSelector()}`);
+}
+
+// Nearest message element before (step < 0) or after (step > 0) `element`
+function adjacentMessage(element, step) {
+    let el = element;
+    do {
+        el = step < 0 ? el.previousElementSibling : el.nextElementSibling;
+        if (el?.matches('.bgpl-placeholder')) {  // Rows not rendered yet: load them, the next press moves into them
+            loadPlaceholder(el);
+            return null;
+        }
+    } while (el && !el.matches('.message'));
+    return el;
+}
+
 function updateGradioInput(element, value) {
     element.value = value;
     element.dispatchEvent(new Event('input', { bubbles: true }));
@@ -67,102 +220,216 @@ function gradioApp() {
     return gradioShadowRoot || document;
 }
 
-// Add hover handlers to messages
-function setupMessageHandlers() {
-    const gradio = gradioApp();
-    messages = gradio.querySelectorAll('#chat .messages .message');
-    
-    if (!messages?.length) {  // Repeat until messages are found
-        if (setupAttempts < 20) {
-            setupAttempts++;
-            setTimeout(setupMessageHandlers, 500);
-            return;
-        } else {
-            throw new Error(`No messages found after ${setupAttempts} attempts`);
-        }
+// Windowed chats: older rows are placeholders, loaded from the rows endpoint once they come near the viewport
+const API_PATH = 'boogaplus/api';
+const PLACEHOLDER_MARGIN = '1500px 0px';  // How far outside the viewport placeholders start loading
+const PLACEHOLDER_RETRY = 2000;
+const windowObservers = new Map();  // Scroll container -> IntersectionObserver of its placeholders
+
+// The endpoints are mounted on the app serving the UI, which may be under a subpath or root path: resolve them against
+// Gradio's root URL (or the page's directory if Gradio doesn't expose it)
+function apiUrl(endpoint) {
+    const root = window.gradio_config?.root || window.location.pathname.replace(/[^/]*$/, '');
+    return `${root.replace(/\/+$/, '')}/${API_PATH}/${endpoint}`;
+}
+
+// Nearest scrolling ancestor of `el` (the viewport if there is none)
+function scrollParent(el) {
+    for (let parent = el.parentElement; parent; parent = parent.parentElement) {
+        const overflowY = getComputedStyle(parent).overflowY;
+        if (overflowY === 'auto' || overflowY === 'scroll') return parent;
+    }
+    return null;
+}
+
+function observePlaceholder(el) {
+    if (el.dataset.loading) return;
+    const root = scrollParent(el);
+    let observer = windowObservers.get(root);
+    if (!observer) {
+        observer = new IntersectionObserver(entries => {
+            for (const entry of entries) {
+                if (!entry.target.matches('.bgpl-placeholder')) observer.unobserve(entry.target);  // Morphed into a row
+                else if (entry.isIntersecting) loadPlaceholder(entry.target);
+            }
+        }, { root, rootMargin: PLACEHOLDER_MARGIN });
+        windowObservers.set(root, observer);
     }
+    observer.observe(el);
+}
 
-    const rootDataset = (gradio !== document) ? gradio.dataset : document.body.dataset; 
-    if (!rootDataset.boogaplusHandled) {  // When all info is available, call startup
-        const navEventHandler = gradio.querySelector('#bgpl_navigate');
-        const startupHandler = gradio.querySelector('#bgpl_startup');
-        if (navEventHandler && startupHandler) {
-            console.log("Setting up nav event handler...");
-            navEventHandler.addEventListener('change', setupMessageHandlers);
-            console.log("Calling startup event handler...");
-            startupHandler.click();
-            
-            rootDataset.boogaplusHandled = 'true';
+async function loadPlaceholder(el) {
+    if (el.dataset.loading) return;
+    el.dataset.loading = 'true';
+    windowObservers.forEach(observer => observer.unobserve(el));
+    const { window: windowId, version, start, end } = el.dataset;
+    try {
+        const response = await fetch(apiUrl(`rows?window=${windowId}&version=${version}&start=${start}&end=${end}`));
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const data = await response.json();
+        // Replaced or morphed into another block by a redraw meanwhile
+        if (!el.isConnected || el.dataset.version !== version || el.dataset.start !== start) return;
+        if (data.stale) {  // The chat changed since it was rendered: redraw it
+            gradioApp().querySelector('#bgpl_startup')?.click();
             return;
         }
-        setupAttempts++;
-        setTimeout(setupMessageHandlers, 500);  // Redo setup until handlers are found
-        return;
+        el.insertAdjacentHTML('beforebegin', data.html);
+        el.remove();
+    } catch (error) {
+        console.error('Could not load chat rows:', error);
+        setTimeout(() => {
+            delete el.dataset.loading;
+            if (el.isConnected) observePlaceholder(el);
+        }, PLACEHOLDER_RETRY);
     }
+}
 
-    if (selectedMessageChatIndex !== null) {  // If a message is selected
-        messages[selectedMessageChatIndex].querySelector('.message-body')?.classList.add('selected-message');
-    }
-
-    setupAttempts = 0;
-
-    messages.forEach((msg, index) => {
-        if (!msg.dataset.boogaplusHandled) {
-            const historyIndex = msg.dataset.historyIndex;
-            const type = msg.dataset.messageType;
-            if (historyIndex && type) {
-                const leftArrow = msg.querySelector('.nav-left');
-                const rightArrow = msg.querySelector('.nav-right');
-                leftArrow?.addEventListener('click', (e) => {
-                    e.stopPropagation();
-                    e.stopImmediatePropagation();
-                    selectMessage(msg, index);
-                    navigateHistory('left', historyIndex, type);
-                });
-                rightArrow?.addEventListener('click', (e) => {
-                    e.stopPropagation();
-                    e.stopImmediatePropagation();
-                    selectMessage(msg, index);
-                    navigateHistory('right', historyIndex, type);
-                });
-            }
+function observePlaceholders(node) {
+    if (node.matches('.bgpl-placeholder')) observePlaceholder(node);
+    node.querySelectorAll('.bgpl-placeholder').forEach(observePlaceholder);
+}
 
-            msg.addEventListener('click', () => {
-                if (msg.querySelector('.selected-message')) {  // Select - deselect swap
-                    deselectMessages();
-                } else {
-                    selectMessage(msg, index);
-                }
-            });
+// Click startup once the chat and the boogaPlus handlers are rendered
+function tryStartup() {
+    const gradio = gradioApp();
+    const rootDataset = (gradio !== document) ? gradio.host.dataset : document.body.dataset;
+    if (rootDataset.boogaplusHandled) {
+        startupDone = true;
+        return;
+    }
+    const startupHandler = gradio.querySelector('#bgpl_startup');
+    if (startupHandler && gradio.querySelector('#chat .message')) {
+        console.log("Calling startup event handler...");
+        rootDataset.boogaplusHandled = 'true';
+        startupDone = true;
+        startupHandler.click();
+    }
+}
 
-            msg.dataset.boogaplusHandled = 'true';
+// Only look at what changed: re-apply the selection to a re-rendered selected message
+function handleMutations(records) {
+    if (!startupDone) tryStartup();
+    for (const record of records) {
+        if (record.type === 'attributes') {  // A DOM diff can turn an element into a placeholder
+            if (record.target.classList?.contains('bgpl-placeholder')) observePlaceholder(record.target);
+            continue;
         }
-    });
+        for (const node of record.addedNodes) {
+            if (node.nodeType === Node.ELEMENT_NODE) observePlaceholders(node);
+        }
+    }
+    if (selectedMessageHistoryIndex === null) return;
+
+    const selector = selectedMessageSelector();
+    for (const record of records) {
+        if (record.type === 'attributes') {  // Class reset by a DOM diff of the chat
+            const body = record.target;
+            if (body.classList?.contains('message-body') && !body.classList.contains('selected-message') && body.parentElement?.closest(selector)) {
+                body.classList.add('selected-message');
+            }
+            continue;
+        }
+        for (const node of record.addedNodes) {
+            if (node.nodeType !== Node.ELEMENT_NODE) continue;
+            const msg = node.matches(selector) ? node : (node.closest(selector) || node.querySelector(selector));
+            msg?.querySelector('.message-body')?.classList.add('selected-message');
+        }
+    }
 }
 
-// Global event listeners for dynamic setup
+// Delegated click handling for every message (no per-message listeners, so re-rendered messages need no setup)
 document.addEventListener('click', function(e) {
-    const chat = e.target.closest('#chat');
-    if (chat) {
-        setupMessageHandlers();
-        const leftArrow = e.target.closest('.nav-left');
-        if (leftArrow) {
-            leftArrow.click();
+    const picker = e.target.closest('.bgpl-swipe-picker');
+    if (!picker) {
+        closeSwipePicker();
+    }
+
+    const msg = e.target.closest('#chat .message');
+    if (msg && !picker) {
+        const historyIndex = msg.dataset.historyIndex;
+        const type = msg.dataset.messageType;
+        if (historyIndex && type) {
+            if (e.target.closest('.nav-left')) {
+                selectMessage(msg);
+                navigateHistory('left', historyIndex, type);
+                return;
+            }
+            if (e.target.closest('.nav-right')) {
+                selectMessage(msg);
+                navigateHistory('right', historyIndex, type);
+                return;
+            }
+            if (e.target.closest('.nav-pos')) {
+                selectMessage(msg);
+                openSwipePicker(historyIndex, type);
+                return;
+            }
         }
-        const rightArrow = e.target.closest('.nav-right');
-        if (rightArrow) {
-            rightArrow.click();
+
+        if (msg.querySelector('.selected-message')) {  // Select - deselect swap
+            deselectMessages();
+        } else {
+            selectMessage(msg);
         }
+        return;
     }
     if (!(e.target.closest('.message') || e.target.closest('button'))) {  // Deselect on click outside
         deselectMessages();
     }
 });
 
+// Prefetch the swipe caches of chats the user is likely to open next (the server loads them in the background)
+function requestPrefetch(targets) {
+    if (!targets.length) return;
+    const key = JSON.stringify(targets);
+    if (key === lastPrefetch) return;
+    const gradio = gradioApp();
+    const targetsInput = gradio.querySelector('#bgpl_prefetch_targets textarea');
+    if (targetsInput) {
+        lastPrefetch = key;
+        updateGradioInput(targetsInput, key);
+        gradio.querySelector('#bgpl_prefetch')?.click();
+    }
+}
+
+// Target of a past chats entry or of a character menu option (its latest chat)
+function prefetchTarget(element) {
+    const chat = element.closest('#past-chats label');
+    if (chat) {
+        const value = chat.querySelector('input')?.value;
+        return value ? { unique_id: value } : null;
+    }
+    const option = element.closest('#character-menu [role="option"]');
+    if (option) {
+        const name = option.getAttribute('aria-label') || option.textContent.trim();
+        return name ? { character: name } : null;
+    }
+    return null;
+}
+
+document.addEventListener('mouseover', function(e) {
+    const target = prefetchTarget(e.target);
+    clearTimeout(prefetchTimer);
+    if (target) {
+        prefetchTimer = setTimeout(() => requestPrefetch([target]), PREFETCH_DELAY);
+    }
+});
+
+// Selecting a past chat: prefetch its neighbours in the list
+document.addEventListener('change', function(e) {
+    const label = e.target.closest('#past-chats label');
+    if (!label) return;
+    const labels = Array.from(label.parentElement.querySelectorAll('label'));
+    const index = labels.indexOf(label);
+    const targets = [labels[index - 1], labels[index + 1]]
+        .filter(Boolean)
+        .map(prefetchTarget)
+        .filter(Boolean);
+    requestPrefetch(targets);
+});
+
 // Handle keyboard navigation
 document.addEventListener('keydown', function(e) {
-    setupMessageHandlers();  // Ensure handlers are set up
-    
     // Only handle if we're not in an input field and a message is selected
     if (e.target.tagName === 'INPUT' || e.target.tagName === 'TEXTAREA' || selectedMessageHistoryIndex === null) {
         return;
@@ -175,36 +442,27 @@ document.addEventListener('keydown', function(e) {
         } else if (e.key === 'ArrowRight') {
             navigateHistory('right');
             e.preventDefault();
-        } else if (e.key === 'ArrowUp') {
-            const index = selectedMessageChatIndex - 1;  // Up one element
-            if (index >= 0) selectMessage(messages[index], index);
-            e.preventDefault();
-        } else if (e.key === 'ArrowDown') {
-            const index = selectedMessageChatIndex + 1;  // Down one element
-            if (index < messages.length) selectMessage(messages[index],index);
+        } else if (e.key === 'ArrowUp' || e.key === 'ArrowDown') {
+            const selected = getSelectedMessage();
+            const next = selected && adjacentMessage(selected, e.key === 'ArrowUp' ? -1 : 1);  // Up/down one element
+            if (next) selectMessage(next);
             e.preventDefault();
         }
     }
 });
 
-// Initial setup with retry
+// Observe the app once; the callback only processes the MutationRecords' nodes
 function initializeHandlers() {
-    setupMessageHandlers();
-    
-    // Create an observer for dynamic chat updates
     const gradio = gradioApp();
-    const chat = gradio.querySelector('#chat');
-    if (chat) {
-        const observer = new MutationObserver(() => {
-            console.log("Updating message handlers for boogaPlus nav overlay...");
-            setupMessageHandlers();
-        });
-        
-        observer.observe(chat, {
-            childList: true,
-            subtree: true 
-        });
-    }
+    const observer = new MutationObserver(handleMutations);
+    observer.observe(gradio === document ? document.body : gradio, {
+        childList: true,
+        subtree: true,
+        attributes: true,
+        attributeFilter: ['class']
+    });
+    gradio.querySelectorAll('.bgpl-placeholder').forEach(observePlaceholder);
+    tryStartup();
 }
 
 // Start initialization when DOM is ready
@@ -214,4 +472,4 @@ if (document.readyState === 'loading') {
     });
 } else {
     initializeHandlers();
-}
\ No newline at end of file
+}
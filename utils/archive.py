@@ -0,0 +1,284 @@
+from typing import Dict, IO, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import gzip
+import json
+import shutil
+import threading
+import time
+import traceback
+
+import extensions.boogaplus.utils.cache as cache
+import extensions.boogaplus.utils.collector as collector
+import extensions.boogaplus.utils.journal as journal
+import extensions.boogaplus.utils.reconcile as reconcile
+import extensions.boogaplus.utils.snapshot as snapshot
+from extensions.boogaplus.utils.writer import writer
+
+"""
+Streaming export and import of swipe caches as JSONL archives (gzip-compressed if the file name ends with .gz).
+
+Every line of an archive is one swipe:
+    {"character": ..., "unique_id": ..., "mode": ..., "row": i, "msg_type": t, "pos": p, "visible": ..., "internal": ...,
+     "selected": true, "time": unix seconds, "next": next_pos}
+"selected", "time" and "next" (see utils/journal.py) are omitted when false or unknown. The swipes of a chat are
+contiguous, in (row, msg_type, pos) order.
+
+Both directions are generators over one chat at a time, so an archive of any size round-trips without holding more
+than one chat per worker in memory. export() reads each chat directory (each character's chats, or the instruct chats)
+in its own worker, writing it to a temporary part file next to the archive, and concatenates the parts in order.
+import_archive() reads the archive sequentially and writes up to WORKERS chats concurrently. Imported chats are
+checked against their history files the way utils/reconcile.py checks a loaded cache: a cached message that doesn't
+hold its history's text means the chat isn't the one the archive was made from, and it is skipped; otherwise the
+swipes the history shows are selected.
+"""
+
+# Colour codes
+_ERROR = "\033[1;31m"
+_SUCCESS = "\033[1;32m"
+_GRAY = "\033[0;30m"
+_RESET = "\033[0m"
+
+WORKERS = 4  # Chat directories exported, or chats imported, concurrently
+
+Key = Tuple[str, str, str]  # cache.make_key()
+
+def configure(workers: Optional[int] = None):
+    global WORKERS
+    if workers is not None:
+        WORKERS = max(1, int(workers))
+
+def _open(path: Path, mode: str) -> IO:
+    """Open an archive in text mode ('r', 'w') or binary mode ('rb', 'wb'), through gzip if its name ends with .gz"""
+    encoding = None if 'b' in mode else 'utf-8'
+    if path.name.endswith('.gz'):
+        return gzip.open(path, mode if encoding is None else mode + 't', encoding=encoding)
+    return open(path, mode, encoding=encoding)
+
+def get_archive_path() -> Path:
+    return cache.get_logs_dir() / 'boogaplus-export.jsonl.gz'
+
+# // Export // #
+
+def chat_records(key: Key, history_cache: Dict) -> Iterator[Dict]:
+    """Archive records of every swipe of a chat's cache"""
+    character, unique_id, mode = key
+    for i in range(len(history_cache['internal'])):
+        for msg_type in (0, 1):
+            msg = journal.get_msg(history_cache, i, msg_type)
+            visible_msg = journal.get_msg(history_cache, i, msg_type, 'visible')
+            if msg is None or visible_msg is None:
+                continue
+            times = msg.get('time') or []
+            links = msg.get('next') or []
+            selected = msg.get('pos', 0)
+            for pos in range(len(msg['text'])):
+                record = {
+                    'character': character, 'unique_id': unique_id, 'mode': mode,
+                    'row': i, 'msg_type': msg_type, 'pos': pos,
+                    'visible': visible_msg['text'][pos], 'internal': msg['text'][pos],
+                }
+                if pos == selected:
+                    record['selected'] = True
+                if pos < len(times) and times[pos] is not None:
+                    record['time'] = times[pos]
+                if pos < len(links) and links[pos] is not None:
+                    record['next'] = links[pos]
+                yield record
+
+def stored_records(key: Key, location) -> Iterator[Dict]:
+    """Archive records of a stored chat (pending changes are written first), loaded only while they are consumed"""
+    writer.flush(location)
+    history_cache, _, _ = cache.store.load(location, track=False)  # A read-only copy
+    with snapshot.opened(history_cache):  # One file handle for every swipe of the chat
+        yield from chat_records(key, history_cache)
+
+def _directories(logs_dir: Path) -> List[List[Tuple[Key, object]]]:
+    """(key, location) of every stored chat, grouped by chat directory"""
+    directories: Dict[Tuple[str, str], List[Tuple[Key, object]]] = {}
+    for key, location, _ in collector.stored_caches(logs_dir):
+        directories.setdefault((key[2], key[0]), []).append((key, location))
+    return [directories[directory] for directory in sorted(directories)]
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+def _write_records(f: IO, records: Iterable[Dict]) -> int:
+    written = 0
+    for record in records:
+        f.write(_encoder.encode(record) + '\n')
+        written += 1
+    return written
+
+def _export_directory(chats: List[Tuple[Key, object]], part_path: Path) -> Dict:
+    report = {'chats': 0, 'swipes': 0, 'errors': 0}
+    with open(part_path, 'w', encoding='utf-8') as f:
+        for key, location in chats:
+            try:
+                if not cache.store.exists(location):  # Removed since it was listed
+                    continue
+                report['swipes'] += _write_records(f, stored_records(key, location))
+                report['chats'] += 1
+            except Exception as e:
+                print(f"{_ERROR}Could not export cache {key[0]} || {key[1]}:{_RESET} {e}")
+                traceback.print_exc()
+                report['errors'] += 1
+    return report
+
+def export(path: Optional[Path] = None) -> Dict:
+    """Write every stored chat's swipes to the archive at `path` and return a report"""
+    start = time.perf_counter()
+    path = Path(path) if path else get_archive_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    directories = _directories(cache.get_logs_dir())
+    part_paths = [path.with_name(f'{path.name}.part{n}') for n in range(len(directories))]
+    report = {'path': str(path), 'chats': 0, 'swipes': 0, 'errors': 0}
+    try:
+        with ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='boogaplus-export') as executor:
+            futures = [executor.submit(_export_directory, chats, part_path) for chats, part_path in zip(directories, part_paths)]
+            with _open(path, 'wb') as out:
+                for future, part_path in zip(futures, part_paths):  # In order, while later directories are still exported
+                    for name, count in future.result().items():
+                        report[name] += count
+                    with open(part_path, 'rb') as part:
+                        shutil.copyfileobj(part, out)
+                    part_path.unlink()
+    finally:
+        for part_path in part_paths:
+            if part_path.exists():
+                part_path.unlink()
+    report['bytes'] = path.stat().st_size
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    print(f"{_SUCCESS}Exported {report['swipes']} swipes of {report['chats']} chats to {path} in {report['seconds']}s{_RESET}")
+    return report
+
+# // Import // #
+
+def read_records(path: Path) -> Iterator[Dict]:
+    """Records of an archive, one line at a time (corrupt lines are reported and skipped)"""
+    with _open(Path(path), 'r') as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"{_ERROR}Ignoring corrupt archive line {n}{_RESET}")
+
+def read_chats(records: Iterable[Dict]) -> Iterator[Tuple[Key, List[Dict]]]:
+    """Group consecutive records by chat, yielding one chat's records at a time"""
+    key, chat = None, []
+    for record in records:
+        record_key = cache.make_key(record.get('character', ''), record.get('unique_id', ''), record.get('mode'))
+        if record_key != key:
+            if chat:
+                yield key, chat
+            key, chat = record_key, []
+        chat.append(record)
+    if chat:
+        yield key, chat
+
+def build_cache(records: List[Dict]) -> Optional[Dict]:
+    """Replay a chat's records into a cache, or None if their positions aren't contiguous from 0"""
+    records = sorted(records, key=lambda record: (record['row'], record['msg_type'], record['pos']))
+    history_cache = journal.empty_cache()
+    expected = {}
+    for record in records:
+        slot = (record['row'], record['msg_type'])
+        if record['pos'] != expected.get(slot, 0) or record['msg_type'] not in (0, 1) or record['row'] < 0:
+            return None
+        expected[slot] = record['pos'] + 1
+        event = journal.make_swipe_event(*slot, record['visible'], record['internal'])
+        event['ts'] = record.get('time')
+        journal.apply_event(history_cache, event)
+    # Swipe and selection events link the previous slot on their own, so the recorded links are set last
+    for record in records:
+        if record.get('selected'):
+            journal.apply_event(history_cache, {'op': 'pos', 'i': record['row'], 't': record['msg_type'], 'p': record['pos']})
+    for record in records:
+        journal.apply_event(history_cache, {'op': 'link', 'i': record['row'], 't': record['msg_type'], 'p': record['pos'], 'c': record.get('next')})
+    return history_cache
+
+def verify(key: Key, history_cache: Dict) -> Optional[str]:
+    """Check a cache against its chat's history file like reconcile() does, selecting the swipes the history shows.
+    Returns why they don't match (a cached message without the history's text), or None if they do"""
+    history_path = cache.get_history_file_path(key[1], key[0], key[2])
+    if not history_path.exists():
+        return 'no history'
+    with open(history_path, 'r', encoding='utf-8') as f:
+        history = json.load(f)
+    fixes = reconcile.plan(history_cache, history)
+    if any(fix['fix'] == 'adopted' for _, fix in fixes):
+        return 'history mismatch'
+    for event, _ in fixes:
+        journal.apply_event(history_cache, event)
+    return None
+
+def import_chat(key: Key, records: List[Dict], replace: bool = False, check: bool = True) -> str:
+    """Write a chat's records to the active store. Returns 'imported' or why the chat was skipped ('stale' if another
+    process wrote the chat meanwhile, so the store refused it)"""
+    location = cache.get_cache_location(key[1], key[0], key[2])
+    if cache.is_loaded(key):
+        return 'loaded'
+    if cache.store.exists(location) and not replace:
+        return 'exists'
+    history_cache = build_cache(records)
+    if history_cache is None:
+        return 'invalid'
+    if check:
+        problem = verify(key, history_cache)
+        if problem is not None:
+            return problem
+    packed = journal.pack_snapshot(history_cache)
+    if cache.store.exists(location):
+        writer.discard(location)
+        cache.store.delete(location)
+    writer.snapshot(location, lambda: packed)
+    try:
+        if writer.flush(location, strict=True):
+            return 'imported'
+    except journal.StaleCacheError:
+        return 'stale'
+    writer.discard(location)  # Don't let the writer retry it behind the report's back
+    return 'error'
+
+def import_archive(path: Optional[Path] = None, replace: bool = False, check: bool = True) -> Dict:
+    """Import every chat of the archive at `path` into the active store and return a report.
+    Chats that are loaded, or (unless `replace`) already cached, are skipped; so are chats that don't match their
+    history (unless `check` is off)."""
+    start = time.perf_counter()
+    path = Path(path) if path else get_archive_path()
+    report = {'path': str(path), 'chats': 0, 'swipes': 0, 'skipped': {}}
+    seen = set()
+    slots = threading.BoundedSemaphore(WORKERS)  # Chats read ahead of the workers
+    report_lock = threading.Lock()
+
+    def run(key: Key, records: List[Dict]):
+        try:
+            try:
+                status = import_chat(key, records, replace, check)
+            except Exception as e:
+                print(f"{_ERROR}Could not import cache {key[0]} || {key[1]}:{_RESET} {e}")
+                traceback.print_exc()
+                status = 'error'
+            with report_lock:
+                if status == 'imported':
+                    report['chats'] += 1
+                    report['swipes'] += len(records)
+                else:
+                    report['skipped'][status] = report['skipped'].get(status, 0) + 1
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='boogaplus-import') as executor:
+        for key, records in read_chats(read_records(path)):
+            if key in seen:  # Split across the archive; its other part would overwrite it
+                report['skipped']['duplicate'] = report['skipped'].get('duplicate', 0) + 1
+                continue
+            seen.add(key)
+            slots.acquire()
+            executor.submit(run, key, records)
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    skipped = sum(report['skipped'].values())
+    print(f"{_SUCCESS}Imported {report['swipes']} swipes of {report['chats']} chats from {path} in {report['seconds']}s"
+          f"{f' ({skipped} skipped)' if skipped else ''}{_RESET}")
+    return report
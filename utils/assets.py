@@ -0,0 +1,101 @@
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+import hashlib
+import os
+import threading
+import time
+
+"""
+Static asset resolution for the chat renderers.
+
+Avatars: resolve() caches whether an avatar file exists and a hash of its contents, which is used as its URL's query
+string, so browsers only re-fetch an avatar when it actually changed. Entries are re-checked (one stat) when their
+context changes (e.g. another character was loaded), when a redraw asks for it, or after CHECK_INTERVAL seconds; the
+file is only re-hashed when its mtime or size changed. Streamed chunks in between cost no filesystem access.
+
+Chat styles: once mount() added the style route to the app, style_tag() links each chat style as a separate, cacheable
+stylesheet (versioned by a hash of its CSS) instead of inlining it into every HTML payload.
+"""
+
+CHECK_INTERVAL = 2.0  # Seconds an avatar's cached state is trusted before it is checked again
+STYLE_ROUTE = '/boogaplus/style'
+
+class _Avatar:
+    __slots__ = ('checked', 'stat', 'digest', 'context')
+    def __init__(self, checked: float, stat: Optional[Tuple[int, int]], digest: Optional[str], context: str):
+        self.checked = checked
+        self.stat = stat
+        self.digest = digest
+        self.context = context
+
+_lock = threading.Lock()
+_avatars: Dict[str, _Avatar] = {}
+_styles: Dict[str, Tuple[str, str]] = {}  # style name -> (CSS it was hashed from, hash)
+_styles_source: Optional[Dict[str, str]] = None  # Chat styles served by the style route (None until mounted)
+
+def _hash_file(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    except OSError:
+        return None
+
+def resolve(path: str, context: str = '', refresh: bool = False) -> Optional[str]:
+    """Content hash of the file at `path`, or None if it doesn't exist"""
+    now = time.monotonic()
+    with _lock:
+        avatar = _avatars.get(path)
+        if avatar is not None and not refresh and avatar.context == context and now - avatar.checked < CHECK_INTERVAL:
+            return avatar.digest
+    try:
+        stat = os.stat(path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        stat_key = None
+    if stat_key is None:
+        digest = None
+    elif avatar is not None and avatar.stat == stat_key:
+        digest = avatar.digest
+    else:
+        digest = _hash_file(path)
+    with _lock:
+        _avatars[path] = _Avatar(now, stat_key, digest, context)
+    return digest
+
+def invalidate(path: Optional[str] = None):
+    """Forget the cached state of an avatar (or of every avatar)"""
+    with _lock:
+        if path is None:
+            _avatars.clear()
+        else:
+            _avatars.pop(path, None)
+
+def style_tag(name: str, css: str) -> str:
+    """<link> to the chat style `name` if the style route is mounted, or the inline <style> otherwise"""
+    if _styles_source is None:
+        return f'<style>{css}</style>'
+    cached = _styles.get(name)
+    if cached is None or cached[0] is not css:
+        cached = _styles[name] = (css, hashlib.blake2b(css.encode('utf-8'), digest_size=8).hexdigest())
+    # Relative like TGWUI's file/ URLs, so it resolves under the app's root path when the UI is served from a subpath
+    return f'<link rel="stylesheet" href="{STYLE_ROUTE.lstrip("/")}/{quote(name)}.css?v={cached[1]}">'
+
+def mount(app, styles: Dict[str, str]) -> bool:
+    """Serve the chat styles in `styles` at {STYLE_ROUTE}/{name}.css from a FastAPI app.
+    Responses are cacheable indefinitely, since style_tag() changes the URL whenever the CSS changes."""
+    global _styles_source
+    if app is None or getattr(app, '_boogaplus_styles', False):
+        return False
+    from fastapi import HTTPException
+    from fastapi.responses import Response
+
+    def style_endpoint(name: str):
+        css = styles.get(name)
+        if css is None:
+            raise HTTPException(status_code=404, detail=f"unknown chat style: {name}")
+        return Response(css, media_type='text/css', headers={'Cache-Control': 'public, max-age=31536000, immutable'})
+
+    app.add_api_route(STYLE_ROUTE + '/{name}.css', style_endpoint, methods=['GET'])
+    app._boogaplus_styles = True
+    _styles_source = styles
+    return True
@@ -1,11 +1,23 @@
-from typing import Dict, List, Optional, Coroutine
+from typing import Dict, List, Optional, Coroutine, Tuple
+from collections import OrderedDict
 from modules import shared
 import modules.chat as chat
 get_history_file_path = chat.get_history_file_path
 from pathlib import Path
 import json
+import threading
 import traceback
 
+import extensions.boogaplus.utils.journal as journal
+import extensions.boogaplus.utils.database as database
+import extensions.boogaplus.utils.snapshot as snapshot
+import extensions.boogaplus.utils.reconcile as reconcile
+import extensions.boogaplus.utils.retention as retention
+from extensions.boogaplus.utils.writer import writer
+from extensions.boogaplus.utils.pool import StringPool
+from extensions.boogaplus.utils.nav import NavTable
+import extensions.boogaplus.utils.metrics as metrics
+
 # Colour codes
 _ERROR = "\033[1;31m"
 _SUCCESS = "\033[1;32m"
@@ -16,74 +28,453 @@ _BOLD = "\033[1;37m"
 _RESET = "\033[0m"
 
 _mode = 'html'
-_current_character = None
-_current_id = None
-_history_cache = {'visible': [], 'internal': []}
+
+MAX_CHATS = 16                   # Loaded chat caches kept in the registry
+MAX_BYTES = 64 * 1024 * 1024     # Approximate combined size of loaded chat caches
+MAX_FIXES = 100                  # Reconciliation fixes remembered per chat cache
+
+BACKEND = 'files'  # 'files' (snapshot + journal next to each history file) or 'sqlite' (one database, see utils/database.py)
+store = journal    # Storage of the active backend
 
 def validate_list(lst: List, i: int):
     """Ensure list is properly extended to index i"""
     if len(lst) <= i:
         lst.extend([None] * (i + 1 - len(lst)))
 
-def validate_cache(i: int):
+def validate_cache(history_cache: Dict, i: int):
     """Ensure cache is properly extended to index i"""
-    global _history_cache
-    
     # Initialize or extend cache if needed
     for cache_type in ['visible', 'internal']:
-        validate_list(_history_cache[cache_type], i)
+        validate_list(history_cache[cache_type], i)
 
-def initialize_cache(i: int):
+def initialize_cache(history_cache: Dict, i: int):
     """Initialize message cache dicts at index `i` if nonexistent"""
-    global _history_cache
     for cache_type in ['visible', 'internal']:
-        if _history_cache[cache_type][i] is None or not isinstance(_history_cache[cache_type][i], list):
+        if history_cache[cache_type][i] is None or not isinstance(history_cache[cache_type][i], list):
             print(f"{_GRAY}Initializing empty {cache_type} cache at index {i}{_RESET}")
-            _history_cache[cache_type][i] = [
+            history_cache[cache_type][i] = [
                 {'text': []},  # User message cache
                 {'text': []}   # Bot message cache
             ]
 
-def update_cache(state: Dict) -> bool:
-    """Update the current cache based on character or chat ID changes"""
-    global _current_character, _current_id, _history_cache
-    
-    if _current_character != state['character_menu'] or _current_id != state['unique_id']:
-        print(f"{_HILITE}Cache update needed:{_RESET} {_current_character} -> {state['character_menu']} {_GRAY}||{_RESET} {_current_id} -> {state['unique_id']}{_RESET}")
-        
-        # Save current cache if it exists
-        if _current_character and _current_id:
-            save_cache(state['mode'])
-        
-        _current_character = state['character_menu']
-        _current_id = state['unique_id']
-        
-        # Load new cache
-        path = get_cache_path(_current_id, _current_character, state['mode'])
-        if not path.exists():
-            _history_cache = {'visible': [], 'internal': []}
-            print(f"{_INPUT}Initialized empty cache{_RESET}")
+def _mode_key(mode: Optional[str]) -> str:
+    """Normalize a TGWUI mode to the history directory it maps to (chat and chat-instruct share logs/chat)"""
+    mode = mode or shared.persistent_interface_state.get('mode') or 'chat-instruct'
+    return 'instruct' if mode == 'instruct' else 'chat'
+
+class ChatCache:
+    """Loaded swipe cache of a single chat, keyed by (character, unique_id, mode)"""
+    def __init__(self, key: Tuple[str, str, str], path, data: Dict, journal_length: int = 0, size: int = 0, string_pool: Optional[StringPool] = None):
+        self.key = key
+        self.path = path                      # Location in the store (see get_cache_location)
+        self.data = data                      # {'visible': [...], 'internal': [...]}
+        self.pool = string_pool or StringPool()  # Shares identical swipe texts
+        self.nav = NavTable.from_cache(data)  # Positions/totals of every message, for rendering
+        self.journal_length = journal_length  # Events written to the journal since the last snapshot
+        self.size = size                      # Approximate resident size in bytes
+        self.lock = threading.RLock()         # Guards data against other Gradio workers and the background writer
+        self.reconciled = False               # Whether the cache was aligned with the history since it was loaded
+        self.fixes: List[Dict] = []           # Latest repairs made by reconcile() and prune()
+
+    def append(self, i: int, msg_type: int, visible_text: str, internal_text: str):
+        """Append a swipe at (`i`, `msg_type`), select it and journal it"""
+        with self.lock:
+            # Verify cache structure
+            validate_cache(self.data, i)
+            initialize_cache(self.data, i)
+            
+            # Append the strings to the respective lists
+            event = journal.make_swipe_event(i, msg_type, visible_text, internal_text)
+            self.apply(event)
+            self.size += len(visible_text) + (len(internal_text) if internal_text != visible_text else 0)
+            
+            # Persist only the new swipe
+            self.write_event(event)
+
+    def extend(self, i: int, msg_type: int, swipes: List[Tuple[str, str]], select: int = 0) -> Optional[int]:
+        """Append (visible, internal) swipes at (`i`, `msg_type`) as one batch and select the `select`th of them.
+        Returns the position of the first one (None if there were none); the batch is queued as a single write."""
+        if not swipes:
+            return None
+        with self.lock:
+            validate_cache(self.data, i)
+            initialize_cache(self.data, i)
+            first = self.nav.get(i, msg_type)[1]
+            events = [journal.make_swipe_event(i, msg_type, visible_text, internal_text) for visible_text, internal_text in swipes]
+            if select != len(swipes) - 1:  # Appending selects the last swipe
+                events.append({'op': 'pos', 'i': i, 't': msg_type, 'p': first + select})
+            for event in events:
+                self.apply(event)
+                writer.append(self.path, event, lock=self.lock)
+            self.size += sum(len(visible_text) + (len(internal_text) if internal_text != visible_text else 0) for visible_text, internal_text in swipes)
+            self.journal_length += len(events)
+            if store.MAX_JOURNAL_EVENTS is not None and self.journal_length >= store.MAX_JOURNAL_EVENTS:
+                self.save()
+        return first
+
+    def set_position(self, i: int, msg_type: int, pos: int):
+        """Select the cached message at `pos` and journal the change"""
+        with self.lock:
+            event = {'op': 'pos', 'i': i, 't': msg_type, 'p': pos}
+            self.apply(event)
+            self.write_event(event)
+
+    def link(self, i: int, msg_type: int, pos: int, next_pos: int):
+        """Set the continuation of swipe `pos` of (`i`, `msg_type`) and journal it (see utils/journal.py)"""
+        with self.lock:
+            event = {'op': 'link', 'i': i, 't': msg_type, 'p': pos, 'c': next_pos}
+            self.apply(event)
+            self.write_event(event)
+
+    def _link_slot(self, rows: List, slot: Tuple[int, int]) -> Optional[bool]:
+        """Link the selected swipe at `slot` to the message after it in the history `rows` (journaled only if it differs).
+        Returns whether the link was already right, or None if either message isn't cached."""
+        msg = journal.get_msg(self.data, *slot)
+        if msg is None:
+            return None
+        r, t = journal.next_slot(*slot)
+        if r >= len(rows) or (r == len(rows) - 1 and t == 1 and not rows[r][1]):  # The history ends at `slot`
+            next_pos = -1
+        else:
+            next_pos, total = self.nav.get(r, t)
+            if not total:
+                return None
+        selected = msg.get('pos', 0)
+        links = msg.get('next') or []
+        if (links[selected] if selected < len(links) else None) == next_pos:
             return True
+        self.link(*slot, selected, next_pos)
+        return False
+
+    def save_branch(self, history: Dict, i: int = 0, msg_type: int = 0, full: bool = False):
+        """Link the selected swipes from (`i`, `msg_type`) on to the messages that follow them in `history`, so the branch
+        can be restored once another swipe of (`i`, `msg_type`) was selected.
+        Selecting swipes keeps these links up to date, so unless `full`, this stops at the first link that is already
+        right (after checking where the history ends, which removing messages changes)."""
+        with self.lock:
+            rows = history['internal']
+            if rows:
+                self._link_slot(rows, (len(rows) - 1, 0))
+                self._link_slot(rows, (len(rows) - 1, 1))
+            slot = (i, msg_type)
+            while slot[0] < len(rows):
+                if self._link_slot(rows, slot) and not full:
+                    return
+                slot = journal.next_slot(*slot)
+
+    def restore_branch(self, history: Dict, i: int, msg_type: int) -> bool:
+        """Replace the messages after (`i`, `msg_type`) in `history` with the branch under its selected swipe, following
+        its links. The history is kept as is from the first unknown link on. Returns whether the history changed."""
+        with self.lock:
+            visible_rows, internal_rows = history['visible'], history['internal']
+            changed = False
+            slot = (i, msg_type)
+            while True:
+                msg = journal.get_msg(self.data, *slot)
+                selected = msg.get('pos', 0)
+                links = msg.get('next') or []
+                link = links[selected] if selected < len(links) else None
+                if link is None:
+                    self.save_branch(history, *slot)
+                    break
+                r, t = following = journal.next_slot(*slot)
+                if link < 0:  # The branch ends at `slot`
+                    if t == 1 and r < len(internal_rows) and (visible_rows[r][1] or internal_rows[r][1]):
+                        visible_rows[r][1] = internal_rows[r][1] = ''
+                        changed = True
+                    length = r + 1 if t == 1 else r
+                    if len(internal_rows) > length:
+                        del visible_rows[length:]
+                        del internal_rows[length:]
+                        changed = True
+                    break
+                following_msg = journal.get_msg(self.data, r, t)
+                if following_msg is None or link >= len(following_msg['text']):
+                    self.save_branch(history, *slot)  # The rest of the history is kept, so it is linked from here on
+                    break
+                if self.nav.get(r, t)[0] != link:
+                    self.set_position(r, t, link)
+                while len(internal_rows) <= r:
+                    visible_rows.append(['', ''])
+                    internal_rows.append(['', ''])
+                internal_text = following_msg['text'][link]
+                if internal_rows[r][t] is not internal_text and internal_rows[r][t] != internal_text:
+                    visible_rows[r][t] = self.data['visible'][r][t]['text'][link]
+                    internal_rows[r][t] = internal_text
+                    changed = True
+                slot = following
+        if changed:
+            metrics.inc('branches_restored')
+        return changed
+
+    def reconcile(self, history: Dict, force: bool = False) -> List[Dict]:
+        """Align the cache with `history` in one pass (see utils/reconcile.py), journaling and recording the fixes.
+        Only runs once per load unless `force`d."""
+        with self.lock:
+            if self.reconciled and not force:
+                return []
+            fixes = []
+            for event, fix in reconcile.plan(self.data, history):
+                self.apply(event)
+                self.write_event(event)
+                fixes.append(fix)
+            self.save_branch(history, full=True)  # Links of swipes cached before they were recorded, or adopted
+            self.reconciled = True
+            self._record(fixes)
+        return fixes
+
+    def prune(self, rows: Optional[List[int]] = None) -> List[Dict]:
+        """Apply the retention limits (see utils/retention.py), journaling and recording what was pruned.
+        With `rows`, only those rows are checked against the per-message limits."""
+        with self.lock:
+            fixes = []
+            for event, fix in retention.plan(self.data, rows, size_hint=self.size):
+                self.apply(event)
+                self.write_event(event)
+                fixes.append(fix)
+            if not fixes:
+                return fixes
+            self.size = max(0, self.size - sum(fix['chars'] for fix in fixes))
+            self.fixes = (self.fixes + fixes)[-MAX_FIXES:]
+        metrics.inc('swipes_pruned', sum(fix['swipes'] for fix in fixes))
+        print(f"{_GRAY}Pruned cache {self.key[0]} || {self.key[1]}: {retention.describe(fixes)}{_RESET}")
+        return fixes
+
+    def _record(self, fixes: List[Dict]):
+        if not fixes:
+            return
+        self.fixes = (self.fixes + fixes)[-MAX_FIXES:]
+        metrics.inc('reconcile_fixes', len(fixes))
+        print(f"{_GRAY}Reconciled cache {self.key[0]} || {self.key[1]}: {reconcile.describe(fixes)}{_RESET}")
+
+    def summarize(self, i: int, msg_type: int, offset: int = 0, limit: int = 50, preview_chars: int = 80) -> Dict:
+        """Page of swipe summaries of (`i`, `msg_type`): position, length and first `preview_chars` characters of
+        each internal text, read without loading the full texts of lazily loaded caches"""
+        with self.lock:
+            pos, total = self.nav.get(i, msg_type)
+            offset = max(0, offset)
+            items = []
+            if total:
+                texts = self.data['internal'][i][msg_type]['text']
+                for p in range(offset, min(total, offset + max(0, limit))):
+                    length, preview = snapshot.summarize(texts, p, preview_chars)
+                    items.append({'pos': p, 'length': length, 'preview': preview})
+        return {'index': i, 'type': msg_type, 'pos': pos, 'total': total, 'offset': offset, 'items': items}
+
+    def apply(self, event: Dict):
+        """Apply a journal event to the cache and its nav table (without persisting it)"""
+        with self.lock:
+            journal.apply_event(self.data, event, self.pool)
+            if event['op'] == 'truncate':
+                self.nav.truncate(event['n'])
+            else:
+                self.nav.update(self.data, event['i'], event['t'])
+
+    def write_event(self, event: Dict):
+        """Queue an event for the journal, compacting it once it grows too long"""
+        with self.lock:
+            writer.append(self.path, event, lock=self.lock)
+            self.journal_length += 1
+            if store.MAX_JOURNAL_EVENTS is not None and self.journal_length >= store.MAX_JOURNAL_EVENTS:
+                self.save()
+
+    def save(self, flush: bool = False) -> bool:
+        """Queue a snapshot of the cache, truncating the journal (written synchronously if `flush`)"""
+        with self.lock:
+            if self.journal_length:
+                if store.MAX_JOURNAL_EVENTS is not None:  # Stores without a journal already hold every event
+                    data = self.data
+                    writer.snapshot(self.path, lambda: journal.pack_snapshot(data), lock=self.lock)
+                self.journal_length = 0
+        if flush:
+            return writer.flush(self.path)
+        return True
+
+"""Registry of loaded chat caches (LRU)"""
+_registry: OrderedDict[Tuple[str, str, str], ChatCache] = OrderedDict()
+_registry_lock = threading.Lock()
+_registry_bytes = 0
+
+def make_key(character: str, unique_id: str, mode: Optional[str]) -> Tuple[str, str, str]:
+    """Registry key of a chat's cache (instruct histories aren't per character, so neither are their keys)"""
+    mode = _mode_key(mode)
+    return ('' if mode == 'instruct' else character, unique_id, mode)
+
+def get_cache_key(state: Dict) -> Tuple[str, str, str]:
+    return make_key(state['character_menu'], state['unique_id'], state.get('mode'))
+
+def _load(key: Tuple[str, str, str], quiet: bool = False) -> ChatCache:
+    """Read a chat's cache from the store (empty if it has none), without adding it to the registry"""
+    path = get_cache_location(key[1], key[0], key[2])
+    writer.flush(path)  # Write out anything still pending for this chat (e.g. from an eviction)
+    data, journal_length, string_pool, size = journal.empty_cache(), 0, None, 0
+    try:
+        if not store.exists(path):
+            if not quiet:
+                print(f"{_INPUT}Initialized empty cache{_RESET}")
+        else:
+            metrics.inc('cache_loads')
+            data, journal_length, string_pool = store.load(path)
+            size = store.size(path)
+    except Exception as e:
+        print(f"{_ERROR}Initialized empty cache (error: {e}){_RESET}")
+    return ChatCache(key, path, data, journal_length, size, string_pool)
+
+def _register(chat_cache: ChatCache, recent: bool = True) -> ChatCache:
+    """Add a loaded cache to the registry, as most recently used or (`recent=False`) as the first to evict.
+    Returns the registered cache, which is another one if it was loaded concurrently (registry lock held)"""
+    global _registry_bytes
+    key = chat_cache.key
+    if key in _registry:
+        if recent:
+            _registry.move_to_end(key)
+        return _registry[key]
+    _registry[key] = chat_cache
+    if not recent:
+        _registry.move_to_end(key, last=False)
+    _registry_bytes += chat_cache.size
+    _evict()
+    return chat_cache
+
+@metrics.timed('update_cache')
+def update_cache(state: Dict) -> ChatCache:
+    """Get the cache of the state's chat, loading it from disk if it is not in the registry"""
+    global _registry_bytes
+    
+    key = get_cache_key(state)
+    with _registry_lock:
+        chat_cache = _registry.get(key)
+    if chat_cache is not None:
+        if not _is_stale(chat_cache):
+            with _registry_lock:
+                if key in _registry:
+                    _registry.move_to_end(key)
+            metrics.inc('cache_hits')
+            return chat_cache
+        # Written by another process since it was loaded: reload it (after writing out our own pending changes)
+        print(f"{_HILITE}Cache changed by another process:{_RESET} {key[0]} {_GRAY}||{_RESET} {key[1]}{_RESET}")
+        metrics.inc('cache_reloads')
+        with _registry_lock:
+            if _registry.get(key) is chat_cache:
+                del _registry[key]
+                _registry_bytes -= chat_cache.size
+    else:
+        metrics.inc('cache_misses')
+        print(f"{_HILITE}Cache update needed:{_RESET} {key[0]} {_GRAY}||{_RESET} {key[1]}{_RESET}")
+    
+    # Load outside the registry lock so other sessions aren't blocked on disk I/O
+    chat_cache = _load(key)
+    with _registry_lock:
+        return _register(chat_cache)
+
+def _is_stale(chat_cache: ChatCache) -> bool:
+    """Whether another process wrote the cache since it was loaded (see journal.is_stale)"""
+    try:
+        return store.is_stale(chat_cache.path)
+    except Exception as e:
+        print(f"{_ERROR}Could not check cache generation:{_RESET} {e}")
+        return False
+
+def is_loaded(key: Tuple[str, str, str]) -> bool:
+    with _registry_lock:
+        return key in _registry
+
+def get_loaded(key: Tuple[str, str, str]) -> Optional[ChatCache]:
+    """A chat's cache if it is loaded (without loading it or counting as a use)"""
+    with _registry_lock:
+        return _registry.get(key)
+
+def preload(key: Tuple[str, str, str]) -> bool:
+    """Load a chat's cache into the registry ahead of use, behind every cache already in use so it never evicts one.
+    Returns False if it was already loaded or has no cache"""
+    if is_loaded(key):
+        return False
+    path = get_cache_location(key[1], key[0], key[2])
+    if not store.exists(path):
+        return False
+    chat_cache = _load(key, quiet=True)
+    with _registry_lock:
+        _register(chat_cache, recent=False)
+        return _registry.get(key) is chat_cache  # Evicted right away if the registry is full
+
+def prune_cache(key: Tuple[str, str, str]) -> List[Dict]:
+    """Apply the retention limits to a chat's cache and snapshot it, loading it behind the caches in use if needed"""
+    with _registry_lock:
+        chat_cache = _registry.get(key)
+    if chat_cache is None:
+        if not store.exists(get_cache_location(key[1], key[0], key[2])):
+            return []
+        chat_cache = _load(key, quiet=True)
+        with _registry_lock:
+            chat_cache = _register(chat_cache, recent=False)
+    fixes = chat_cache.prune()
+    if fixes:
+        chat_cache.save(flush=True)
+    return fixes
+
+def registry_stats() -> Tuple[int, int]:
+    """(loaded caches, their approximate combined size in bytes)"""
+    with _registry_lock:
+        return len(_registry), _registry_bytes
+
+def get_recent_cache() -> Optional[ChatCache]:
+    """Get the most recently used chat cache"""
+    with _registry_lock:
+        return next(reversed(_registry.values()), None)
+
+def _evict():
+    """Evict least recently used caches over the count/byte budget, flushing them to disk (registry lock held)"""
+    global _registry_bytes
+    _registry_bytes = sum(chat_cache.size for chat_cache in _registry.values())
+    while len(_registry) > 1 and (len(_registry) > MAX_CHATS or _registry_bytes > MAX_BYTES):
+        key, chat_cache = _registry.popitem(last=False)
+        _registry_bytes -= chat_cache.size
+        metrics.inc('cache_evictions')
+        print(f"{_GRAY}Evicting cache {key[0]} || {key[1]}{_RESET}")
+        chat_cache.save()  # update_cache() flushes the writer before reloading, so this is never read stale
+
+def configure(max_chats: Optional[int] = None, max_bytes: Optional[int] = None, backend: Optional[str] = None):
+    global MAX_CHATS, MAX_BYTES
+    if max_chats is not None:
+        MAX_CHATS = max(1, int(max_chats))
+    if max_bytes is not None:
+        MAX_BYTES = max(0, int(max_bytes))
+    if backend is not None and backend != BACKEND:
+        set_backend(backend)
+    with _registry_lock:
+        _evict()
+
+def get_logs_dir() -> Path:
+    """TGWUI's logs directory (parent of logs/chat and logs/instruct)"""
+    return get_history_file_path('', '', 'instruct').parent.parent
+
+def set_backend(backend: str):
+    """Switch the storage backend, writing out and unloading every cache of the current one.
+    The first time the SQLite backend is used, existing .json.cache files are imported into it."""
+    global BACKEND, store, _registry_bytes
+    if backend not in ('files', 'sqlite'):
+        print(f"{_ERROR}Unknown cache backend:{_RESET} {backend}")
+        return
+    new_store = journal
+    if backend == 'sqlite':
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                contents = f.read()
-                if contents:
-                    _history_cache = json.loads(contents)
-                else:
-                    _history_cache = {'visible': [], 'internal': []}
-                    print(f"{_INPUT}Initialized empty cache{_RESET}")
+            new_store = database.SQLiteStore(get_logs_dir() / 'boogaplus.sqlite3')
+            database.import_caches(new_store, get_logs_dir())
         except Exception as e:
-            _history_cache = {'visible': [], 'internal': []}
-            print(f"{_ERROR}Initialized empty cache (error: {e}){_RESET}")
-        return True
-    return False
+            print(f"{_ERROR}Could not open the cache database, keeping {BACKEND} backend:{_RESET} {e}")
+            traceback.print_exc()
+            return
+    save_cache()
+    writer.configure(store=new_store)  # Flushes pending writes to the old store first
+    with _registry_lock:
+        _registry.clear()
+        _registry_bytes = 0
+        BACKEND, store = backend, new_store
 
+@metrics.timed('append_to_cache')
 def append_to_cache(history: Dict, state: Dict, is_bot=True) -> bool:
     """Append a message to the end of the cache"""
-    global _history_cache, _current_character, _current_id
-    
-    # Update cache if character/chat changed
-    update_cache(state)
+    chat_cache = update_cache(state)
     
     msg_type = 1 if is_bot else 0  # int(is_bot)
     i = len(history['visible']) - 1
@@ -92,58 +483,23 @@ def append_to_cache(history: Dict, state: Dict, is_bot=True) -> bool:
         return False
     internal_text = history['internal'][i][msg_type]
     try:
-        # Verify cache structure
-        validate_cache(i)
-        initialize_cache(i)
-        
-        # Initialize the message arrays if they don't exist
-        if not _history_cache['visible'][i][msg_type] or not _history_cache['internal'][i][msg_type]:
-            _history_cache['visible'][i][msg_type] = {'text': []}
-            _history_cache['internal'][i][msg_type] = {'text': []}
-        
-        # Append the strings to the respective lists
-        length = len(_history_cache['visible'][i][msg_type]['text'])
-        _history_cache['visible'][i][msg_type]['text'].append(visible_text)
-        _history_cache['visible'][i][msg_type]['pos'] = length
-        _history_cache['internal'][i][msg_type]['text'].append(internal_text)
-        _history_cache['internal'][i][msg_type]['pos'] = length
-        
-        # Save cache to disk
-        save_cache(state['mode'])
+        chat_cache.append(i, msg_type, visible_text, internal_text)
+        if retention.enabled():
+            chat_cache.prune(rows=[i])
         return True
-        
     except Exception as e:
         print(f"{_ERROR}Error appending to cache: {e}{_RESET}")
         traceback.print_exc()
     return False
 
-def save_cache(mode: Optional[str] = None) -> bool:
-    """Save the cache to disk"""
-    global _history_cache, _current_character, _current_id
-    
-    if not _current_id or not _current_character:
-        return False
-    
-    path = get_cache_path(_current_id, _current_character, mode or shared.persistent_interface_state['mode'] or 'chat-instruct')
-    try:
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(_history_cache, f, indent=4)
-        return True
-    except Exception as e:
-        print(f"{_ERROR}Error saving cache:{_RESET} {e}")
-        traceback.print_exc()
-    return False
-
-def get_position(msg_cache: List) -> Optional[int]:
-    """Get the current position of the message's cache"""
-    try:
-        if len(msg_cache) == 0:
-            return None
-        return next(i for i, text in enumerate(msg_cache) if not text)  # Find the first None value
-    except Exception as e:
-        print(f"{_ERROR}Error getting position:{_RESET} {e}")
-        traceback.print_exc()
-    return None
+def save_cache(flush: bool = False) -> bool:
+    """Save every loaded cache to disk"""
+    with _registry_lock:
+        chat_caches = list(_registry.values())
+    success = True
+    for chat_cache in chat_caches:
+        success = chat_cache.save(flush) and success
+    return success
 
 def get_cache_path(unique_id: str, character: str, mode: str) -> Path:
     """Get the path to the cache file"""
@@ -152,6 +508,23 @@ def get_cache_path(unique_id: str, character: str, mode: str) -> Path:
         path.mkdir(parents=True)
     return path / f'{unique_id}.json.cache'
 
+def get_cache_location(unique_id: str, character: str, mode: str):
+    """Get the location of a chat's cache in the active backend: its cache file path, or its database key
+    (instruct histories aren't per character, so neither are their caches)"""
+    if BACKEND == 'sqlite':
+        mode = _mode_key(mode)
+        return ('' if mode == 'instruct' else character, mode, unique_id)
+    return get_cache_path(unique_id, character, mode)
+
+def get_location_key(location) -> Optional[Tuple[str, str, str]]:
+    """Registry key of a cache location of either backend (None if a path isn't a chat's cache)"""
+    if isinstance(location, Path):
+        location = database.location_from_path(location, get_logs_dir())
+        if location is None:
+            return None
+    character, mode, unique_id = location
+    return make_key(character, unique_id, mode)
+
 
 # // TGWUI Monkey Patches // #
 
@@ -159,14 +532,11 @@ import logging as logger
 
 """rename_history"""
 get_history_file_path = chat.get_history_file_path
+@metrics.timed('rename_history')
 def rename_history(old_id, new_id, character, mode):
     '''
     BOOGAPLUS MONKEY PATCH
     '''
-    global _current_id
-    if shared.args.multi_user:
-        return
-
     old_p = get_history_file_path(old_id, character, mode)
     new_p = get_history_file_path(new_id, character, mode)
     if new_p.parent != old_p.parent:
@@ -176,24 +546,46 @@ def rename_history(old_id, new_id, character, mode):
     elif new_p.exists():
         logger.error(f"The new path already exists and will not be overwritten: \"{new_p}\".")
     else:
-        logger.info(f"Renaming \"{old_p}\" to \"{new_p}\"")
-        old_p.rename(new_p)
-        logger.info(f"{_BOLD}boogaplus: Renaming \"{old_p}\" ({_current_id}) cache to \"{new_p}\"{_RESET}")
-        get_cache_path(old_id, character, mode).rename(get_cache_path(new_id, character, mode))
-        _current_id = new_id
+        if old_p.exists():  # Histories aren't saved in multi-user mode, but their caches still are
+            logger.info(f"Renaming \"{old_p}\" to \"{new_p}\"")
+            old_p.rename(new_p)
+        
+        old_cache_p = get_cache_location(old_id, character, mode)
+        new_cache_p = get_cache_location(new_id, character, mode)
+        logger.info(f"{_BOLD}boogaplus: Renaming \"{old_cache_p}\" cache to \"{new_cache_p}\"{_RESET}")
+        old_key, new_key = make_key(character, old_id, mode), make_key(character, new_id, mode)
+        
+        def repoint():  # Under the writer's io lock, so nothing is written to either path until the cache follows
+            global _registry_bytes
+            with _registry_lock:
+                replaced = _registry.pop(new_key, None)
+                if replaced is not None:  # Its file was just overwritten
+                    _registry_bytes -= replaced.size
+                chat_cache = _registry.pop(old_key, None)
+                if chat_cache is not None:
+                    with chat_cache.lock:  # New writes go to the new path from here on
+                        chat_cache.key, chat_cache.path = new_key, new_cache_p
+                    _registry[new_key] = chat_cache
+        writer.move(old_cache_p, new_cache_p, repoint=repoint)
 chat.rename_history = rename_history
 
 """handle_delete_chat_confirm_click"""
 delete_file = chat.delete_file
 _handle_delete_chat_confirm_click = chat.handle_delete_chat_confirm_click
+@metrics.timed('handle_delete_chat_confirm_click')
 def handle_delete_chat_confirm_click(state):
     '''
     BOOGAPLUS MONKEY PATCH
     '''
-    global _current_id
+    global _registry_bytes
     result = _handle_delete_chat_confirm_click(state)
-    delete_file(get_cache_path(state['unique_id'], state['character_menu'], state['mode']))
-    _current_id = None
+    with _registry_lock:
+        chat_cache = _registry.pop(get_cache_key(state), None)
+        if chat_cache is not None:
+            _registry_bytes -= chat_cache.size
+    path = get_cache_location(state['unique_id'], state['character_menu'], state['mode'])
+    writer.discard(path)
+    store.delete(path)
     return result
 chat.handle_delete_chat_confirm_click = handle_delete_chat_confirm_click
 
@@ -201,6 +593,7 @@ chat.handle_delete_chat_confirm_click = handle_delete_chat_confirm_click
 replace_last_reply = chat.replace_last_reply
 save_history = chat.save_history
 redraw_html = chat.redraw_html
+@metrics.timed('handle_replace_last_reply_click')
 def handle_replace_last_reply_click(text, state):
     '''
     BOOGAPLUS MONKEY PATCH
@@ -217,6 +610,7 @@ chat.handle_replace_last_reply_click = handle_replace_last_reply_click
 
 """handle_send_dummy_reply_click"""
 send_dummy_reply = chat.send_dummy_reply
+@metrics.timed('handle_send_dummy_reply_click')
 def handle_send_dummy_reply_click(text, state):
     '''
     BOOGAPLUS MONKEY PATCH
@@ -231,6 +625,7 @@ chat.handle_send_dummy_reply_click = handle_send_dummy_reply_click
 
 """handle_send_dummy_message_click"""
 send_dummy_message = chat.send_dummy_message
+@metrics.timed('handle_send_dummy_message_click')
 def handle_send_dummy_message_click(text, state):
     '''
     BOOGAPLUS MONKEY PATCH
@@ -0,0 +1,163 @@
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import threading
+import time
+import traceback
+
+from modules import shared
+
+import extensions.boogaplus.utils.cache as cache
+import extensions.boogaplus.utils.retention as retention
+from extensions.boogaplus.utils.writer import writer
+import extensions.boogaplus.utils.metrics as metrics
+
+"""
+Storage garbage collection.
+
+collect() makes one pass over every stored chat cache:
+    - caches whose history no longer exists (e.g. deleted outside TGWUI's delete button) are removed, along with stray
+      temporary files of interrupted snapshot writes and lock files of removed caches
+    - the retention limits (utils/retention.py) are applied to the rest, and pruned caches are snapshotted
+and reports the space it reclaimed. Caches of loaded chats are never removed, and recently written cache files get a
+grace period, since a new chat's history may be saved just after its first swipe.
+In multi-user mode histories aren't saved, so no cache is considered orphaned.
+"""
+
+# Colour codes
+_ERROR = "\033[1;31m"
+_SUCCESS = "\033[1;32m"
+_GRAY = "\033[0;30m"
+_RESET = "\033[0m"
+
+GRACE = 3600      # Seconds before a cache file without a history counts as orphaned
+INTERVAL = 24 * 3600  # Seconds between background passes (0 = only when requested)
+STARTUP_DELAY = 60    # Seconds after startup before the first background pass
+
+_lock = threading.Lock()  # One pass at a time
+_thread: Optional[threading.Thread] = None
+last_report: Optional[Dict] = None
+
+def configure(interval: Optional[float] = None):
+    global INTERVAL
+    if interval is not None:
+        INTERVAL = max(0, float(interval))
+
+def _file_caches(logs_dir: Path) -> Dict[Path, List[Path]]:
+    """Cache files (snapshot, journal, lock file, temporary snapshot) under `logs_dir`, grouped by snapshot path"""
+    caches: Dict[Path, List[Path]] = {}
+    for directory in [*logs_dir.glob('chat/*'), logs_dir / 'instruct']:
+        if not directory.is_dir():
+            continue
+        for path in directory.glob('*.json.cache*'):
+            name = path.name
+            for suffix in ('.journal', '.lock', '.tmp'):
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            if name.endswith('.json.cache'):
+                caches.setdefault(path.with_name(name), []).append(path)
+    return caches
+
+def _history_path(key: Tuple[str, str, str]) -> Path:
+    return cache.get_history_file_path(key[1], key[0], key[2])
+
+def stored_caches(logs_dir: Path) -> List[Tuple[Tuple[str, str, str], object, List[Path]]]:
+    """(key, location, files) of every cache of the active backend (`files` only for the files backend)"""
+    if cache.BACKEND == 'sqlite':
+        return [(cache.make_key(character, unique_id, mode), (character, mode, unique_id), []) for character, mode, unique_id, _ in cache.store.chats()]
+    stored = []
+    for cache_path, files in sorted(_file_caches(logs_dir).items()):
+        key = cache.get_location_key(cache_path)
+        if key is not None:
+            stored.append((key, cache_path, files))
+    return stored
+
+def _last_write(location, files: List[Path]) -> Optional[float]:
+    """When a cache was last written: its newest file, or the time the SQLite store recorded (None if unknown)"""
+    if cache.BACKEND == 'sqlite':
+        return cache.store.modified(location)
+    return max((path.stat().st_mtime for path in files), default=None)
+
+def _is_orphan(key: Tuple[str, str, str], location, files: List[Path], now: float) -> bool:
+    if shared.args.multi_user or cache.is_loaded(key) or _history_path(key).exists():
+        return False
+    try:
+        last_write = _last_write(location, files)
+    except OSError:  # Removed while scanning
+        return False
+    return last_write is not None and now - last_write > GRACE
+
+def _remove_stray(files: List[Path], now: float, exists: bool) -> int:
+    """Remove temporary snapshot files left by interrupted writes, and the lock file of a cache that doesn't `exist`
+    anymore, returning the bytes reclaimed"""
+    reclaimed = 0
+    for path in files:
+        if path.name.endswith('.tmp') or (not exists and path.name.endswith('.lock')):
+            try:
+                if now - path.stat().st_mtime > GRACE:
+                    reclaimed += path.stat().st_size
+                    path.unlink()
+            except OSError:
+                pass
+    return reclaimed
+
+def collect() -> Dict:
+    """Run one garbage collection pass and return its report"""
+    global last_report
+    with _lock:
+        start = time.perf_counter()
+        now = time.time()
+        logs_dir = cache.get_logs_dir()
+        report = {'orphans': 0, 'chats_pruned': 0, 'swipes_pruned': 0, 'bytes_reclaimed': 0}
+        for key, location, files in stored_caches(logs_dir):
+            try:
+                exists = cache.store.exists(location)
+                report['bytes_reclaimed'] += _remove_stray(files, now, exists)
+                if not exists:
+                    continue
+                if _is_orphan(key, location, files, now):
+                    size = cache.store.size(location)
+                    writer.discard(location)
+                    cache.store.delete(location)
+                    report['orphans'] += 1
+                    report['bytes_reclaimed'] += size
+                    continue
+                if retention.enabled():
+                    size = cache.store.size(location)
+                    fixes = cache.prune_cache(key)
+                    if fixes:
+                        report['chats_pruned'] += 1
+                        report['swipes_pruned'] += sum(fix['swipes'] for fix in fixes)
+                        report['bytes_reclaimed'] += max(0, size - cache.store.size(location))
+            except Exception as e:
+                print(f"{_ERROR}Storage GC failed for {location}:{_RESET} {e}")
+                traceback.print_exc()
+        report['seconds'] = round(time.perf_counter() - start, 3)
+        report['time'] = int(now)
+        last_report = report
+    metrics.inc('gc_bytes_reclaimed', report['bytes_reclaimed'])
+    if report['orphans'] or report['swipes_pruned']:
+        print(f"{_SUCCESS}Storage GC: removed {report['orphans']} orphaned caches, pruned {report['swipes_pruned']} swipes "
+              f"in {report['chats_pruned']} chats, reclaimed {report['bytes_reclaimed'] / 1024:.1f} KiB{_RESET}")
+    else:
+        print(f"{_GRAY}Storage GC: nothing to reclaim{_RESET}")
+    return report
+
+def start() -> Optional[threading.Thread]:
+    """Run collect() in the background, shortly after startup and then every INTERVAL seconds"""
+    global _thread
+    if not INTERVAL or (_thread is not None and _thread.is_alive()):
+        return None
+
+    def run():
+        time.sleep(STARTUP_DELAY)
+        while INTERVAL:
+            try:
+                collect()
+            except Exception as e:
+                print(f"{_ERROR}Storage GC failed:{_RESET} {e}")
+                traceback.print_exc()
+            time.sleep(INTERVAL)
+
+    _thread = threading.Thread(target=run, name='boogaplus-gc', daemon=True)
+    _thread.start()
+    return _thread
@@ -0,0 +1,394 @@
+from typing import Dict, List, Optional, Tuple
+from html import escape
+from pathlib import Path
+import sqlite3
+import threading
+import time
+import traceback
+
+import extensions.boogaplus.utils.journal as journal
+import extensions.boogaplus.utils.pool as pool
+from extensions.boogaplus.utils.pool import StringPool
+
+# Colour codes
+_ERROR = "\033[1;31m"
+_SUCCESS = "\033[1;32m"
+_INPUT = "\033[0;33m"
+_GRAY = "\033[0;30m"
+_HILITE = "\033[0;36m"
+_BOLD = "\033[1;37m"
+_RESET = "\033[0m"
+
+"""
+SQLite swipe store (alternative to the per-chat snapshot + journal files of utils/journal.py).
+
+Chats are located by (character, mode, unique_id) instead of a file path; every chat gets one row in `chats`, so
+renaming a chat is a single UPDATE no matter how many swipes it has. Swipes and selected positions are keyed by
+(chat, row, msg_type[, pos]) and stored in WITHOUT ROWID tables clustered on that key, so appending a swipe or
+selecting a position touches a single B-tree path.
+
+SQLite serializes writers across processes itself; every write also increments the chat's generation, so a process can
+tell that another one changed a chat since it was loaded (is_stale), like the lock files of utils/journal.py.
+Branch links (see utils/journal.py) are stored per swipe in `next_pos` and maintained by the same events.
+"""
+
+Location = Tuple[str, str, str]  # (character, mode, unique_id)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY,
+    character TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    unique_id TEXT NOT NULL,
+    generation INTEGER NOT NULL DEFAULT 0,  -- incremented by every write
+    modified REAL,  -- time of the last write (unix seconds)
+    UNIQUE (character, mode, unique_id)
+);
+CREATE TABLE IF NOT EXISTS swipes (
+    chat_id INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    msg_type INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    visible TEXT NOT NULL,
+    internal TEXT,  -- NULL if identical to visible
+    time INTEGER,   -- creation time (unix seconds), NULL if unknown
+    next_pos INTEGER,  -- position of the swipe that followed it in the next slot, -1 if none, NULL if unknown
+    PRIMARY KEY (chat_id, row, msg_type, pos)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS positions (
+    chat_id INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    msg_type INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, row, msg_type)
+) WITHOUT ROWID;
+"""
+
+class SQLiteStore:
+    """Swipe store backed by a single SQLite database in WAL mode.
+
+    Implements the same storage interface as utils/journal.py (exists/load/size/append_events/write_snapshot/rename/
+    delete), with (character, mode, unique_id) locations. Every event is committed on its own row, so there is no
+    journal to compact (`MAX_JOURNAL_EVENTS` is None)."""
+
+    MAX_JOURNAL_EVENTS = None
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()  # One connection per thread (WAL lets readers run alongside the writer)
+        self._generations: Dict[Location, int] = {}  # Generation of every chat as last loaded or written by this process
+        self._generations_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = [column[1] for column in conn.execute('PRAGMA table_info(swipes)')]
+            if 'time' not in columns:  # Created before swipe times
+                conn.execute('ALTER TABLE swipes ADD COLUMN time INTEGER')
+            if 'next_pos' not in columns:  # Created before branch links
+                conn.execute('ALTER TABLE swipes ADD COLUMN next_pos INTEGER')
+            columns = [column[1] for column in conn.execute('PRAGMA table_info(chats)')]
+            if 'generation' not in columns:
+                conn.execute('ALTER TABLE chats ADD COLUMN generation INTEGER NOT NULL DEFAULT 0')
+            if 'modified' not in columns:  # Created before write times; existing chats count as written now
+                conn.execute('ALTER TABLE chats ADD COLUMN modified REAL')
+                conn.execute('UPDATE chats SET modified = ?', (time.time(),))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints; a crash can only lose the last commits
+        return conn
+
+    def _chat_id(self, conn: sqlite3.Connection, location: Location, create: bool = False) -> Optional[int]:
+        row = conn.execute('SELECT id FROM chats WHERE character = ? AND mode = ? AND unique_id = ?', location).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        return conn.execute('INSERT INTO chats (character, mode, unique_id) VALUES (?, ?, ?)', location).lastrowid
+
+    def exists(self, location: Location) -> bool:
+        return self._chat_id(self._connect(), location) is not None
+
+    def _generation(self, conn: sqlite3.Connection, location: Location) -> int:
+        row = conn.execute('SELECT generation FROM chats WHERE character = ? AND mode = ? AND unique_id = ?', location).fetchone()
+        return row[0] if row else 0
+
+    def _bump_generation(self, conn: sqlite3.Connection, chat_id: int, location: Location, previous: int):
+        """Store generation `previous` + 1 and the write time (in the write's transaction), keeping track of the generation
+        if this process was in sync"""
+        conn.execute('UPDATE chats SET generation = ?, modified = ? WHERE id = ?', (previous + 1, time.time(), chat_id))
+        with self._generations_lock:
+            if self._generations.get(location, 0) == previous:
+                self._generations[location] = previous + 1
+
+    def generation(self, location: Location) -> int:
+        return self._generation(self._connect(), location)
+
+    def modified(self, location: Location) -> Optional[float]:
+        """Time of a chat's last write (unix seconds), or None if it isn't stored"""
+        row = self._connect().execute('SELECT modified FROM chats WHERE character = ? AND mode = ? AND unique_id = ?', location).fetchone()
+        return row[0] if row else None
+
+    def is_stale(self, location: Location) -> bool:
+        """Whether another process wrote the chat since this process last loaded or wrote it"""
+        with self._generations_lock:
+            known = self._generations.get(location, 0)
+        return self.generation(location) != known
+
+    def load(self, location: Location, track: bool = True) -> Tuple[Dict, int, StringPool]:
+        """Load a chat's cache. Returns the cache, 0 (no journal) and the cache's string pool.
+        Without `track`, the generation read isn't remembered (see journal.load)."""
+        history_cache = journal.empty_cache()
+        string_pool = StringPool()
+        conn = self._connect()
+        conn.execute('BEGIN')  # One read transaction, so the generation matches the rows read
+        try:
+            return self._load(conn, location, history_cache, string_pool, track)
+        finally:
+            conn.rollback()
+
+    def _load(self, conn: sqlite3.Connection, location: Location, history_cache: Dict, string_pool: StringPool, track: bool) -> Tuple[Dict, int, StringPool]:
+        chat_id = self._chat_id(conn, location)
+        if track:
+            with self._generations_lock:
+                self._generations[location] = self._generation(conn, location)
+        if chat_id is None:
+            return history_cache, 0, string_pool
+
+        visible_rows, internal_rows = history_cache['visible'], history_cache['internal']
+        intern = string_pool.intern
+        for i, msg_type, visible_text, internal_text, ts, link in conn.execute(
+            'SELECT row, msg_type, visible, internal, time, next_pos FROM swipes WHERE chat_id = ? ORDER BY row, msg_type, pos', (chat_id,)
+        ):
+            if len(visible_rows) <= i:
+                visible_rows.extend([None] * (i + 1 - len(visible_rows)))
+                internal_rows.extend([None] * (i + 1 - len(internal_rows)))
+            if visible_rows[i] is None:
+                visible_rows[i] = [{'text': []}, {'text': []}]
+                internal_rows[i] = [{'text': [], 'time': [], 'next': []}, {'text': [], 'time': [], 'next': []}]
+            visible_text = intern(visible_text)
+            visible_rows[i][msg_type]['text'].append(visible_text)
+            internal_msg = internal_rows[i][msg_type]
+            internal_msg['text'].append(intern(internal_text) if internal_text is not None else visible_text)
+            internal_msg['time'].append(ts)
+            internal_msg['next'].append(link)
+        for i, msg_type, pos in conn.execute('SELECT row, msg_type, pos FROM positions WHERE chat_id = ?', (chat_id,)):
+            if i < len(visible_rows) and visible_rows[i] is not None:
+                visible_rows[i][msg_type]['pos'] = internal_rows[i][msg_type]['pos'] = pos
+        return history_cache, 0, string_pool
+
+    def size(self, location: Location) -> int:
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT SUM(LENGTH(visible) + COALESCE(LENGTH(internal), 0)) FROM swipes WHERE chat_id = (SELECT id FROM chats WHERE character = ? AND mode = ? AND unique_id = ?)',
+            location
+        ).fetchone()
+        return row[0] or 0
+
+    def _link(self, conn: sqlite3.Connection, chat_id: int, i: int, msg_type: int, pos: int):
+        """Link the selected swipe of the slot before (`i`, `msg_type`) to swipe `pos` (see journal._link)"""
+        previous = journal.previous_slot(i, msg_type)
+        if previous is None:
+            return
+        conn.execute(
+            'UPDATE swipes SET next_pos = ? WHERE chat_id = ? AND row = ? AND msg_type = ? '
+            'AND pos = (SELECT pos FROM positions WHERE chat_id = ? AND row = ? AND msg_type = ?)',
+            (pos, chat_id, *previous, chat_id, *previous)
+        )
+
+    def _remap_links(self, conn: sqlite3.Connection, chat_id: int, i: int, msg_type: int, keep: Optional[List[int]]):
+        """Update the links into (`i`, `msg_type`) after its swipes were pruned down to `keep` (see journal._remap_links)"""
+        previous = journal.previous_slot(i, msg_type)
+        if previous is None:
+            return
+        new_positions = {pos: new_pos for new_pos, pos in enumerate(sorted(keep or ()))}
+        conn.executemany('UPDATE swipes SET next_pos = ? WHERE chat_id = ? AND row = ? AND msg_type = ? AND pos = ?', [
+            (new_positions.get(link), chat_id, *previous, pos)
+            for pos, link in conn.execute('SELECT pos, next_pos FROM swipes WHERE chat_id = ? AND row = ? AND msg_type = ? AND next_pos >= 0', (chat_id, *previous)).fetchall()
+            if new_positions.get(link) != link
+        ])
+
+    def _append_event(self, conn: sqlite3.Connection, chat_id: int, event: Dict) -> int:
+        op = event.get('op')
+        if op == 'truncate':
+            conn.execute('DELETE FROM swipes WHERE chat_id = ? AND row >= ?', (chat_id, event['n']))
+            conn.execute('DELETE FROM positions WHERE chat_id = ? AND row >= ?', (chat_id, event['n']))
+            self._remap_links(conn, chat_id, event['n'], 0, None)
+            return 0
+        i, msg_type = event['i'], event['t']
+        if op == 'swipe':
+            visible_text = event['v']
+            internal_text = event.get('n')
+            conn.execute(
+                'INSERT INTO swipes (chat_id, row, msg_type, pos, visible, internal, time, next_pos) '
+                'SELECT ?, ?, ?, COALESCE(MAX(pos) + 1, 0), ?, ?, ?, -1 FROM swipes WHERE chat_id = ? AND row = ? AND msg_type = ?',
+                (chat_id, i, msg_type, visible_text, internal_text, event.get('ts'), chat_id, i, msg_type)
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO positions (chat_id, row, msg_type, pos) '
+                'SELECT ?, ?, ?, MAX(pos) FROM swipes WHERE chat_id = ? AND row = ? AND msg_type = ?',
+                (chat_id, i, msg_type, chat_id, i, msg_type)
+            )
+            self._link(conn, chat_id, i, msg_type, conn.execute('SELECT MAX(pos) FROM swipes WHERE chat_id = ? AND row = ? AND msg_type = ?', (chat_id, i, msg_type)).fetchone()[0])
+            return len(visible_text) + len(internal_text or '')
+        if op == 'pos':
+            conn.execute('INSERT OR REPLACE INTO positions (chat_id, row, msg_type, pos) VALUES (?, ?, ?, ?)', (chat_id, i, msg_type, event['p']))
+            self._link(conn, chat_id, i, msg_type, event['p'])
+            return 0
+        if op == 'link':
+            conn.execute('UPDATE swipes SET next_pos = ? WHERE chat_id = ? AND row = ? AND msg_type = ? AND pos = ?', (event['c'], chat_id, i, msg_type, event['p']))
+            return 0
+        if op == 'prune':
+            keep = sorted(event['k'])
+            positions = [row[0] for row in conn.execute('SELECT pos FROM swipes WHERE chat_id = ? AND row = ? AND msg_type = ? ORDER BY pos', (chat_id, i, msg_type))]
+            kept = set(positions[p] for p in keep if p < len(positions))
+            conn.executemany('DELETE FROM swipes WHERE chat_id = ? AND row = ? AND msg_type = ? AND pos = ?', [(chat_id, i, msg_type, pos) for pos in positions if pos not in kept])
+            # Renumber in ascending order, so a swipe only ever moves into a slot that is already free
+            conn.executemany('UPDATE swipes SET pos = ? WHERE chat_id = ? AND row = ? AND msg_type = ? AND pos = ?', [
+                (new_pos, chat_id, i, msg_type, pos) for new_pos, pos in enumerate(sorted(kept)) if new_pos != pos
+            ])
+            selected = conn.execute('SELECT pos FROM positions WHERE chat_id = ? AND row = ? AND msg_type = ?', (chat_id, i, msg_type)).fetchone()
+            if selected is not None and kept:
+                old_selected = positions[min(selected[0], len(positions) - 1)]
+                new_selected = min(sum(1 for pos in kept if pos < old_selected), len(kept) - 1)
+                conn.execute('UPDATE positions SET pos = ? WHERE chat_id = ? AND row = ? AND msg_type = ?', (new_selected, chat_id, i, msg_type))
+            self._remap_links(conn, chat_id, i, msg_type, keep)
+            return 0
+        print(f"{_ERROR}Unknown journal event:{_RESET} {op}")
+        return 0
+
+    def append_events(self, location: Location, events: List[Dict]) -> int:
+        """Apply journal events in a single transaction, returning the number of text bytes written"""
+        written = 0
+        with self._connect() as conn:
+            chat_id = self._chat_id(conn, location, create=True)
+            previous = self._generation(conn, location)
+            for event in events:
+                written += self._append_event(conn, chat_id, event)
+            self._bump_generation(conn, chat_id, location, previous)
+        return written
+
+    def write_snapshot(self, location: Location, packed: Dict) -> int:
+        """Replace a chat's swipes with a pooled cache (see pool.pack), returning the number of text bytes written.
+        Raises journal.StaleCacheError (writing nothing) if another process wrote the chat since this one loaded it."""
+        texts = packed['pool']
+
+        def get_text(text_id: Optional[int]) -> Optional[str]:
+            if text_id is None:
+                return None
+            return pool.resolve(texts[text_id]) if text_id >= 0 else escape(pool.resolve(texts[~text_id]))
+
+        swipes, positions = [], []
+        internal_rows = packed['internal']
+        for i, row in enumerate(packed['visible']):
+            if not isinstance(row, list):
+                continue
+            for msg_type, msg in enumerate(row):
+                if not msg:
+                    continue
+                internal_row = internal_rows[i] if i < len(internal_rows) and isinstance(internal_rows[i], list) else []
+                internal_msg = internal_row[msg_type] if msg_type < len(internal_row) and internal_row[msg_type] else {'ids': []}
+                times = internal_msg.get('time') or []
+                links = internal_msg.get('next') or []
+                ids = msg.get('ids', [])
+                for pos, text_id in enumerate(ids):
+                    visible_text = get_text(text_id)
+                    if visible_text is None:
+                        continue
+                    internal_text = get_text(internal_msg['ids'][pos]) if pos < len(internal_msg['ids']) else None
+                    ts = times[pos] if pos < len(times) else None
+                    link = links[pos] if pos < len(links) else None
+                    swipes.append((i, msg_type, pos, visible_text, internal_text if internal_text != visible_text else None, ts, link))
+                if ids:
+                    positions.append((i, msg_type, msg.get('pos', 0)))
+
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')  # Take the write lock before checking the generation
+            chat_id = self._chat_id(conn, location, create=True)
+            previous = self._generation(conn, location)
+            with self._generations_lock:
+                if previous != self._generations.get(location, 0):
+                    raise journal.StaleCacheError(f"{'/'.join(location)} was written by another process")
+            conn.execute('DELETE FROM swipes WHERE chat_id = ?', (chat_id,))
+            conn.execute('DELETE FROM positions WHERE chat_id = ?', (chat_id,))
+            self._bump_generation(conn, chat_id, location, previous)
+            conn.executemany('INSERT INTO swipes (chat_id, row, msg_type, pos, visible, internal, time, next_pos) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [(chat_id, *swipe) for swipe in swipes])
+            conn.executemany('INSERT INTO positions (chat_id, row, msg_type, pos) VALUES (?, ?, ?, ?)', [(chat_id, *position) for position in positions])
+        return sum(len(swipe[3]) + len(swipe[4] or '') for swipe in swipes)
+
+    def rename(self, old_location: Location, new_location: Location):
+        """Move a chat to `new_location`, replacing any chat stored there"""
+        if old_location == new_location:
+            return
+        with self._connect() as conn:
+            self._delete_chat(conn, new_location)  # Same transaction, so the UNIQUE key is free for the UPDATE
+            conn.execute('UPDATE chats SET character = ?, mode = ?, unique_id = ? WHERE character = ? AND mode = ? AND unique_id = ?', (*new_location, *old_location))
+        with self._generations_lock:
+            self._generations.pop(new_location, None)
+            if old_location in self._generations:
+                self._generations[new_location] = self._generations.pop(old_location)
+
+    def delete(self, location: Location):
+        with self._connect() as conn:
+            self._delete_chat(conn, location)
+        with self._generations_lock:
+            self._generations.pop(location, None)
+
+    def _delete_chat(self, conn: sqlite3.Connection, location: Location):
+        chat_id = self._chat_id(conn, location)
+        if chat_id is not None:
+            conn.execute('DELETE FROM swipes WHERE chat_id = ?', (chat_id,))
+            conn.execute('DELETE FROM positions WHERE chat_id = ?', (chat_id,))
+            conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._connect().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def chats(self) -> List[Tuple[str, str, str, int]]:
+        """(character, mode, unique_id, number of swipes) of every stored chat"""
+        return self._connect().execute(
+            'SELECT character, mode, unique_id, (SELECT COUNT(*) FROM swipes WHERE chat_id = chats.id) FROM chats ORDER BY character, mode, unique_id'
+        ).fetchall()
+
+def location_from_path(cache_path: Path, logs_dir: Path) -> Optional[Location]:
+    """Map a .json.cache file to its location: logs/chat/{character}/{unique_id}.json.cache or logs/instruct/{unique_id}.json.cache"""
+    parts = cache_path.relative_to(logs_dir).parts
+    unique_id = cache_path.name[:-len('.json.cache')]
+    if len(parts) == 3 and parts[0] == 'chat':
+        return (parts[1], 'chat', unique_id)
+    if len(parts) == 2 and parts[0] == 'instruct':
+        return ('', 'instruct', unique_id)
+    return None
+
+def import_caches(store: SQLiteStore, logs_dir: Path) -> int:
+    """One-shot import of every .json.cache (and its journal) under `logs_dir`; chats already in the store are kept.
+    Returns the number of imported chats. The cache files are left in place."""
+    if store.get_meta('imported_from') == str(logs_dir):
+        return 0
+    imported = 0
+    for cache_path in sorted(logs_dir.glob('**/*.json.cache')):
+        location = location_from_path(cache_path, logs_dir)
+        if location is None or store.exists(location):
+            continue
+        try:
+            history_cache, _, _ = journal.load(cache_path)
+            store.write_snapshot(location, journal.pack_snapshot(history_cache))
+            imported += 1
+        except Exception as e:
+            print(f"{_ERROR}Could not import {cache_path}:{_RESET} {e}")
+            traceback.print_exc()
+    store.set_meta('imported_from', str(logs_dir))
+    if imported:
+        print(f"{_SUCCESS}Imported {imported} chat caches into {store.path.name}{_RESET}")
+    return imported
@@ -0,0 +1,37 @@
+from typing import IO, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+"""
+Advisory inter-process file locks (flock on POSIX, msvcrt byte-range locks on Windows, which are always exclusive).
+
+Locks are held on a separate lock file, since snapshots are replaced by renaming a new file over them. Every acquisition
+opens its own file descriptor, so threads of the same process exclude each other too; don't nest locks on one path.
+"""
+
+@contextmanager
+def locked(path: Path, exclusive: bool = True) -> Iterator[IO[bytes]]:
+    """Hold a lock on `path` (created if missing) and yield it, opened for reading and appending"""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # Retries for ~10 seconds before raising OSError
+        try:
+            yield f
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,66 @@
+from typing import Dict, Hashable, Optional
+from collections import OrderedDict
+import threading
+
+MAX_BYTES = 8 * 1024 * 1024  # Approximate budget for cached row HTML
+
+class FragmentCache:
+    """LRU cache of rendered chat rows, bounded by the size of the cached HTML"""
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._fragments: OrderedDict[Hashable, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._fragments.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def put(self, key: Hashable, fragment: str):
+        with self._lock:
+            old = self._fragments.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            if len(fragment) > self.max_bytes:
+                return
+            self._fragments[key] = fragment
+            self.bytes += len(fragment)
+            self._trim()
+
+    def _trim(self):
+        """Evict least recently used fragments over the budget (lock held)"""
+        while self.bytes > self.max_bytes:
+            _, evicted = self._fragments.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def configure(self, max_bytes: Optional[int] = None):
+        if max_bytes is not None:
+            with self._lock:
+                self.max_bytes = max(0, int(max_bytes))
+                self._trim()
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._fragments),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+fragments = FragmentCache()
@@ -0,0 +1,369 @@
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import json
+import os
+import threading
+import time
+import traceback
+
+import extensions.boogaplus.utils.pool as pool
+import extensions.boogaplus.utils.snapshot as snapshot
+from extensions.boogaplus.utils.filelock import locked
+from extensions.boogaplus.utils.pool import StringPool
+
+# Colour codes
+_ERROR = "\033[1;31m"
+_SUCCESS = "\033[1;32m"
+_INPUT = "\033[0;33m"
+_GRAY = "\033[0;30m"
+_HILITE = "\033[0;36m"
+_BOLD = "\033[1;37m"
+_RESET = "\033[0m"
+
+# Number of journal events after which the journal is folded back into the snapshot
+MAX_JOURNAL_EVENTS = 256
+
+"""
+Storage layout (next to the history file):
+    {unique_id}.json.cache          snapshot of the full cache (indexed format, see utils/snapshot.py)
+    {unique_id}.json.cache.journal  append-only log of events applied on top of the snapshot, one JSON object per line
+    {unique_id}.json.cache.lock     advisory lock held around every read and write (see utils/filelock.py), holding
+                                    the cache's generation: a counter incremented by every write, from any process
+
+Every process remembers the generation it last loaded or wrote, so it can tell when another process (e.g. another
+TGWUI instance on the same logs directory) wrote the cache since (is_stale), and reload it only then. A snapshot is
+never written over such changes (StaleCacheError); journal events only add to them, so they still are.
+
+Events:
+    {"op": "swipe", "i": row, "t": msg_type, "v": visible_text, "n": internal_text, "ts": time}  -> append a swipe and select it
+                                                                                ("n" is omitted if equal to "v")
+    {"op": "pos", "i": row, "t": msg_type, "p": pos}                            -> select an existing swipe
+    {"op": "truncate", "n": rows}                                               -> drop every row from `rows` on
+    {"op": "prune", "i": row, "t": msg_type, "k": [pos, ...]}                   -> keep only the swipes at these positions
+    {"op": "link", "i": row, "t": msg_type, "p": pos, "c": next_pos}           -> set the continuation of a swipe
+
+Swipe creation times (unix seconds, None for swipes cached before they were recorded) are kept in the internal message
+cache's "time" list, parallel to its "text" list.
+
+Branches: messages are ordered in slots (row 0 user, row 0 bot, row 1 user, ...), and every swipe owns the conversation
+that continued after it, as the position of the swipe that followed it in the next slot. These links are kept in the
+internal message cache's "next" list, parallel to "text": -1 if the conversation ended at the swipe, None if unknown
+(swipes cached before links were recorded). Selecting a swipe ("swipe" or "pos") links the selected swipe of the
+previous slot to it, so following the links from any swipe walks the branch last seen under it. Branches share every
+swipe of their common prefix, and all of them keep their rows in the same swipe lists.
+"""
+
+class StaleCacheError(Exception):
+    """The cache was written by another process since this process loaded it"""
+
+_generations: Dict[Path, int] = {}        # Generation of every cache as last loaded or written by this process
+_lock_stats: Dict[Path, Tuple] = {}       # Lock file (mtime, size) when its generation was last found in sync
+_generations_lock = threading.Lock()
+
+def empty_cache() -> Dict:
+    return {'visible': [], 'internal': []}
+
+def get_journal_path(cache_path: Path) -> Path:
+    """Get the path to the journal file belonging to a snapshot"""
+    return cache_path.with_name(cache_path.name + '.journal')
+
+def _ensure_msg(history_cache: Dict, i: int, msg_type: int):
+    """Ensure the message dicts at (`i`, `msg_type`) exist in both cache types"""
+    for cache_type in ['visible', 'internal']:
+        rows = history_cache[cache_type]
+        if len(rows) <= i:
+            rows.extend([None] * (i + 1 - len(rows)))
+        if rows[i] is None or not isinstance(rows[i], list):
+            rows[i] = [{'text': []}, {'text': []}]
+    if not history_cache['visible'][i][msg_type] or not history_cache['internal'][i][msg_type]:
+        history_cache['visible'][i][msg_type] = {'text': []}
+        history_cache['internal'][i][msg_type] = {'text': []}
+
+def get_lock_path(cache_path: Path) -> Path:
+    """Get the path to the lock (and generation) file belonging to a snapshot"""
+    return cache_path.with_name(cache_path.name + '.lock')
+
+def _stat_key(path: Path) -> Optional[Tuple]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _read_generation(f) -> int:
+    f.seek(0)
+    try:
+        return int(f.read() or 0)
+    except ValueError:  # Torn by a crash mid-write; any change makes readers reload
+        return -1
+
+def _bump_generation(f, cache_path: Path, previous: int):
+    """Store generation `previous` + 1 (lock held), keeping track of it if this process was in sync with `previous`"""
+    f.seek(0)
+    f.truncate()
+    f.write(str(previous + 1).encode('ascii'))
+    f.flush()
+    with _generations_lock:
+        if _generations.get(cache_path, 0) == previous:
+            _generations[cache_path] = previous + 1
+            _lock_stats[cache_path] = _stat_key(get_lock_path(cache_path))
+
+def generation(cache_path: Path) -> int:
+    """Current generation of a cache on disk (0 if it was never written)"""
+    if not get_lock_path(cache_path).exists():
+        return 0
+    with locked(get_lock_path(cache_path), exclusive=False) as f:
+        return _read_generation(f)
+
+def is_stale(cache_path: Path) -> bool:
+    """Whether another process wrote the cache since this process last loaded or wrote it (one stat if it didn't)"""
+    lock_path = get_lock_path(cache_path)
+    stat_key = _stat_key(lock_path)
+    with _generations_lock:
+        if cache_path in _lock_stats and stat_key == _lock_stats[cache_path]:
+            return False
+    current = generation(cache_path) if stat_key is not None else 0  # Waits for a write in progress in this process too
+    with _generations_lock:
+        if current != _generations.get(cache_path, 0):
+            return True
+        _lock_stats[cache_path] = stat_key
+    return False
+
+def previous_slot(i: int, msg_type: int) -> Optional[Tuple[int, int]]:
+    """Slot of the message before (`i`, `msg_type`), or None for the first message"""
+    if msg_type == 1:
+        return i, 0
+    return (i - 1, 1) if i > 0 else None
+
+def next_slot(i: int, msg_type: int) -> Tuple[int, int]:
+    """Slot of the message after (`i`, `msg_type`)"""
+    return (i, 1) if msg_type == 0 else (i + 1, 0)
+
+def get_msg(history_cache: Dict, i: int, msg_type: int, cache_type: str = 'internal') -> Optional[Dict]:
+    """Message cache at (`i`, `msg_type`), or None if it has no swipes"""
+    rows = history_cache[cache_type]
+    row = rows[i] if 0 <= i < len(rows) else None
+    msg = row[msg_type] if isinstance(row, list) and msg_type < len(row) else None
+    return msg if msg and msg.get('text') else None
+
+def get_links(msg_cache: Dict) -> List[Optional[int]]:
+    """The "next" list of an internal message cache, padded to its number of swipes"""
+    links = msg_cache.setdefault('next', [])
+    length = len(msg_cache['text'])
+    if len(links) < length:
+        links.extend([None] * (length - len(links)))
+    return links
+
+def _link(history_cache: Dict, i: int, msg_type: int, pos: int):
+    """Link the selected swipe of the slot before (`i`, `msg_type`) to swipe `pos`"""
+    previous = previous_slot(i, msg_type)
+    msg = get_msg(history_cache, *previous) if previous is not None else None
+    if msg is not None:
+        links = get_links(msg)
+        selected = msg.get('pos', 0)
+        if selected < len(links):
+            links[selected] = pos
+
+def _remap_links(history_cache: Dict, i: int, msg_type: int, keep: Optional[List[int]]):
+    """Update the links into (`i`, `msg_type`) after its swipes were pruned down to `keep` (or all dropped if None)"""
+    previous = previous_slot(i, msg_type)
+    msg = get_msg(history_cache, *previous) if previous is not None else None
+    if msg is None or not msg.get('next'):
+        return
+    new_positions = {pos: new_pos for new_pos, pos in enumerate(sorted(keep or ()))}
+    msg['next'] = [link if link is None or link < 0 else new_positions.get(link) for link in msg['next']]
+
+def make_swipe_event(i: int, msg_type: int, visible_text: str, internal_text: str, ts: Optional[int] = None) -> Dict:
+    event = {'op': 'swipe', 'i': i, 't': msg_type, 'v': visible_text}
+    if internal_text != visible_text:
+        event['n'] = internal_text
+    event['ts'] = int(time.time()) if ts is None else ts
+    return event
+
+def _prune(msg_cache: Dict, keep: List[int]):
+    """Drop the swipes of a message cache that aren't in `keep`, remapping its selected position"""
+    kept = set(keep)
+    for key in ('text', 'time', 'next'):
+        values = msg_cache.get(key)
+        if values is None:
+            continue
+        for pos in reversed(range(len(values))):  # Deleting in place keeps lazily loaded texts unloaded
+            if pos not in kept:
+                del values[pos]
+    pos = msg_cache.get('pos', 0)
+    msg_cache['pos'] = max(0, min(sum(1 for p in kept if p < pos), len(msg_cache['text']) - 1))
+
+def apply_event(history_cache: Dict, event: Dict, string_pool: Optional[StringPool] = None):
+    """Apply a single journal event to `history_cache` in place"""
+    op = event.get('op')
+    if op == 'truncate':
+        for cache_type in ['visible', 'internal']:
+            del history_cache[cache_type][event['n']:]
+        _remap_links(history_cache, event['n'], 0, None)
+        return
+    i, msg_type = event['i'], event['t']
+    if op == 'swipe':
+        _ensure_msg(history_cache, i, msg_type)
+        visible_text = event['v']
+        internal_text = event.get('n', visible_text)
+        if string_pool is not None:
+            visible_text = string_pool.intern(visible_text)
+            internal_text = string_pool.intern(internal_text)
+        visible_msg_cache = history_cache['visible'][i][msg_type]
+        internal_msg_cache = history_cache['internal'][i][msg_type]
+        length = len(visible_msg_cache['text'])
+        visible_msg_cache['text'].append(visible_text)
+        visible_msg_cache['pos'] = length
+        internal_msg_cache['text'].append(internal_text)
+        internal_msg_cache['pos'] = length
+        times = internal_msg_cache.setdefault('time', [])
+        if len(times) < length:
+            times.extend([None] * (length - len(times)))
+        del times[length:]
+        times.append(event.get('ts'))
+        links = internal_msg_cache.setdefault('next', [])
+        if len(links) < length:
+            links.extend([None] * (length - len(links)))
+        del links[length:]
+        links.append(-1)  # Nothing followed the new swipe yet
+        _link(history_cache, i, msg_type, length)
+    elif op == 'pos':
+        _ensure_msg(history_cache, i, msg_type)
+        history_cache['visible'][i][msg_type]['pos'] = event['p']
+        history_cache['internal'][i][msg_type]['pos'] = event['p']
+        _link(history_cache, i, msg_type, event['p'])
+    elif op == 'prune':
+        _ensure_msg(history_cache, i, msg_type)
+        _prune(history_cache['visible'][i][msg_type], event['k'])
+        _prune(history_cache['internal'][i][msg_type], event['k'])
+        _remap_links(history_cache, i, msg_type, event['k'])
+    elif op == 'link':
+        msg = get_msg(history_cache, i, msg_type)
+        if msg is not None and event['p'] < len(msg['text']):
+            get_links(msg)[event['p']] = event['c']
+    else:
+        print(f"{_ERROR}Unknown journal event:{_RESET} {op}")
+
+def read_events(journal_path: Path) -> List[Dict]:
+    """Read all complete events from a journal (a torn trailing line from a crash is ignored)"""
+    events = []
+    if not journal_path.exists():
+        return events
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                print(f"{_INPUT}Ignoring incomplete journal entry in {journal_path.name}{_RESET}")
+                break
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"{_ERROR}Ignoring corrupt journal entry in {journal_path.name}{_RESET}")
+    return events
+
+def dumps_event(event: Dict) -> str:
+    """Serialize an event to a single journal line"""
+    return json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+def pack_snapshot(history_cache: Dict) -> Dict:
+    """Convert a cache to its pooled snapshot form (texts not loaded yet stay references into their snapshot)"""
+    return pool.pack(history_cache)
+
+def append_lines(cache_path: Path, lines: List[str]) -> int:
+    """Append serialized events to the journal, returning the number of bytes written"""
+    contents = ''.join(lines)
+    with locked(get_lock_path(cache_path)) as lock:
+        previous = _read_generation(lock)
+        with open(get_journal_path(cache_path), 'a', encoding='utf-8') as f:
+            f.write(contents)
+        _bump_generation(lock, cache_path, previous)
+    return len(contents)
+
+def append_events(cache_path: Path, events: List[Dict]) -> int:
+    """Append events to the journal, returning the number of bytes written"""
+    return append_lines(cache_path, [dumps_event(event) for event in events])
+
+def atomic_write(path: Path, contents: bytes):
+    """Write `contents` to a temporary file and rename it over `path`, so readers never see a torn file"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load(cache_path: Path, track: bool = True) -> Tuple[Dict, int, StringPool]:
+    """Load the snapshot (legacy monolithic caches included) and replay its journal on top.
+    Returns the cache, the number of replayed journal events and the cache's string pool.
+    Without `track`, the generation read isn't remembered (for read-only copies, which must not mask staleness)."""
+    history_cache = None
+    string_pool = StringPool()
+    with locked(get_lock_path(cache_path), exclusive=False) as lock:
+        current = _read_generation(lock)
+        if cache_path.exists():
+            history_cache = snapshot.read(cache_path, string_pool)
+        events = read_events(get_journal_path(cache_path))
+    if track:
+        with _generations_lock:
+            _generations[cache_path] = current
+            _lock_stats[cache_path] = _stat_key(get_lock_path(cache_path))
+    if not history_cache:
+        history_cache = empty_cache()
+
+    for event in events:
+        try:
+            apply_event(history_cache, event, string_pool)
+        except Exception as e:
+            print(f"{_ERROR}Error replaying journal event:{_RESET} {e}")
+            traceback.print_exc()
+    return history_cache, len(events), string_pool
+
+def write_snapshot(cache_path: Path, packed: Dict) -> int:
+    """Atomically replace the snapshot and truncate the journal, returning the number of bytes written.
+    Raises StaleCacheError (writing nothing) if another process wrote the cache since this one loaded it."""
+    try:
+        data, rebase = snapshot.encode_rebasing(packed)
+    except snapshot.SnapshotReplacedError as e:  # Texts copied from the old snapshot are gone with it
+        raise StaleCacheError(str(e)) from e
+    with locked(get_lock_path(cache_path)) as lock:
+        previous = _read_generation(lock)
+        with _generations_lock:
+            if previous != _generations.get(cache_path, 0):
+                raise StaleCacheError(f"{cache_path.name} was written by another process")
+        with rebase(cache_path):
+            atomic_write(cache_path, data)
+        journal_path = get_journal_path(cache_path)
+        if journal_path.exists():
+            journal_path.unlink()
+        _bump_generation(lock, cache_path, previous)
+    return len(data)
+
+def exists(cache_path: Path) -> bool:
+    return cache_path.exists() or get_journal_path(cache_path).exists()
+
+def size(cache_path: Path) -> int:
+    """Combined size of the snapshot and the journal on disk"""
+    return sum(path.stat().st_size for path in (cache_path, get_journal_path(cache_path)) if path.exists())
+
+def rename(old_path: Path, new_path: Path):
+    """Rename the snapshot, the journal and the lock file, replacing any cache at `new_path`"""
+    with locked(get_lock_path(old_path)):
+        for old, new in ((old_path, new_path), (get_journal_path(old_path), get_journal_path(new_path))):
+            if old.exists():
+                old.replace(new)
+            elif new.exists():  # Left over from the replaced cache
+                new.unlink()
+    get_lock_path(old_path).replace(get_lock_path(new_path))  # Once released (open files can't be renamed on Windows)
+    with _generations_lock:
+        if old_path in _generations:
+            _generations[new_path] = _generations.pop(old_path)
+        _lock_stats.pop(old_path, None)
+        _lock_stats.pop(new_path, None)
+
+def delete(cache_path: Path):
+    """Delete the snapshot, the journal and the lock file"""
+    for path in (cache_path, get_journal_path(cache_path), get_lock_path(cache_path)):
+        if path.exists():
+            path.unlink()
+    with _generations_lock:
+        _generations.pop(cache_path, None)
+        _lock_stats.pop(cache_path, None)
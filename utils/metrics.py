@@ -0,0 +1,174 @@
+from typing import Callable, Dict, List, Optional
+from functools import wraps
+import inspect
+import threading
+import time
+
+"""
+Hot-path instrumentation: latency histograms per function and named counters.
+
+Everything is gated on `ENABLED`, so when metrics are off (the default) the cost is one global lookup per call.
+"""
+
+ENABLED = False
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q: float) -> float:
+        """Approximate percentile (upper bound of the bucket it falls in)"""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+_lock = threading.Lock()
+_histograms: Dict[str, Histogram] = {}
+_counters: Dict[str, float] = {}
+
+def configure(enabled: Optional[bool] = None):
+    global ENABLED
+    if enabled is not None:
+        ENABLED = bool(enabled)
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def observe(name: str, seconds: float):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+def inc(name: str, value: float = 1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def timed(name: str) -> Callable:
+    """Decorator recording the latency of every call in histogram `name`.
+    For generator functions, only the time spent producing items is recorded (not the time the consumer holds them);
+    for coroutine functions, the time until the coroutine completes (awaits included)."""
+    def decorator(fn: Callable) -> Callable:
+        if inspect.isgeneratorfunction(fn):
+            @wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    yield from fn(*args, **kwargs)
+                    return
+                elapsed = 0.0
+                generator = fn(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                finally:
+                    generator.close()
+                    observe(name, elapsed)
+            return generator_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def coroutine_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    observe(name, time.perf_counter() - start)
+            return coroutine_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def snapshot() -> Dict:
+    """JSON-friendly dump of all metrics (latencies in milliseconds)"""
+    with _lock:
+        return {
+            'enabled': ENABLED,
+            'latency_ms': {
+                name: {
+                    'count': histogram.count,
+                    'mean': histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                    'p50': histogram.percentile(0.5) * 1000,
+                    'p90': histogram.percentile(0.9) * 1000,
+                    'p99': histogram.percentile(0.99) * 1000,
+                } for name, histogram in sorted(_histograms.items())
+            },
+            'counters': dict(sorted(_counters.items())),
+        }
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def render_prometheus(gauges: Optional[Dict[str, float]] = None) -> str:
+    """Prometheus text exposition format"""
+    lines: List[str] = []
+    with _lock:
+        lines.append('# HELP boogaplus_latency_seconds Latency of boogaPlus hooks and monkeypatches.')
+        lines.append('# TYPE boogaplus_latency_seconds histogram')
+        for name, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'boogaplus_latency_seconds_bucket{{fn="{_label(name)}",le="{le}"}} {cumulative}')
+            lines.append(f'boogaplus_latency_seconds_sum{{fn="{_label(name)}"}} {histogram.sum}')
+            lines.append(f'boogaplus_latency_seconds_count{{fn="{_label(name)}"}} {histogram.count}')
+        for name, value in sorted(_counters.items()):
+            lines.append(f'# TYPE boogaplus_{name}_total counter')
+            lines.append(f'boogaplus_{name}_total {value}')
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f'# TYPE boogaplus_{name} gauge')
+        lines.append(f'boogaplus_{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+def mount(app, path: str = '/boogaplus/metrics', gauges: Optional[Callable[[], Dict[str, float]]] = None) -> bool:
+    """Add a Prometheus endpoint to a FastAPI app (e.g. the one Gradio serves the UI with)"""
+    if app is None or getattr(app, '_boogaplus_metrics', False):
+        return False
+    from fastapi.responses import PlainTextResponse
+
+    def metrics_endpoint():
+        return PlainTextResponse(render_prometheus(gauges() if gauges else None))
+
+    app.add_api_route(path, metrics_endpoint, methods=['GET'])
+    app._boogaplus_metrics = True
+    return True
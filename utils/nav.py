@@ -0,0 +1,66 @@
+from typing import Dict, List, Tuple
+from array import array
+
+class NavTable:
+    """Flat table of the selected position and total positions of every message, kept in sync with a chat cache.
+
+    Two int columns (pos, total) per message type, indexed by history row, so renderers can read them in O(1)."""
+    def __init__(self):
+        self.columns = [(array('i'), array('i')) for _ in range(2)]  # [msg_type] -> (pos, total)
+
+    def __len__(self):
+        return len(self.columns[0][0])
+
+    def _extend(self, length: int):
+        missing = length - len(self)
+        if missing > 0:
+            for pos, total in self.columns:
+                pos.extend([0] * missing)
+                total.extend([0] * missing)
+
+    def get(self, i: int, msg_type: int) -> Tuple[int, int]:
+        """Get (pos, total) of the message at (`i`, `msg_type`); (0, 0) if it has no cache"""
+        pos, total = self.columns[msg_type]
+        if 0 <= i < len(pos):
+            return pos[i], total[i]
+        return 0, 0
+
+    def set(self, i: int, msg_type: int, pos: int, total: int):
+        self._extend(i + 1)
+        self.columns[msg_type][0][i] = pos
+        self.columns[msg_type][1][i] = total
+
+    def update(self, history_cache: Dict, i: int, msg_type: int):
+        """Re-read (`i`, `msg_type`) from the cache after it was mutated"""
+        self.set(i, msg_type, *_read(history_cache, i, msg_type))
+
+    def truncate(self, length: int):
+        for pos, total in self.columns:
+            del pos[length:]
+            del total[length:]
+
+    def rows(self) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+        """Bulk accessor: ((user pos, user total), (bot pos, bot total)) for every row"""
+        (user_pos, user_total), (bot_pos, bot_total) = self.columns
+        return list(zip(zip(user_pos, user_total), zip(bot_pos, bot_total)))
+
+    @classmethod
+    def from_cache(cls, history_cache: Dict) -> 'NavTable':
+        table = cls()
+        rows = history_cache.get('visible') or []
+        table._extend(len(rows))
+        for i in range(len(rows)):
+            for msg_type in range(2):
+                pos, total = _read(history_cache, i, msg_type)
+                if total:
+                    table.columns[msg_type][0][i] = pos
+                    table.columns[msg_type][1][i] = total
+        return table
+
+def _read(history_cache: Dict, i: int, msg_type: int) -> Tuple[int, int]:
+    rows = history_cache['visible']
+    row = rows[i] if i < len(rows) else None
+    msg = row[msg_type] if isinstance(row, list) and msg_type < len(row) else None
+    if not msg:
+        return 0, 0
+    return msg.get('pos', 0), len(msg.get('text') or [])
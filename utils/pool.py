@@ -0,0 +1,138 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from html import escape
+
+"""
+Pooled snapshot format: every distinct swipe text is stored once in `pool`, and message caches reference it by index.
+A visible id `~k` (negative) means `html.escape(pool[k])`, which is how TGWUI usually derives visible from internal text.
+    {"format": 2, "pool": [...], "visible": [[{"ids": [...], "pos": n}, ...], ...], "internal": [...]}
+pack() leaves texts that were never read from an indexed snapshot (utils/snapshot.py) in it: their pool entries are
+TextRefs, which the snapshot encoder copies from the old file, and which other consumers read with resolve().
+"""
+
+FORMAT = 2
+
+class StringPool:
+    """Content-addressed pool of swipe texts, so identical texts (e.g. visible == internal) share one string object"""
+    def __init__(self):
+        self._texts: Dict[str, str] = {}
+
+    def intern(self, text):
+        if not isinstance(text, str):
+            return text
+        return self._texts.setdefault(text, text)
+
+    def __len__(self):
+        return len(self._texts)
+
+class TextRef(NamedTuple):
+    """Pool entry of a text that is still only stored in a snapshot (`source` is its snapshot.BlobReader)"""
+    source: object
+    text_id: int
+
+def resolve(entry):
+    """Text of a pool entry, reading it if it is a TextRef"""
+    return entry.source.get(entry.text_id) if isinstance(entry, TextRef) else entry
+
+def _texts(msg: Dict) -> List:
+    """Texts of a message cache, as TextRefs where they haven't been read from their snapshot"""
+    texts = msg.get('text', [])
+    return texts.packable() if hasattr(texts, 'packable') else texts
+
+def is_packed(data: Dict) -> bool:
+    return isinstance(data, dict) and 'pool' in data
+
+def _pack_msgs(rows: List, ids: Dict[str, int], pool: List[str], counterparts: Optional[List] = None) -> List:
+    def get_id(text) -> int:
+        if isinstance(text, TextRef) and text.text_id < 0:  # Escaped in its snapshot, and so it stays
+            return ~get_id(TextRef(text.source, ~text.text_id))
+        text_id = ids.get(text)
+        if text_id is None:
+            text_id = ids[text] = len(pool)
+            pool.append(text)
+        return text_id
+
+    packed_rows = []
+    for i, row in enumerate(rows):
+        if not isinstance(row, list):
+            packed_rows.append(row)
+            continue
+        packed_row = []
+        for msg_type, msg in enumerate(row):
+            if not msg:
+                packed_row.append(msg)
+                continue
+            counterpart = None
+            if counterparts is not None and i < len(counterparts) and isinstance(counterparts[i], list) and msg_type < len(counterparts[i]):
+                counterpart = _texts(counterparts[i][msg_type] or {})
+            text_ids = []
+            for pos, text in enumerate(_texts(msg)):
+                if isinstance(text, TextRef):
+                    text_ids.append(get_id(text))
+                    continue
+                if not isinstance(text, str):
+                    text_ids.append(None)
+                    continue
+                internal = counterpart[pos] if counterpart and pos < len(counterpart) else None
+                if isinstance(internal, str) and text != internal and text == escape(internal):
+                    text_ids.append(~get_id(internal))
+                else:
+                    text_ids.append(get_id(text))
+            packed_msg = {key: value for key, value in msg.items() if key != 'text'}
+            packed_msg['ids'] = text_ids
+            packed_row.append(packed_msg)
+        packed_rows.append(packed_row)
+    return packed_rows
+
+def pack(history_cache: Dict) -> Dict:
+    """Convert a cache to the pooled snapshot format (without reading texts that are still only in their snapshot)"""
+    ids: Dict[str, int] = {}
+    pool: List[str] = []
+    internal = _pack_msgs(history_cache['internal'], ids, pool)  # Internal first, so visible can reference it
+    visible = _pack_msgs(history_cache['visible'], ids, pool, history_cache['internal'])
+    return {'format': FORMAT, 'pool': pool, 'visible': visible, 'internal': internal}
+
+def unpack(packed: Dict, string_pool: Optional[StringPool] = None) -> Tuple[Dict, StringPool]:
+    """Convert a pooled snapshot back to the in-memory cache format"""
+    string_pool = string_pool or StringPool()
+    pool = [string_pool.intern(text) for text in packed['pool']]
+    escaped: Dict[int, str] = {}
+
+    def get_text(text_id: Optional[int]) -> Optional[str]:
+        if text_id is None:
+            return None
+        if text_id >= 0:
+            return pool[text_id]
+        if text_id not in escaped:
+            escaped[text_id] = string_pool.intern(escape(pool[~text_id]))
+        return escaped[text_id]
+
+    history_cache = {}
+    for cache_type in ['visible', 'internal']:
+        rows = []
+        for row in packed[cache_type]:
+            if not isinstance(row, list):
+                rows.append(row)
+                continue
+            unpacked_row = []
+            for msg in row:
+                if not msg:
+                    unpacked_row.append(msg)
+                    continue
+                unpacked_msg = {key: value for key, value in msg.items() if key != 'ids'}
+                unpacked_msg['text'] = [get_text(text_id) for text_id in msg['ids']]
+                unpacked_row.append(unpacked_msg)
+            rows.append(unpacked_row)
+        history_cache[cache_type] = rows
+    return history_cache, string_pool
+
+def intern_cache(history_cache: Dict, string_pool: Optional[StringPool] = None) -> StringPool:
+    """Intern every text of an unpacked (legacy) cache in place"""
+    string_pool = string_pool or StringPool()
+    for cache_type in ['visible', 'internal']:
+        for row in history_cache[cache_type]:
+            if not isinstance(row, list):
+                continue
+            for msg in row:
+                if msg and 'text' in msg:
+                    msg['text'] = [string_pool.intern(text) for text in msg['text']]
+    return string_pool
@@ -0,0 +1,154 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import threading
+import traceback
+
+import extensions.boogaplus.utils.cache as cache
+import extensions.boogaplus.utils.metrics as metrics
+
+"""
+Background warm-up and prefetch of chat caches.
+
+At startup, the caches of the most recently used chats (by modification time of their history/cache files) are loaded
+in a thread pool, so the first render of a recent chat doesn't pay for parsing its cache. While browsing the chat
+menu, hovered and neighbouring chats are prefetched the same way. Prefetched caches are registered behind every cache
+in use (see cache.preload), so they never evict one, and are only loaded within their own count/byte budget.
+"""
+
+# Colour codes
+_ERROR = "\033[1;31m"
+_GRAY = "\033[0;30m"
+_RESET = "\033[0m"
+
+MAX_CHATS = 8                    # Chats loaded by the startup warm-up
+MAX_BYTES = 32 * 1024 * 1024     # Approximate size of the caches loaded by the warm-up
+WORKERS = 4                      # Loader threads
+
+_SUFFIXES = ('.json.cache.journal', '.json.cache', '.json')  # Longest first
+
+Key = Tuple[str, str, str]  # cache.make_key()
+
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_queued = set()  # Keys submitted and not loaded yet
+
+def configure(max_chats: Optional[int] = None, max_bytes: Optional[int] = None, workers: Optional[int] = None):
+    global MAX_CHATS, MAX_BYTES, WORKERS, _executor
+    if max_chats is not None:
+        MAX_CHATS = max(0, int(max_chats))
+    if max_bytes is not None:
+        MAX_BYTES = max(0, int(max_bytes))
+    if workers is not None and max(1, int(workers)) != WORKERS:
+        WORKERS = max(1, int(workers))
+        with _lock:
+            if _executor is not None:
+                _executor.shutdown(wait=False)  # Queued loads still run; new ones go to the new pool
+                _executor = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='boogaplus-prefetch')
+        return _executor
+
+def _parse_name(name: str) -> Optional[str]:
+    """unique_id of a history, cache or journal file name"""
+    for suffix in _SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
+
+def recent_chats(logs_dir: Path, limit: Optional[int] = None) -> List[Key]:
+    """Keys of the chats under `logs_dir`, most recently modified first.
+    A chat's history, snapshot and journal all count, so a chat is as recent as its last write by either TGWUI or boogaPlus."""
+    mtimes: Dict[Key, float] = {}
+    for pattern, mode in (('chat/*/*.json*', 'chat'), ('instruct/*.json*', 'instruct')):
+        for path in logs_dir.glob(pattern):
+            unique_id = _parse_name(path.name)
+            if not unique_id:
+                continue
+            key = cache.make_key(path.parent.name, unique_id, mode)
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:  # Removed while scanning
+                continue
+            if mtime > mtimes.get(key, 0.0):
+                mtimes[key] = mtime
+    keys = sorted(mtimes, key=mtimes.get, reverse=True)
+    return keys if limit is None else keys[:limit]
+
+def latest_chat(character: str, mode: Optional[str]) -> Optional[str]:
+    """unique_id of a character's most recent chat (the one TGWUI opens when the character is selected)"""
+    key = cache.make_key(character, '', mode)
+    directory = cache.get_history_file_path('', key[0], key[2]).parent
+    histories = list(directory.glob('*.json')) if directory.is_dir() else []
+    if not histories:
+        return None
+    return max(histories, key=lambda path: path.stat().st_mtime).stem
+
+def _cache_size(key: Key) -> int:
+    try:
+        location = cache.get_cache_location(key[1], key[0], key[2])
+        return cache.store.size(location) if cache.store.exists(location) else 0
+    except Exception:
+        return 0
+
+def _load(key: Key):
+    try:
+        if cache.preload(key):
+            metrics.inc('cache_prefetches')
+    except Exception as e:
+        print(f"{_ERROR}Could not prefetch cache {key[0]} || {key[1]}:{_RESET} {e}")
+        traceback.print_exc()
+    finally:
+        with _lock:
+            _queued.discard(key)
+
+def prefetch(keys: Iterable[Key], max_chats: Optional[int] = None, max_bytes: Optional[int] = None) -> int:
+    """Load the caches of `keys` in the background, in order, up to `max_chats` of them while their combined size fits
+    in `max_bytes` (and in what is left of the registry's budget). Caches already loaded or queued are skipped.
+    Returns the number of loads submitted."""
+    loaded, loaded_bytes = cache.registry_stats()
+    budget = cache.MAX_BYTES - loaded_bytes
+    if max_bytes is not None:
+        budget = min(budget, max_bytes)
+    slots = cache.MAX_CHATS - loaded
+    if max_chats is not None:
+        slots = min(slots, max_chats)
+    submitted = 0
+    for key in keys:
+        if submitted >= slots:
+            break
+        with _lock:
+            if key in _queued:
+                continue
+        if cache.is_loaded(key):
+            continue
+        size = _cache_size(key)
+        if not size:  # No cache to load
+            continue
+        if size > budget:
+            break
+        budget -= size
+        with _lock:
+            _queued.add(key)
+        _get_executor().submit(_load, key)
+        submitted += 1
+    return submitted
+
+def warm_up() -> threading.Thread:
+    """Scan for the most recently used chats and prefetch their caches within the warm-up budget, without blocking"""
+    def run():
+        try:
+            submitted = prefetch(recent_chats(cache.get_logs_dir()), max_chats=MAX_CHATS, max_bytes=MAX_BYTES)
+            if submitted:
+                print(f"{_GRAY}Warming up {submitted} recent chat caches{_RESET}")
+        except Exception as e:
+            print(f"{_ERROR}Cache warm-up failed:{_RESET} {e}")
+            traceback.print_exc()
+
+    thread = threading.Thread(target=run, name='boogaplus-warm-up', daemon=True)
+    thread.start()
+    return thread
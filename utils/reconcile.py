@@ -0,0 +1,50 @@
+from typing import Dict, List, Tuple
+
+import extensions.boogaplus.utils.journal as journal
+import extensions.boogaplus.utils.snapshot as snapshot
+
+"""
+Cache/history reconciliation.
+
+The cache drifts from TGWUI's history when it is edited outside the patched handlers. plan() compares the two in a
+single pass over the rows and returns the journal events that repair the cache, each with a record of what it fixes:
+    {"fix": "repositioned", "row": i, "type": t, "from": pos, "to": pos}    selected swipe isn't the displayed text
+    {"fix": "adopted", "row": i, "type": t, "pos": pos}                     displayed text isn't cached, added as a swipe
+Texts are matched by hash (see snapshot.find_text), so lazily loaded caches aren't read in full. Cached rows past the end
+of the history are kept: they belong to other branches (see utils/journal.py), or to removed messages, which stay
+available as swipes.
+"""
+
+def plan(history_cache: Dict, history: Dict) -> List[Tuple[Dict, Dict]]:
+    """(event, fix) pairs aligning `history_cache` with `history`"""
+    fixes = []
+    internal_rows = history['internal']
+    visible_rows = history['visible']
+    cache_rows = history_cache['internal']
+    length = len(internal_rows)
+
+    for i in range(min(length, len(cache_rows))):
+        row = cache_rows[i]
+        if not isinstance(row, list):
+            continue
+        for msg_type, msg in enumerate(row[:2]):
+            texts = msg.get('text') if msg else None
+            text = internal_rows[i][msg_type]
+            if not texts or not text:
+                continue
+            pos = msg.get('pos', 0)
+            found = snapshot.find_text(texts, text, hint=pos)
+            if found == pos:
+                continue
+            if found >= 0:
+                fixes.append(({'op': 'pos', 'i': i, 't': msg_type, 'p': found}, {'fix': 'repositioned', 'row': i, 'type': msg_type, 'from': pos, 'to': found}))
+            elif i < length - 1:  # The last row may be mid-generation; the handlers append it once it is complete
+                fixes.append((journal.make_swipe_event(i, msg_type, visible_rows[i][msg_type], text), {'fix': 'adopted', 'row': i, 'type': msg_type, 'pos': len(texts)}))
+    return fixes
+
+def describe(fixes: List[Dict]) -> str:
+    """One-line summary of applied fixes, e.g. "2 repositioned, 1 adopted\""""
+    counts = {}
+    for fix in fixes:
+        counts[fix['fix']] = counts.get(fix['fix'], 0) + 1
+    return ', '.join(f"{counts[name]} {name}" for name in ('repositioned', 'adopted') if name in counts)
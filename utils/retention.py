@@ -0,0 +1,116 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import time
+
+import extensions.boogaplus.utils.snapshot as snapshot
+
+"""
+Swipe retention.
+
+Every regeneration is cached forever by default, so chats with heavy regeneration keep growing. plan() applies the
+configured limits to a cache and returns the journal events that prune it, each with a record of what it removed:
+    {"fix": "pruned", "row": i, "type": t, "swipes": n, "chars": c}
+Limits (0 = unlimited):
+    MAX_SWIPES   swipes kept per message (the oldest go first)
+    MAX_BYTES    approximate size of a chat's swipes, counted in characters of their internal texts (the oldest go first,
+                 across the whole chat)
+    MAX_AGE      seconds after which a swipe is pruned (swipes cached before creation times were recorded are kept)
+The selected swipe of every message is always kept. Lengths of lazily loaded texts come from the snapshot header, so
+planning doesn't read them.
+"""
+
+MAX_SWIPES = 0
+MAX_BYTES = 0
+MAX_AGE = 0
+
+def configure(max_swipes: Optional[int] = None, max_bytes: Optional[int] = None, max_age: Optional[float] = None):
+    global MAX_SWIPES, MAX_BYTES, MAX_AGE
+    if max_swipes is not None:
+        MAX_SWIPES = max(0, int(max_swipes))
+    if max_bytes is not None:
+        MAX_BYTES = max(0, int(max_bytes))
+    if max_age is not None:
+        MAX_AGE = max(0, int(max_age))
+
+def enabled() -> bool:
+    return bool(MAX_SWIPES or MAX_BYTES or MAX_AGE)
+
+def _messages(history_cache: Dict, rows: Optional[Iterable[int]]):
+    """(row, msg_type, internal message cache) of every cached message, or only of `rows`"""
+    internal_rows = history_cache['internal']
+    for i in range(len(internal_rows)) if rows is None else rows:
+        row = internal_rows[i] if 0 <= i < len(internal_rows) else None
+        if not isinstance(row, list):
+            continue
+        for msg_type, msg in enumerate(row[:2]):
+            if msg and msg.get('text'):
+                yield i, msg_type, msg
+
+def plan(history_cache: Dict, rows: Optional[Iterable[int]] = None, now: Optional[float] = None, size_hint: Optional[int] = None) -> List[Tuple[Dict, Dict]]:
+    """(event, fix) pairs pruning `history_cache` down to the retention limits.
+    With `rows`, only those rows are checked against the per-message limits (the size limit always covers the whole chat).
+    With a `size_hint` (an upper bound of the chat's size) within MAX_BYTES, the size limit isn't checked."""
+    if not enabled():
+        return []
+    now = time.time() if now is None else now
+    dropped: Dict[Tuple[int, int], set] = {}
+
+    def drop(i: int, msg_type: int, pos: int):
+        dropped.setdefault((i, msg_type), set()).add(pos)
+
+    for i, msg_type, msg in _messages(history_cache, rows):
+        total = len(msg['text'])
+        selected = msg.get('pos', 0)
+        times = msg.get('time') or []
+        kept = list(range(total))
+        if MAX_AGE:
+            for pos in range(min(total, len(times))):
+                if pos != selected and times[pos] is not None and now - times[pos] > MAX_AGE:
+                    drop(i, msg_type, pos)
+            kept = [pos for pos in kept if pos not in dropped.get((i, msg_type), ())]
+        if MAX_SWIPES and len(kept) > MAX_SWIPES:
+            excess = len(kept) - MAX_SWIPES
+            for pos in kept:
+                if excess <= 0:
+                    break
+                if pos != selected:
+                    drop(i, msg_type, pos)
+                    excess -= 1
+
+    lengths: Dict[Tuple[int, int, int], int] = {}
+    if MAX_BYTES and (size_hint is None or size_hint > MAX_BYTES):
+        candidates = []
+        total_chars = 0
+        for i, msg_type, msg in _messages(history_cache, None):
+            texts = msg['text']
+            selected = msg.get('pos', 0)
+            times = msg.get('time') or []
+            gone = dropped.get((i, msg_type), ())
+            for pos in range(len(texts)):
+                length = lengths[i, msg_type, pos] = snapshot.text_length(texts, pos)
+                if pos in gone:
+                    continue
+                total_chars += length
+                if pos != selected:
+                    ts = times[pos] if pos < len(times) and times[pos] is not None else 0
+                    candidates.append((ts, i, pos, msg_type))
+        candidates.sort()  # Oldest first; swipes without a creation time count as the oldest
+        for ts, i, pos, msg_type in candidates:
+            if total_chars <= MAX_BYTES:
+                break
+            drop(i, msg_type, pos)
+            total_chars -= lengths[i, msg_type, pos]
+
+    fixes = []
+    internal_rows = history_cache['internal']
+    for (i, msg_type), gone in sorted(dropped.items()):
+        texts = internal_rows[i][msg_type]['text']
+        keep = [pos for pos in range(len(texts)) if pos not in gone]
+        chars = sum(lengths.get((i, msg_type, pos)) or snapshot.text_length(texts, pos) for pos in gone)
+        fixes.append(({'op': 'prune', 'i': i, 't': msg_type, 'k': keep}, {'fix': 'pruned', 'row': i, 'type': msg_type, 'swipes': len(gone), 'chars': chars}))
+    return fixes
+
+def describe(fixes: List[Dict]) -> str:
+    """One-line summary of pruned swipes, e.g. "12 swipes pruned (34567 chars)\""""
+    swipes = sum(fix['swipes'] for fix in fixes)
+    chars = sum(fix['chars'] for fix in fixes)
+    return f"{swipes} swipes pruned ({chars} chars)"
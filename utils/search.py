@@ -0,0 +1,373 @@
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import queue
+import re
+import sqlite3
+import threading
+import time
+import traceback
+
+import extensions.boogaplus.utils.cache as cache
+from extensions.boogaplus.utils.writer import writer
+import extensions.boogaplus.utils.metrics as metrics
+
+"""
+Full-text search over the swipes of every chat.
+
+An inverted index in its own SQLite database (logs/boogaplus-index.sqlite3, shared by every backend and process) maps
+each token of each swipe's internal text to (chat, row, msg_type, pos). It is fed by the cache writer (see
+CacheWriter.listen) with the journal events it persists, so it only covers what is on disk; renamed and deleted caches
+are followed the same way. The writer only queues these changes, and the index's own thread applies them, so writes
+never wait for the index. Chats cached before the index existed are indexed once by a background backfill
+(index_all), or as soon as they are written.
+
+A chat is reindexed from the store when its events don't tell what changed (the first write of a chat that isn't
+indexed, or a write on top of another process's changes). The store is read while writes are paused, and the queued
+changes it already holds are skipped when their turn comes (changes are numbered in the order they reached the store).
+
+Tokens are lowercased runs of word characters, MIN_TOKEN_LENGTH to MAX_TOKEN_LENGTH long. A query matches the swipes
+containing all of its tokens, most recently indexed chats first; the longest token drives the lookup (longer tokens
+tend to be rarer), and the others are checked with one primary key probe each.
+"""
+
+# Colour codes
+_ERROR = "\033[1;31m"
+_SUCCESS = "\033[1;32m"
+_GRAY = "\033[0;30m"
+_RESET = "\033[0m"
+
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 40
+MAX_QUERY_TOKENS = 8
+MAX_RESULTS = 500
+
+Key = Tuple[str, str, str]  # cache.make_key()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY,
+    character TEXT NOT NULL,
+    unique_id TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    indexed INTEGER NOT NULL DEFAULT 0,  -- 1 once every swipe of the chat is indexed
+    UNIQUE (character, unique_id, mode)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    msg_type INTEGER NOT NULL,
+    swipes INTEGER NOT NULL,  -- number of swipes, which is the position of the next one
+    PRIMARY KEY (chat_id, row, msg_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    msg_type INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    PRIMARY KEY (token, chat_id, row, msg_type, pos)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_by_message ON postings (chat_id, row, msg_type, pos);
+"""
+
+_TOKEN = re.compile(r'\w+')
+
+def tokenize(text) -> set:
+    """Distinct tokens of a text"""
+    if not isinstance(text, str):
+        return set()
+    return {token for token in _TOKEN.findall(text.lower()) if MIN_TOKEN_LENGTH <= len(token) <= MAX_TOKEN_LENGTH}
+
+class SearchIndex:
+    """Inverted index of swipe texts, kept up to date as a listener of the cache writer"""
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()  # One connection per thread
+        self._lock = threading.RLock()   # Serializes this process's index writes
+        self._queue: queue.Queue = queue.Queue()  # (number, method, args) of changes written to the store
+        self._queued = 0                 # Number of the last queued change
+        self._read: Dict[Key, int] = {}  # Chat -> number of the last change the store held when it was reindexed
+        self._thread: Optional[threading.Thread] = None
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # The index can be rebuilt from the caches
+        return conn
+
+    def _chat_id(self, conn: sqlite3.Connection, key: Key, create: bool = False) -> Optional[int]:
+        row = conn.execute('SELECT id FROM chats WHERE character = ? AND unique_id = ? AND mode = ?', key).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        return conn.execute('INSERT INTO chats (character, unique_id, mode) VALUES (?, ?, ?)', key).lastrowid
+
+    def _clear(self, conn: sqlite3.Connection, chat_id: int, row: int = 0):
+        conn.execute('DELETE FROM postings WHERE chat_id = ? AND row >= ?', (chat_id, row))
+        conn.execute('DELETE FROM messages WHERE chat_id = ? AND row >= ?', (chat_id, row))
+
+    def _add(self, conn: sqlite3.Connection, chat_id: int, i: int, msg_type: int, pos: int, text):
+        conn.executemany('INSERT OR IGNORE INTO postings (token, chat_id, row, msg_type, pos) VALUES (?, ?, ?, ?, ?)', [
+            (token, chat_id, i, msg_type, pos) for token in tokenize(text)
+        ])
+
+    def _apply(self, conn: sqlite3.Connection, chat_id: int, event: Dict):
+        op = event.get('op')
+        if op == 'truncate':
+            self._clear(conn, chat_id, event['n'])
+            return
+        if op not in ('swipe', 'prune'):  # Selections and links don't change any text
+            return
+        i, msg_type = event['i'], event['t']
+        row = conn.execute('SELECT swipes FROM messages WHERE chat_id = ? AND row = ? AND msg_type = ?', (chat_id, i, msg_type)).fetchone()
+        swipes = row[0] if row else 0
+        if op == 'swipe':
+            self._add(conn, chat_id, i, msg_type, swipes, event.get('n', event['v']))
+            swipes += 1
+        else:
+            keep = sorted(set(event['k']))
+            kept = set(keep)
+            conn.executemany('DELETE FROM postings WHERE chat_id = ? AND row = ? AND msg_type = ? AND pos = ?', [
+                (chat_id, i, msg_type, pos) for pos in range(swipes) if pos not in kept
+            ])
+            # Renumber in ascending order, so a posting only ever moves to a position that is already free
+            conn.executemany('UPDATE postings SET pos = ? WHERE chat_id = ? AND row = ? AND msg_type = ? AND pos = ?', [
+                (new_pos, chat_id, i, msg_type, pos) for new_pos, pos in enumerate(keep) if new_pos != pos
+            ])
+            swipes = len(keep)
+        conn.execute('INSERT OR REPLACE INTO messages (chat_id, row, msg_type, swipes) VALUES (?, ?, ?, ?)', (chat_id, i, msg_type, swipes))
+
+    @staticmethod
+    def _messages(history_cache: Dict) -> List[Tuple[int, int, List]]:
+        """(row, msg_type, texts) of every cached message (reads every text)"""
+        messages = []
+        for i, row in enumerate(history_cache['internal']):
+            if not isinstance(row, list):
+                continue
+            for msg_type, msg in enumerate(row[:2]):
+                texts = msg.get('text') if msg else None
+                if texts:
+                    messages.append((i, msg_type, list(texts)))
+        return messages
+
+    def _replace(self, key: Key, messages: List[Tuple[int, int, List]], read: Optional[int] = None):
+        """Replace everything indexed for a chat with `messages`, read from the store once change `read` reached it"""
+        with self._lock, self._connect() as conn:
+            chat_id = self._chat_id(conn, key, create=True)
+            self._clear(conn, chat_id)
+            for i, msg_type, texts in messages:
+                for pos, text in enumerate(texts):
+                    self._add(conn, chat_id, i, msg_type, pos, text)
+                conn.execute('INSERT INTO messages (chat_id, row, msg_type, swipes) VALUES (?, ?, ?, ?)', (chat_id, i, msg_type, len(texts)))
+            conn.execute('UPDATE chats SET indexed = 1 WHERE id = ?', (chat_id,))
+            if read is not None:
+                self._read[key] = max(read, self._read.get(key, 0))
+
+    def reindex(self, key: Key, history_cache: Dict):
+        """Replace everything indexed for a chat with the swipes of `history_cache`"""
+        self._replace(key, self._messages(history_cache))
+
+    def reindex_stored(self, key: Key, location) -> bool:
+        """Replace everything indexed for a chat with its stored swipes (on the index's thread, since changes queued
+        after the store was read must be applied after this). Returns False if it isn't stored"""
+        with writer.paused():  # Holds off writes, so the store matches the changes queued so far
+            if not cache.store.exists(location):
+                return False
+            read = self._queued
+            history_cache, _, _ = cache.store.load(location, track=False)  # A read-only copy
+            messages = self._messages(history_cache)
+        self._replace(key, messages, read)
+        return True
+
+    def is_indexed(self, key: Key) -> bool:
+        row = self._connect().execute('SELECT indexed FROM chats WHERE character = ? AND unique_id = ? AND mode = ?', key).fetchone()
+        return bool(row and row[0])
+
+    def remove(self, key: Key):
+        with self._lock, self._connect() as conn:
+            chat_id = self._chat_id(conn, key)
+            if chat_id is not None:
+                self._clear(conn, chat_id)
+                conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
+
+    def rename(self, old_key: Key, new_key: Key):
+        with self._lock, self._connect() as conn:
+            stale_id = self._chat_id(conn, new_key)
+            if stale_id is not None:  # Left over from a chat that was deleted without the index being told
+                self._clear(conn, stale_id)
+                conn.execute('DELETE FROM chats WHERE id = ?', (stale_id,))
+            conn.execute('UPDATE chats SET character = ?, unique_id = ?, mode = ? WHERE character = ? AND unique_id = ? AND mode = ?', (*new_key, *old_key))
+
+    # Cache writer listener (called under the writer's io lock, see CacheWriter.listen): changes are only queued
+    def _enqueue(self, method: str, *args):
+        self._queued += 1
+        self._queue.put((self._queued, method, args))
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='boogaplus-index-updates', daemon=True)
+            self._thread.start()
+
+    def written(self, location, events: Optional[List[Dict]]):
+        self._enqueue('_written', location, events)
+
+    def request_index(self, location):
+        """Queue indexing a stored chat that isn't indexed yet"""
+        with writer.paused():
+            self._enqueue('_index', location)
+
+    def moved(self, old_location, new_location):
+        self._enqueue('_moved', old_location, new_location)
+
+    def discarded(self, location):
+        self._enqueue('_discarded', location)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued change is indexed (up to `timeout` seconds). Returns whether it was"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            number, method, args = self._queue.get()
+            try:
+                getattr(self, method)(number, *args)
+            except Exception as e:
+                print(f"{_ERROR}Error updating the search index:{_RESET} {e}")
+                traceback.print_exc()
+            finally:
+                with self._lock:  # Reindexed chats whose skipped changes have all been seen
+                    for key in [key for key, read in self._read.items() if read <= number]:
+                        del self._read[key]
+                self._queue.task_done()
+
+    def _written(self, number: int, location, events: Optional[List[Dict]]):
+        key = cache.get_location_key(location)
+        if key is None:
+            return
+        with self._lock:
+            if number <= self._read.get(key, 0):  # Already read from the store by a reindex
+                return
+            if events is not None and self.is_indexed(key):
+                with self._connect() as conn:
+                    chat_id = self._chat_id(conn, key)
+                    for event in events:
+                        self._apply(conn, chat_id, event)
+                return
+        self.reindex_stored(key, location)  # The store holds more than these events
+
+    def _index(self, number: int, location):
+        key = cache.get_location_key(location)
+        if key is not None and not self.is_indexed(key):
+            self.reindex_stored(key, location)
+
+    def _moved(self, number: int, old_location, new_location):
+        old_key, new_key = cache.get_location_key(old_location), cache.get_location_key(new_location)
+        if old_key is not None and new_key is not None:
+            with self._lock:
+                self.rename(old_key, new_key)
+                if old_key in self._read:
+                    self._read[new_key] = self._read.pop(old_key)
+            if not self.is_indexed(new_key):  # Moved before a queued reindex could read it under its old name
+                self.reindex_stored(new_key, new_location)
+
+    def _discarded(self, number: int, location):
+        key = cache.get_location_key(location)
+        if key is not None:
+            with self._lock:
+                self.remove(key)
+                self._read.pop(key, None)
+
+    def search(self, query: str, limit: int = 50, character: Optional[str] = None) -> List[Dict]:
+        """Swipes containing every token of `query` (of one `character`'s chats if given), most recent chats first"""
+        tokens = sorted(tokenize(query), key=len, reverse=True)[:MAX_QUERY_TOKENS]
+        if not tokens:
+            return []
+        sql = ['SELECT c.character, c.unique_id, c.mode, p0.row, p0.msg_type, p0.pos FROM postings p0']
+        sql += [f'CROSS JOIN postings p{n}' for n in range(1, len(tokens))]  # CROSS JOIN keeps p0 as the driving table
+        sql.append('JOIN chats c ON c.id = p0.chat_id WHERE p0.token = ?')
+        args = [tokens[0]]
+        for n, token in enumerate(tokens[1:], 1):
+            sql.append(f'AND p{n}.token = ? AND p{n}.chat_id = p0.chat_id AND p{n}.row = p0.row AND p{n}.msg_type = p0.msg_type AND p{n}.pos = p0.pos')
+            args.append(token)
+        if character is not None:
+            sql.append('AND c.character = ?')
+            args.append(character)
+        sql.append('ORDER BY p0.chat_id DESC, p0.row DESC, p0.msg_type DESC, p0.pos DESC LIMIT ?')
+        args.append(max(0, min(int(limit), MAX_RESULTS)))
+        return [
+            {'character': hit[0], 'unique_id': hit[1], 'mode': hit[2], 'index': hit[3], 'type': hit[4], 'pos': hit[5]}
+            for hit in self._connect().execute(' '.join(sql), args)
+        ]
+
+    def stats(self) -> Dict:
+        conn = self._connect()
+        return {
+            'chats': conn.execute('SELECT COUNT(*) FROM chats WHERE indexed = 1').fetchone()[0],
+            'postings': conn.execute('SELECT COUNT(*) FROM postings').fetchone()[0],
+        }
+
+index: Optional[SearchIndex] = None
+_backfill: Optional[threading.Thread] = None
+
+def close(timeout: float = 5.0):
+    """Index the changes still queued (at exit)"""
+    if index is not None and not index.join(timeout):
+        print(f"{_ERROR}Search index updates still pending at exit; affected chats may be missing from results{_RESET}")
+
+def get_index_path() -> Path:
+    return cache.get_logs_dir() / 'boogaplus-index.sqlite3'
+
+def configure(enabled: bool = True) -> Optional[SearchIndex]:
+    """Open the index and start following the cache writer (the index can't be detached again, only left stale)"""
+    global index
+    if enabled and index is None:
+        try:
+            index = SearchIndex(get_index_path())
+        except Exception as e:
+            print(f"{_ERROR}Could not open the search index:{_RESET} {e}")
+            traceback.print_exc()
+            return None
+        writer.listen(index)
+    return index
+
+@metrics.timed('search')
+def search(query: str, limit: int = 50, character: Optional[str] = None) -> List[Dict]:
+    if index is None:
+        return []
+    return index.search(query, limit, character)
+
+def index_all() -> Optional[threading.Thread]:
+    """Index every stored chat that isn't indexed yet, in the background"""
+    global _backfill
+    if index is None or (_backfill is not None and _backfill.is_alive()):
+        return None
+    import extensions.boogaplus.utils.collector as collector
+
+    def run():
+        try:
+            start = time.perf_counter()
+            indexed = 0
+            for key, location, _ in collector.stored_caches(cache.get_logs_dir()):
+                if not index.is_indexed(key):
+                    index.request_index(location)
+                    index.join()  # One chat at a time, so the writer's changes don't queue up behind the backfill
+                    indexed += 1
+            if indexed:
+                print(f"{_SUCCESS}Indexed {indexed} chats for search in {time.perf_counter() - start:.1f}s{_RESET}")
+        except Exception as e:
+            print(f"{_ERROR}Search index backfill failed:{_RESET} {e}")
+            traceback.print_exc()
+
+    _backfill = threading.Thread(target=run, name='boogaplus-index', daemon=True)
+    _backfill.start()
+    return _backfill
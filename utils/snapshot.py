@@ -0,0 +1,398 @@
+from typing import IO, Callable, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections.abc import MutableSequence
+from contextlib import ExitStack, contextmanager
+from html import escape
+from pathlib import Path
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+import extensions.boogaplus.utils.pool as pool
+from extensions.boogaplus.utils.pool import StringPool, TextRef
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Colour codes
+_ERROR = "\033[1;31m"
+_SUCCESS = "\033[1;32m"
+_INPUT = "\033[0;33m"
+_GRAY = "\033[0;30m"
+_HILITE = "\033[0;36m"
+_BOLD = "\033[1;37m"
+_RESET = "\033[0m"
+
+# Text compression ('none', 'zlib' or 'zstd'); the codec is stored in the header, so this can be changed at any time
+COMPRESSION = 'none'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+"""
+Indexed snapshot format (format 3):
+    b'BGPL3\n'
+    b'{header length}\n'
+    {header JSON}   {"format": 3, "codec": codec, "pool": [[offset, length, text length, hash], ...], "visible": [...], "internal": [...]}
+    {text blobs}    every pooled text, individually encoded with `codec`, at `offset` from the end of the header
+
+"visible"/"internal" are the pooled message caches of utils/pool.py ({"ids": [...], "pos": n}), so positions and
+counts are known from the header alone, and texts are only read from disk (by seeking) when they are accessed.
+Text lengths (in characters) and hashes are stored too, so swipes can be summarized by reading only the start of their
+blob, and found by content (see find_text) without reading them at all.
+Texts that were never read are copied blob by blob into the next snapshot (see pool.TextRef), without being decoded
+unless the codec changed, and their readers are then pointed at the new file (see encode_rebasing).
+Older snapshots (pooled JSON, optionally compressed as a whole, or the legacy monolithic cache) are still read.
+"""
+
+MAGIC = b'BGPL3\n'
+
+def configure(compression: Optional[str] = None):
+    global COMPRESSION
+    if compression is not None:
+        if compression == 'zstd' and zstandard is None:
+            print(f"{_INPUT}zstandard is not installed, compressing caches with zlib instead{_RESET}")
+            compression = 'zlib'
+        COMPRESSION = compression
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data)
+    return data
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("cache is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    return data
+
+class SnapshotReplacedError(RuntimeError):
+    """A lazily read snapshot was replaced (by another process) before all of its texts were read"""
+
+def _identity(stat: os.stat_result) -> Tuple[int, int, int]:
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+class BlobReader:
+    """Reads pooled texts of an indexed snapshot on demand (the file is reopened per read unless opened() holds it, so it
+    can be replaced).
+    Reads check that the file is still the one the header was read from, since offsets are meaningless in another.
+    Text ids are those of the snapshot the reader was created for; once its texts were copied into a newer snapshot
+    (see retarget), they are translated to that snapshot's ids."""
+    def __init__(self, path: Path, base: int, offsets: List[List[int]], codec: str, string_pool: StringPool, identity: Optional[Tuple[int, int, int]] = None):
+        self.path = path
+        self.identity = identity
+        self.base = base
+        self.offsets = offsets
+        self.codec = codec
+        self.string_pool = string_pool
+        self.reads = 0
+        self._ids: Optional[Dict[int, int]] = None  # Text id -> id in the current file (None while it's the original)
+        self._texts: Dict[int, str] = {}
+        self._file: Optional[IO] = None  # Kept open by opened()
+        self._lock = threading.Lock()
+
+    def _entry(self, text_id: int) -> List:
+        return self.offsets[text_id if self._ids is None else self._ids[text_id]]
+
+    def _read(self, text_id: int, chars: Optional[int] = None) -> Tuple[bytes, str]:
+        """(blob of a text, only as much as its first `chars` characters need if it isn't compressed; its codec)"""
+        with self._lock, ExitStack() as stack:
+            f = self._file
+            if f is None:
+                f = stack.enter_context(self._open())
+            offset, length = self._entry(text_id)[:2]
+            if chars is not None and self.codec == 'none':
+                length = min(length, chars * 4)  # At most 4 bytes per character in UTF-8
+            f.seek(self.base + offset)
+            data = f.read(length)
+            self.reads += 1
+            return data, self.codec
+
+    def _open(self) -> IO:
+        f = open(self.path, 'rb')
+        if self.identity is not None and _identity(os.fstat(f.fileno())) != self.identity:
+            f.close()
+            raise SnapshotReplacedError(f"{self.path.name} was replaced while it was being read")
+        return f
+
+    @contextmanager
+    def opened(self) -> Iterator[None]:
+        """Keep the file open for the reads made meanwhile (e.g. while every text is read in turn), instead of reopening
+        it per read. The texts read are those of the file as it was opened, even if it's replaced in the meantime."""
+        with self._lock:
+            f = self._file = self._open()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._file is f:
+                    self._file = None
+            f.close()
+
+    def hash(self, text_id: int) -> Optional[str]:
+        """Stored hash of a text (None if escaped or not stored)"""
+        entry = self._entry(text_id) if text_id >= 0 else None
+        return entry[3] if entry is not None and len(entry) > 3 else None
+
+    def length(self, text_id: int) -> int:
+        """Length of a text in characters, from the header if stored"""
+        entry = self._entry(text_id) if text_id >= 0 and text_id not in self._texts else None
+        if entry is None or len(entry) < 3:
+            return len(self.get(text_id))
+        return entry[2]
+
+    def summary(self, text_id: int, n: int) -> Tuple[int, str]:
+        """(length, first `n` characters) of a text, reading as little of it as possible"""
+        entry = self._entry(text_id) if text_id >= 0 and text_id not in self._texts else None
+        if entry is None or len(entry) < 3:  # Escaped, already loaded or no stored length
+            text = self.get(text_id)
+            return len(text), text[:n]
+        text_length = entry[2]
+        data, codec = self._read(text_id, n)
+        if codec == 'zlib':
+            data = zlib.decompressobj().decompress(data, n * 4)
+        elif codec != 'none':
+            data = _decompress(data, codec)
+        return text_length, data.decode('utf-8', errors='ignore')[:n]
+
+    def get(self, text_id: int) -> str:
+        if text_id < 0:
+            return self.string_pool.intern(escape(self.get(~text_id)))
+        text = self._texts.get(text_id)
+        if text is None:
+            text = self._texts[text_id] = self.string_pool.intern(_decompress(*self._read(text_id)).decode('utf-8'))
+        return text
+
+    def copy(self, text_id: int, codec: str) -> Tuple[bytes, int, str]:
+        """(blob encoded with `codec`, length, hash) of a text, for another snapshot. The blob is copied as is if it
+        already uses `codec`; either way, the text isn't kept loaded."""
+        text = self._texts.get(text_id)
+        if text is None:
+            entry = self._entry(text_id)
+            blob, blob_codec = self._read(text_id)
+            if blob_codec == codec and len(entry) > 3:
+                return blob, entry[2], entry[3]
+            text = _decompress(blob, blob_codec).decode('utf-8')
+        return _compress(text.encode('utf-8'), codec), len(text), text_hash(text)
+
+    def retarget(self, path: Path, base: int, offsets: List[List[int]], codec: str, identity: Tuple[int, int, int], ids: Dict[int, int]):
+        """Read from a newer snapshot, into which this reader's texts were copied as `ids` (text id -> new id).
+        The caller holds the lock (see encode_rebasing)."""
+        self.path, self.base, self.offsets, self.codec, self.identity, self._ids = path, base, offsets, codec, identity, ids
+        self._file = None  # Reads open the new file
+
+class _Unloaded:
+    __slots__ = ('text_id',)
+    def __init__(self, text_id: int):
+        self.text_id = text_id
+
+class LazyTexts(MutableSequence):
+    """List of swipe texts whose entries are read from the snapshot the first time they are accessed"""
+    def __init__(self, reader: BlobReader, text_ids: Iterable[Optional[int]]):
+        self._reader = reader
+        self._items = [None if text_id is None else _Unloaded(text_id) for text_id in text_ids]
+
+    def _resolve(self, index: int):
+        item = self._items[index]
+        if isinstance(item, _Unloaded):
+            item = self._items[index] = self._reader.get(item.text_id)
+        return item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._resolve(i) for i in range(*index.indices(len(self._items)))]
+        return self._resolve(index)
+
+    def __setitem__(self, index, value):
+        self._items[index] = value
+
+    def __delitem__(self, index):
+        del self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+    def insert(self, index, value):
+        self._items.insert(index, value)
+
+    def __eq__(self, other):
+        return list(self) == list(other) if isinstance(other, (list, LazyTexts)) else NotImplemented
+
+    def __repr__(self):
+        return f"LazyTexts({len(self._items)} texts, {sum(isinstance(item, _Unloaded) for item in self._items)} unloaded)"
+
+    def loaded(self) -> int:
+        return sum(not isinstance(item, _Unloaded) for item in self._items)
+
+    def packable(self) -> List:
+        """Texts, with the unloaded ones as pool.TextRefs (see pool.pack)"""
+        return [TextRef(self._reader, item.text_id) if isinstance(item, _Unloaded) else item for item in self._items]
+
+    def summary(self, index: int, n: int) -> Tuple[int, str]:
+        """(length, first `n` characters) of a text, without loading it"""
+        item = self._items[index]
+        if isinstance(item, _Unloaded):
+            return self._reader.summary(item.text_id, n)
+        item = item or ''
+        return len(item), item[:n]
+
+    def length(self, index: int) -> int:
+        """Length of a text, without loading it"""
+        item = self._items[index]
+        if isinstance(item, _Unloaded):
+            return self._reader.length(item.text_id)
+        return len(item or '')
+
+    def find(self, text: str, hint: int = 0) -> int:
+        """Index of `text` (checking `hint` first), or -1. Unloaded texts are compared by stored hash, without reading them."""
+        digest = None
+        order = range(len(self._items))
+        if 0 <= hint < len(self._items):
+            order = [hint, *range(hint), *range(hint + 1, len(self._items))]
+        for index in order:
+            item = self._items[index]
+            if isinstance(item, _Unloaded):
+                stored = self._reader.hash(item.text_id)
+                if stored is not None:
+                    digest = digest or text_hash(text)
+                    if stored == digest:
+                        return index
+                    continue
+                item = self._resolve(index)
+            if item == text:
+                return index
+        return -1
+
+def find_text(texts, text: str, hint: int = 0) -> int:
+    """Index of `text` in `texts` (checking `hint` first), or -1, without loading lazily loaded texts"""
+    if isinstance(texts, LazyTexts):
+        return texts.find(text, hint)
+    if 0 <= hint < len(texts) and texts[hint] == text:
+        return hint
+    try:
+        return texts.index(text)
+    except ValueError:
+        return -1
+
+def summarize(texts, index: int, n: int) -> Tuple[int, str]:
+    """(length, first `n` characters) of `texts[index]`, without loading it if `texts` is lazy"""
+    if isinstance(texts, LazyTexts):
+        return texts.summary(index, n)
+    text = texts[index] or ''
+    return len(text), text[:n]
+
+def text_length(texts, index: int) -> int:
+    """Length of `texts[index]`, without loading it if `texts` is lazy"""
+    if isinstance(texts, LazyTexts):
+        return texts.length(index)
+    return len(texts[index] or '')
+
+@contextmanager
+def opened(history_cache: Dict) -> Iterator[None]:
+    """Keep the snapshot files of a cache's unloaded texts open meanwhile (see BlobReader.opened)"""
+    readers = {}
+    for cache_type in ['visible', 'internal']:
+        for row in history_cache.get(cache_type) or []:
+            for msg in row if isinstance(row, list) else []:
+                texts = msg.get('text') if isinstance(msg, dict) else None
+                if isinstance(texts, LazyTexts):
+                    readers[texts._reader] = None
+    with ExitStack() as stack:
+        for reader in readers:
+            stack.enter_context(reader.opened())
+        yield
+
+def encode_rebasing(packed: Dict) -> Tuple[bytes, Callable[[Path], ContextManager]]:
+    """Encode a pooled cache (see pool.pack) as an indexed snapshot. Texts still in a previous snapshot are copied from
+    it, so the second result must wrap replacing that snapshot with this one: `with rebase(path): <write to path>`
+    holds off reads from the old file meanwhile, and then points its readers at the new one."""
+    codec = COMPRESSION if COMPRESSION != 'zstd' or zstandard is not None else 'zlib'
+    offsets, blobs, offset = [], [], 0
+    sources: Dict[BlobReader, Dict[int, int]] = {}
+    for text_id, text in enumerate(packed['pool']):
+        if isinstance(text, TextRef):
+            blob, text_length, digest = text.source.copy(text.text_id, codec)
+            sources.setdefault(text.source, {})[text.text_id] = text_id
+        else:
+            blob, text_length, digest = _compress(text.encode('utf-8'), codec), len(text), text_hash(text)
+        offsets.append([offset, len(blob), text_length, digest])
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps({
+        'format': 3,
+        'codec': codec,
+        'pool': offsets,
+        'visible': packed['visible'],
+        'internal': packed['internal'],
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    prefix = MAGIC + str(len(header)).encode('ascii') + b'\n'
+
+    @contextmanager
+    def rebase(path: Path) -> Iterator[None]:
+        with ExitStack() as stack:
+            for source in sources:
+                stack.enter_context(source._lock)
+            yield
+            identity = _identity(os.stat(path))
+            for source, ids in sources.items():
+                source.retarget(path, len(prefix) + len(header), offsets, codec, identity, ids)
+
+    return b''.join([prefix, header, *blobs]), rebase
+
+def encode(packed: Dict) -> bytes:
+    """Encode a pooled cache (see pool.pack) as an indexed snapshot"""
+    return encode_rebasing(packed)[0]
+
+def _unpack_lazy(header: Dict, reader: BlobReader) -> Dict:
+    history_cache = {}
+    for cache_type in ['visible', 'internal']:
+        rows = []
+        for row in header[cache_type]:
+            if not isinstance(row, list):
+                rows.append(row)
+                continue
+            unpacked_row = []
+            for msg in row:
+                if not msg:
+                    unpacked_row.append(msg)
+                    continue
+                unpacked_msg = {key: value for key, value in msg.items() if key != 'ids'}
+                unpacked_msg['text'] = LazyTexts(reader, msg['ids'])
+                unpacked_row.append(unpacked_msg)
+            rows.append(unpacked_row)
+        history_cache[cache_type] = rows
+    return history_cache
+
+def read(path: Path, string_pool: StringPool) -> Optional[Dict]:
+    """Read a snapshot of any format. Indexed snapshots only have their header read; texts are loaded lazily."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            header_length = int(f.readline())
+            header = json.loads(f.read(header_length))
+            reader = BlobReader(path, f.tell(), header['pool'], header['codec'], string_pool, _identity(os.fstat(f.fileno())))
+            return _unpack_lazy(header, reader)
+        f.seek(0)
+        data = f.read()
+
+    # Older formats: (optionally compressed) JSON
+    if data.startswith(_ZSTD_MAGIC):
+        data = _decompress(data, 'zstd')
+    elif data[:1] == b'\x78':  # zlib header (JSON never starts with 'x')
+        data = _decompress(data, 'zlib')
+    if not data:
+        return None
+    history_cache = json.loads(data)
+    if pool.is_packed(history_cache):
+        history_cache, _ = pool.unpack(history_cache, string_pool)
+    elif history_cache:
+        pool.intern_cache(history_cache, string_pool)  # Legacy format
+    return history_cache
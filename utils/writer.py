@@ -0,0 +1,268 @@
+from typing import Any, Callable, Dict, List, Optional
+from contextlib import nullcontext
+from pathlib import Path
+import threading
+import time
+import traceback
+
+import extensions.boogaplus.utils.journal as journal
+import extensions.boogaplus.utils.metrics as metrics
+
+# Colour codes
+_ERROR = "\033[1;31m"
+_SUCCESS = "\033[1;32m"
+_INPUT = "\033[0;33m"
+_GRAY = "\033[0;30m"
+_HILITE = "\033[0;36m"
+_BOLD = "\033[1;37m"
+_RESET = "\033[0m"
+
+DEBOUNCE_SECONDS = 2.0  # Flush a dirty chat this long after its first pending mutation
+MAX_PENDING = 32        # ...or as soon as this many mutations are pending
+RETRY_SECONDS = 5.0     # Delay before a failed write is retried by the worker (flush() retries immediately)
+
+class _Job:
+    """Pending writes for a single cache file"""
+    def __init__(self, lock):
+        self.events: List[Dict] = []
+        self.snapshot: Optional[Callable[[], Any]] = None
+        self.lock = lock
+        self.mutations = 0
+        self.since = time.monotonic()
+        self.retry_at = 0.0  # Set when a write failed
+
+class CacheWriter:
+    """Background persistence worker, writing to `store` (utils/journal.py files by default, or utils/database.py).
+
+    Mutations are coalesced per cache file (dirty flag = a pending job) and written after `debounce` seconds or
+    `max_pending` mutations, whichever comes first. A pending snapshot supersedes all journal events queued before it;
+    they are only written instead if the store refuses the snapshot because another process changed the cache.
+    A job whose write fails is queued again (ahead of anything queued since), so nothing is lost while the store is
+    unavailable; the worker retries it after RETRY_SECONDS.
+
+    Lock order: io lock -> cache lock (passed by the caller) -> queue lock. Callers must enqueue while holding the cache
+    lock they pass in, so that a snapshot is always serialized consistently with the queued journal events.
+    Listeners (see listen) are notified under the io lock, in the order changes reach the store."""
+
+    def __init__(self, debounce: float = DEBOUNCE_SECONDS, max_pending: int = MAX_PENDING):
+        self.debounce = debounce
+        self.max_pending = max_pending
+        self.store = journal
+        self._pending: Dict[Path, _Job] = {}
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._listeners: List[Any] = []
+
+    def configure(self, debounce: Optional[float] = None, max_pending: Optional[int] = None, store=None):
+        if store is not None and store is not self.store:
+            self.flush()  # Pending changes belong to the old store
+            with self._io_lock:
+                self.store = store
+        with self._lock:
+            if debounce is not None:
+                self.debounce = max(0.0, float(debounce))
+            if max_pending is not None:
+                self.max_pending = max(1, int(max_pending))
+            self._wakeup.notify()
+
+    def listen(self, listener):
+        """Notify `listener` of every change that reaches the store:
+            listener.written(path, events)     events were written (None if the cache also holds another process's
+                                               changes, so it has to be read back from the store)
+            listener.moved(old_path, new_path) the cache was renamed
+            listener.discarded(path)           the cache is about to be deleted
+        Listeners are called under the io lock, which every write waits for, so they should only queue their work."""
+        with self._io_lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def paused(self):
+        """Lock holding off writes, so the store can be read in a state every listener was notified of"""
+        return self._io_lock
+
+    def _notify(self, method: str, *args):
+        for listener in self._listeners:
+            try:
+                getattr(listener, method)(*args)
+            except Exception as e:
+                print(f"{_ERROR}Error notifying {type(listener).__name__}.{method}:{_RESET} {e}")
+                traceback.print_exc()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="boogaplus-cache-writer", daemon=True)
+            self._thread.start()
+
+    def _job(self, path: Path, lock) -> _Job:
+        job = self._pending.get(path)
+        if job is None:
+            job = self._pending[path] = _Job(lock)
+        job.mutations += 1
+        if job.mutations >= self.max_pending:
+            self._wakeup.notify()
+        self._start()
+        return job
+
+    def append(self, path: Path, event: Dict, lock=None):
+        """Queue a journal event for `path`"""
+        with self._lock:
+            self._job(path, lock).events.append(event)
+
+    def snapshot(self, path: Path, serialize: Callable[[], Any], lock=None):
+        """Queue a snapshot of `path`; `serialize` is called under `lock` when the write happens and its result is
+        encoded and written outside of it"""
+        with self._lock:
+            job = self._job(path, lock)
+            job.snapshot = serialize  # Queued events are kept in case the snapshot is refused (see _write)
+
+    def is_dirty(self, path: Path) -> bool:
+        with self._lock:
+            return path in self._pending
+
+    def pending(self) -> int:
+        """Number of cache files with unwritten changes"""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, path: Optional[Path] = None, strict: bool = False) -> bool:
+        """Synchronously write pending changes for `path` (or for every file if None).
+        With `strict`, a snapshot the store refuses because another process changed the cache raises
+        journal.StaleCacheError (once the journal events queued with it, if any, were written in its place)."""
+        with self._lock:
+            paths = [path] if path is not None else list(self._pending)
+        success = True
+        for p in paths:
+            success = self._write(p, strict) and success
+        return success
+
+    def move(self, old_path: Path, new_path: Path, repoint: Optional[Callable[[], None]] = None):
+        """Rename the files of `old_path` to `new_path` (replacing anything there), carrying over its pending changes.
+        `repoint` is called once the files were moved, before any other write, to switch the cache over to `new_path`:
+        changes queued before it are carried over and changes queued after it go to `new_path` directly."""
+        with self._io_lock:
+            with self._lock:
+                self._pending.pop(new_path, None)  # Queued for the cache being replaced
+            self.store.rename(old_path, new_path)
+            if repoint is not None:
+                repoint()
+            with self._lock:
+                old_job = self._pending.pop(old_path, None)
+                if old_job is not None:
+                    new_job = self._pending.get(new_path)
+                    if new_job is None:
+                        self._pending[new_path] = old_job
+                    else:  # Writes were already queued under the new path since repointing
+                        if new_job.snapshot is None:
+                            new_job.snapshot = old_job.snapshot  # Serializes the same (current) data
+                        new_job.events[:0] = old_job.events
+                        new_job.mutations += old_job.mutations
+                        new_job.since = min(new_job.since, old_job.since)
+            self._notify('moved', old_path, new_path)
+
+    def discard(self, path: Path):
+        """Drop pending changes for `path` (e.g. before deleting it)"""
+        with self._io_lock:
+            with self._lock:
+                self._pending.pop(path, None)
+            self._notify('discarded', path)
+
+    def _requeue(self, path: Path, job: _Job):
+        """Put a job whose write failed back in front of the changes queued for `path` since it was taken"""
+        with self._lock:
+            job.retry_at = time.monotonic() + RETRY_SECONDS
+            newer = self._pending.get(path)
+            if newer is not None:
+                job.events.extend(newer.events)
+                if newer.snapshot is not None:
+                    job.snapshot = newer.snapshot  # Serializes the same (current) data
+                job.mutations += newer.mutations
+            self._pending[path] = job
+            self._wakeup.notify()
+
+    def stop(self):
+        """Flush everything and stop the worker"""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _write(self, path: Path, strict: bool = False) -> bool:
+        with self._io_lock:
+            with self._lock:
+                job = self._pending.get(path)
+            if job is None:
+                return True
+
+            # Take the job and serialize the snapshot under the cache lock so no mutation can slip in between
+            with job.lock or nullcontext():
+                with self._lock:
+                    job = self._pending.pop(path, None)
+                if job is None:
+                    return True
+                try:
+                    contents = job.snapshot() if job.snapshot else None
+                except Exception as e:
+                    print(f"{_ERROR}Error serializing cache:{_RESET} {e}")
+                    traceback.print_exc()
+                    self._requeue(path, job)
+                    return False
+
+            refused = None
+            try:
+                if contents is not None:
+                    try:
+                        metrics.inc('bytes_written', self.store.write_snapshot(path, contents))
+                        metrics.inc('snapshot_writes')
+                        self._notify('written', path, job.events)
+                        return True
+                    except journal.StaleCacheError as e:  # Keep the other process's changes, add ours on top
+                        print(f"{_INPUT}Not compacting cache ({e}), appending to its journal instead{_RESET}")
+                        metrics.inc('stale_snapshots')
+                        if job.events:
+                            metrics.inc('bytes_written', self.store.append_events(path, job.events))
+                            metrics.inc('journal_writes')
+                        self._notify('written', path, None)
+                        refused = e
+                elif job.events:
+                    metrics.inc('bytes_written', self.store.append_events(path, job.events))
+                    metrics.inc('journal_writes')
+                    self._notify('written', path, job.events)
+            except Exception as e:
+                print(f"{_ERROR}Error writing cache {path}:{_RESET} {e}")
+                traceback.print_exc()
+                self._requeue(path, job)
+                return False
+            if refused is not None and strict:
+                raise refused
+            return True
+
+    def _due(self) -> List[Path]:
+        now = time.monotonic()
+        return [
+            path for path, job in self._pending.items()
+            if now >= job.retry_at and (job.mutations >= self.max_pending or now - job.since >= self.debounce)
+        ]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                due = self._due()
+                while not due and not self._stopping:
+                    timeout = None
+                    if self._pending:
+                        wake = min(max(job.since + self.debounce, job.retry_at) for job in self._pending.values())
+                        timeout = max(0.0, wake - time.monotonic())
+                    self._wakeup.wait(timeout)
+                    due = self._due()
+                if self._stopping:
+                    return
+            for path in due:
+                self._write(path)
+
+writer = CacheWriter()